@@ -10,12 +10,12 @@ from dataactbroker.fileRoutes import add_file_routes
 from dataactbroker.handlers.accountHandler import AccountHandler
 from dataactbroker.handlers.aws.sesEmail import sesEmail
 from dataactbroker.handlers.aws.session import UserSessionInterface
+from dataactbroker.handlers.userCache import user_cache
 from dataactbroker.loginRoutes import add_login_routes
 from dataactbroker.userRoutes import add_user_routes
 from dataactcore.config import CONFIG_BROKER, CONFIG_SERVICES
 from dataactcore.interfaces.db import GlobalDB
 from dataactcore.logging import configure_logging
-from dataactcore.models.userModel import User
 from dataactcore.utils.jsonResponse import JsonResponse
 from dataactcore.utils.responseException import ResponseException
 from dataactcore.utils.statusCode import StatusCode
@@ -29,6 +29,7 @@ def createApp():
     app.config['LOCAL'] = local
     app.debug = CONFIG_SERVICES['debug']
     app.config['SYSTEM_EMAIL'] = CONFIG_BROKER['reply_to_email']
+    GlobalDB.configure('broker')
 
     # Future: Override config w/ environment variable, if set
     app.config.from_envvar('BROKER_SETTINGS', silent=True)
@@ -47,10 +48,10 @@ def createApp():
     JsonResponse.debugMode = app.debug
 
     if CONFIG_SERVICES['cross_origin_url'] ==  "*":
-        cors = CORS(app, supports_credentials=False, allow_headers = "*", expose_headers = "X-Session-Id")
+        cors = CORS(app, supports_credentials=False, allow_headers = "*", expose_headers = ["X-Session-Id", "ETag"])
     else:
         cors = CORS(app, supports_credentials=False, origins=CONFIG_SERVICES['cross_origin_url'],
-                    allow_headers = "*", expose_headers = "X-Session-Id")
+                    allow_headers = "*", expose_headers = ["X-Session-Id", "ETag"])
     # Enable DB session table handling
     app.session_interface = UserSessionInterface()
     # Set up bcrypt
@@ -62,12 +63,10 @@ def createApp():
 
     @app.before_request
     def before_request():
-        sess = GlobalDB.db().session
-        # setup user
+        # setup user, along with the affiliations used for permission checks
         g.user = None
         if session.get('name') is not None:
-            g.user = sess.query(User).filter_by(user_id=session['name']).\
-                one_or_none()
+            g.user = user_cache.load(session['name'])
 
     # Root will point to index.html
     @app.route("/", methods=["GET"])
@@ -6,7 +6,7 @@ from dataactbroker.exceptions.invalid_usage import InvalidUsage
 from dataactbroker.handlers.fileHandler import (
     FileHandler, get_error_metrics, get_status,
     list_submissions as list_submissions_handler,
-    narratives_for_submission, update_narratives
+    narratives_for_submission, update_narratives, wait_for_status
 )
 from dataactcore.interfaces.function_bag import get_submission_stats
 from dataactbroker.permissions import requires_login, requires_submission_perms
@@ -40,7 +40,14 @@ def add_file_routes(app, CreateCredentials, isLocal, serverPath):
     @convert_to_submission_id
     @requires_submission_perms('reader')
     def check_status(submission):
-        return get_status(submission)
+        return get_status(submission, request.if_none_match)
+
+    @app.route("/v1/wait_for_status/", methods = ["POST"])
+    @convert_to_submission_id
+    @requires_submission_perms('reader')
+    def wait_for_submission_status(submission):
+        """ Like check_status, but if the status matches If-None-Match, wait for a job to change status first """
+        return wait_for_status(submission, request.if_none_match)
 
     @app.route("/v1/submission_error_reports/", methods = ["POST"])
     @requires_login
@@ -96,7 +103,7 @@ def add_file_routes(app, CreateCredentials, isLocal, serverPath):
                 "Incorrect value specified for the 'certified' parameter. "
                 "Must be one of 'mixed', 'true', or 'false'")
 
-        return list_submissions_handler(page, limit, certified)
+        return list_submissions_handler(page, limit, certified, request.args.get('cursor'))
 
     @app.route("/v1/get_protected_files/", methods=["GET"])
     @requires_login
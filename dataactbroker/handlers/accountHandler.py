@@ -7,6 +7,7 @@ from flask import g
 
 from dataactbroker.handlers.aws.sesEmail import sesEmail
 from dataactbroker.handlers.aws.session import LoginSession
+from dataactbroker.handlers.userCache import user_cache
 from dataactcore.utils.jsonResponse import JsonResponse
 from dataactcore.utils.requestDictionary import RequestDictionary
 from dataactcore.utils.responseException import ResponseException
@@ -197,6 +198,7 @@ class AccountHandler:
             g.user.skip_guide = skip_guide == "true"
         except ResponseException as exc:
             return JsonResponse.error(exc, exc.status)
+        user_cache.invalidate_on_commit(g.user)
         sess.commit()
         return JsonResponse.create(
             StatusCode.OK,
@@ -301,6 +303,8 @@ def set_max_perms(user, max_group_list):
 
         user.affiliations = affiliations
         user.website_admin = False
+    # Don't authenticate later requests with the user's old permissions
+    user_cache.invalidate_on_commit(user)
 
 
 def json_for_user(user):
@@ -3,8 +3,7 @@ from uuid import uuid4
 from datetime import datetime, timedelta
 from flask.sessions import SessionInterface, SessionMixin
 from flask_login import _create_identifier
-from dataactcore.interfaces.db import GlobalDB
-from dataactcore.models.userModel import SessionMap
+from dataactbroker.handlers.aws.sessionStore import SessionStore
 
 
 class LoginSession:
@@ -74,17 +73,22 @@ class UserSession(dict, SessionMixin):
 class UserSessionInterface(SessionInterface):
     """
 
-    Class That implements the SessionInterface and uses SessionTable to store data
+    Class That implements the SessionInterface and uses a SessionStore to store data
 
-    """
+    Constants :
 
+    TIME_OUT_LIMIT -- (int) The limit used for the session
 
-    SESSSION_CLEAR_COUNT_LIMIT = 10
+    """
+    TIME_OUT_LIMIT = 604800
 
-    CountLimit = 1
+    def __init__(self, store=None):
+        """
+        arguments:
 
-    def __init__(self):
-        return
+        store -- (SessionStore) where sessions are kept, defaults to one built from the broker config
+        """
+        self.store = store or SessionStore.from_config()
 
     def open_session(self, app, request):
         """
@@ -97,12 +101,15 @@ class UserSessionInterface(SessionInterface):
         implements the open_session method that pulls or creates a new UserSession object
 
         """
+        # Expired sessions are removed in the background rather than while handling requests
+        self.store.start_sweeper()
         sid = request.headers.get("x-session-id")
-        if sid and SessionTable.doesSessionExist(sid):
-            if SessionTable.getTimeout(sid)> toUnixTime(datetime.utcnow()):
+        if sid:
+            stored = self.store.load(sid)
+            if stored is not None and stored.expiration > toUnixTime(datetime.utcnow()):
                 session_dict =  UserSession()
                 # Read data as json
-                data = loads(SessionTable.getData(sid))
+                data = loads(stored.data)
                 for key in data.keys():
                     session_dict[key] = data[key]
                 return session_dict
@@ -122,8 +129,8 @@ class UserSessionInterface(SessionInterface):
         request -- (Request)  the request object
         session -- (Session)  the session object
 
-        implements the save_session method that saves the session or clears it
-        based on the timeout limit, this function also extends the expiration time of the current session
+        implements the save_session method that saves the session, this function also extends the expiration time of
+        the current session. The store only rewrites sessions whose data changed.
 
         """
         if not session:
@@ -132,99 +139,19 @@ class UserSessionInterface(SessionInterface):
         if self.get_expiration_time(app, session):
             expiration = self.get_expiration_time(app, session)
         else:
-            if "session_check" in session and session["session_check"] and SessionTable.doesSessionExist(session["sid"]):
+            stored = None
+            if "session_check" in session and session["session_check"]:
+                stored = self.store.load(session["sid"])
+            if stored is not None:
                 # This is just a session check, don't extend expiration time
-                expiration = SessionTable.getTimeout(session["sid"])
+                expiration = stored.expiration
                 # Make sure next route call does not get counted as session check
                 session["session_check"] = False
             else:
-                expiration = datetime.utcnow() + timedelta(seconds=SessionTable.TIME_OUT_LIMIT)
+                expiration = datetime.utcnow() + timedelta(seconds=self.TIME_OUT_LIMIT)
         if not "_uid" in session:
             LoginSession.resetID(session)
-        SessionTable.newSession(session["sid"],session,expiration)
-        UserSessionInterface.CountLimit += 1
-        if UserSessionInterface.CountLimit % UserSessionInterface.SESSSION_CLEAR_COUNT_LIMIT == 0 :
-            SessionTable.clearSessions()
-            UserSessionInterface.CountLimit = 1
+        self.store.save(session["sid"], dumps(session, sort_keys=True), toUnixTime(expiration))
 
         # Return session ID as header x-session-id
         response.headers["x-session-id"] = session["sid"]
-
-class SessionTable :
-    """
-    Provides helper functions for session management
-
-    Constants :
-
-    TIME_OUT_LIMIT -- (int) The limit used for the session
-
-    """
-    TIME_OUT_LIMIT = 604800
-
-    @staticmethod
-    def clearSessions() :
-        """
-        Removes old sessions that are expired
-        """
-        newTime = toUnixTime(datetime.utcnow())
-        sess = GlobalDB.db().session
-        sess.query(SessionMap).filter(SessionMap.expiration < newTime).delete()
-        sess.commit()
-
-    @staticmethod
-    def doesSessionExist(uid) :
-        """
-        arguments:
-
-        uid -- (String) the uid
-        return (boolean) if the session
-        """
-        item = GlobalDB.db().session.query(SessionMap).filter_by(uid=uid).one_or_none()
-        if item is not None:
-            # session found
-            return True
-        else:
-            return False
-
-
-    @staticmethod
-    def getTimeout(uid) :
-        """
-        arguments:
-
-        uid -- (String) the uid
-        return (int) time when the session expires
-        """
-        return GlobalDB.db().session.query(SessionMap).filter_by(uid=uid).one().expiration
-
-    @staticmethod
-    def getData(uid) :
-        """
-        uid -- (String) the uid
-        return (Session) the session data
-        """
-        return GlobalDB.db().session.query(SessionMap).filter_by(uid=uid).one().data
-
-    @staticmethod
-    def newSession(uid,data,expiration) :
-        """ Updates current session or creates a new one if no session exists
-        arguments:
-
-        uid  -- (String) the session id
-        data -- (String) the data for the session
-        expiration -- (int) the time in seconds from 1970 when the session is no longer active
-
-        Updates the exsiting session or creates a new one
-        """
-        # Try converting session to json
-        sess = GlobalDB.db().session
-        user_session = sess.query(SessionMap).filter_by(uid=uid).one_or_none()
-        if user_session is None:
-            # No existing session found, create a new one
-            new_session = SessionMap(uid = uid, data = dumps(data), expiration = toUnixTime(expiration))
-            sess.add(new_session)
-        else:
-            # Modify existing session
-            user_session.data = dumps(data)
-            user_session.expiration = toUnixTime(expiration)
-        sess.commit()
@@ -0,0 +1,201 @@
+from collections import namedtuple
+from datetime import datetime
+import logging
+import threading
+import time
+
+from dataactcore.config import CONFIG_BROKER
+from dataactcore.interfaces.db import GlobalDB
+from dataactcore.models.userModel import SessionMap
+
+
+logger = logging.getLogger(__name__)
+
+# A session's JSON data and the unix time it expires
+StoredSession = namedtuple('StoredSession', ['data', 'expiration'])
+
+
+def unix_now():
+    """ Current time in seconds since 1970, as stored in session_map.expiration """
+    return (datetime.utcnow() - datetime(1970, 1, 1)).total_seconds()
+
+
+class DatabaseSessionBackend:
+    """ Keeps sessions in the session_map table, shared by every broker process """
+
+    def get(self, uid):
+        """ Returns the StoredSession for uid, or None if there isn't one """
+        row = GlobalDB.db().session.query(SessionMap.data, SessionMap.expiration).filter_by(uid=uid).first()
+        return StoredSession(row.data, row.expiration) if row else None
+
+    def put(self, uid, data, expiration):
+        """ Create or replace the session for uid """
+        sess = GlobalDB.db().session
+        updated = sess.query(SessionMap).filter_by(uid=uid).\
+            update({'data': data, 'expiration': expiration}, synchronize_session=False)
+        if not updated:
+            sess.add(SessionMap(uid=uid, data=data, expiration=expiration))
+        sess.commit()
+
+    def extend(self, expirations):
+        """ Set new expiration times for existing sessions
+
+        Args:
+            expirations: dict mapping uid to the session's new expiration
+        """
+        sess = GlobalDB.db().session
+        for uid, expiration in expirations.items():
+            sess.query(SessionMap).filter_by(uid=uid).\
+                update({'expiration': expiration}, synchronize_session=False)
+        sess.commit()
+
+    def delete_expired(self, now):
+        """ Remove sessions that expired before now """
+        sess = GlobalDB.db().session
+        sess.query(SessionMap).filter(SessionMap.expiration < now).delete(synchronize_session=False)
+        sess.commit()
+
+
+class MemorySessionBackend:
+    """ Keeps sessions in a dict. Only visible to one process, so meant for tests and local development """
+
+    def __init__(self):
+        self.sessions = {}
+
+    def get(self, uid):
+        return self.sessions.get(uid)
+
+    def put(self, uid, data, expiration):
+        self.sessions[uid] = StoredSession(data, expiration)
+
+    def extend(self, expirations):
+        for uid, expiration in expirations.items():
+            if uid in self.sessions:
+                self.sessions[uid] = self.sessions[uid]._replace(expiration=expiration)
+
+    def delete_expired(self, now):
+        for uid, stored in list(self.sessions.items()):
+            if stored.expiration < now:
+                del self.sessions[uid]
+
+
+SESSION_BACKENDS = {'database': DatabaseSessionBackend, 'memory': MemorySessionBackend}
+
+
+class SessionStore:
+    """ Process-local cache in front of a session backend
+
+    Sessions read within cache_ttl seconds of being cached are served without touching the backend. Saving a session
+    whose data hasn't changed doesn't rewrite it; a longer expiration is just noted and written to the backend in bulk
+    by the next sweep. The sweep, run by a background thread, also removes expired sessions.
+    """
+    CACHE_TTL = 10
+    SWEEP_INTERVAL = 300
+
+    def __init__(self, backend, cache_ttl=None, sweep_interval=None):
+        """
+        Args:
+            backend: where sessions are stored, e.g. a DatabaseSessionBackend
+            cache_ttl: seconds a session is served from the cache before being re-read from the backend
+            sweep_interval: seconds between sweeps by the background thread
+        """
+        self.backend = backend
+        self.cache_ttl = cache_ttl if cache_ttl is not None else self.CACHE_TTL
+        self.sweep_interval = sweep_interval or self.SWEEP_INTERVAL
+        # uid -> (StoredSession, time cached)
+        self.cache = {}
+        # uid -> expiration not yet written to the backend
+        self.pending_expirations = {}
+        self.lock = threading.Lock()
+        self.sweeper = None
+
+    @classmethod
+    def from_config(cls):
+        """ Build a store using the broker's session settings """
+        backend = SESSION_BACKENDS[CONFIG_BROKER.get('session_backend') or 'database']()
+        return cls(backend, CONFIG_BROKER.get('session_cache_ttl'), CONFIG_BROKER.get('session_sweep_interval'))
+
+    def load(self, uid):
+        """ Returns the StoredSession for uid, or None if there isn't one """
+        now = time.time()
+        with self.lock:
+            cached = self.cache.get(uid)
+            if cached and now - cached[1] < self.cache_ttl:
+                return cached[0]
+        stored = self.backend.get(uid)
+        if stored is None:
+            return None
+        with self.lock:
+            # An expiration waiting to be written is newer than the backend's
+            pending = self.pending_expirations.get(uid)
+            if pending is not None and pending > stored.expiration:
+                stored = stored._replace(expiration=pending)
+            self.cache[uid] = (stored, now)
+        return stored
+
+    def save(self, uid, data, expiration):
+        """ Store a session, writing to the backend only if its data changed
+
+        Args:
+            uid: session id
+            data: the session's JSON data
+            expiration: unix time the session expires
+        """
+        with self.lock:
+            cached = self.cache.get(uid)
+            if cached and cached[0].data == data:
+                if expiration != cached[0].expiration:
+                    self.cache[uid] = (cached[0]._replace(expiration=expiration), cached[1])
+                    self.pending_expirations[uid] = expiration
+                return
+        self.backend.put(uid, data, expiration)
+        with self.lock:
+            self.pending_expirations.pop(uid, None)
+            self.cache[uid] = (StoredSession(data, expiration), time.time())
+
+    def sweep(self):
+        """ Write pending expirations, remove expired sessions and drop stale cache entries """
+        now = time.time()
+        with self.lock:
+            pending, self.pending_expirations = self.pending_expirations, {}
+            for uid, (_, cached_at) in list(self.cache.items()):
+                if now - cached_at >= self.cache_ttl:
+                    del self.cache[uid]
+        if pending:
+            try:
+                self.backend.extend(pending)
+            except Exception:
+                # Keep them for the next sweep, unless a newer expiration has been noted since
+                with self.lock:
+                    for uid, expiration in pending.items():
+                        self.pending_expirations.setdefault(uid, expiration)
+                raise
+        self.backend.delete_expired(unix_now())
+
+    def start_sweeper(self):
+        """ Start the background thread that sweeps the store, if it isn't already running """
+        with self.lock:
+            if self.sweeper is None:
+                self.sweeper = SessionSweeper(self)
+                self.sweeper.start()
+
+
+class SessionSweeper(threading.Thread):
+    """ Daemon thread which sweeps a SessionStore every sweep_interval seconds """
+
+    def __init__(self, store):
+        super(SessionSweeper, self).__init__(name='session-sweeper', daemon=True)
+        self.store = store
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.store.sweep_interval):
+            try:
+                self.store.sweep()
+            except Exception:
+                logger.exception('Session sweep failed')
+            finally:
+                GlobalDB.close()
+
+    def stop(self):
+        self.stopped.set()
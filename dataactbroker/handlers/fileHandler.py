@@ -1,18 +1,21 @@
 import os
 from collections import namedtuple
-from csv import reader
+from contextlib import closing
 from datetime import datetime
+import json
 import logging
+import time
+from functools import partial
 from dateutil.relativedelta import relativedelta
 from uuid import uuid4
-from shutil import copyfile
 
 import requests
-from flask import g, request
+from flask import Response, g, request
 from requests.exceptions import Timeout
 import sqlalchemy as sa
 from sqlalchemy import func
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import aliased, joinedload
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
 from werkzeug.utils import secure_filename
 
@@ -23,11 +26,12 @@ from dataactcore.config import CONFIG_BROKER, CONFIG_SERVICES
 from dataactcore.interfaces.db import GlobalDB
 from dataactcore.models.errorModels import File
 from dataactcore.models.jobModels import (
-    FileGenerationTask, Job, Submission, SubmissionNarrative)
+    FileGenerationTask, Job, Submission, SubmissionNarrative, SubmissionStatusSnapshot)
 from dataactcore.models.userModel import User
 from dataactcore.models.lookups import (
     FILE_TYPE_DICT, FILE_TYPE_DICT_LETTER, FILE_TYPE_DICT_LETTER_ID,
     JOB_STATUS_DICT, JOB_TYPE_DICT, RULE_SEVERITY_DICT, FILE_TYPE_DICT_ID, JOB_STATUS_DICT_ID)
+from dataactcore.utils.jobNotifications import job_status_listener
 from dataactcore.utils.jobQueue import generate_e_file, generate_f_file
 from dataactcore.utils.jsonResponse import JsonResponse
 from dataactcore.utils.report import (get_report_path, get_cross_report_name,
@@ -38,13 +42,18 @@ from dataactcore.utils.statusCode import StatusCode
 from dataactcore.utils.stringCleaner import StringCleaner
 from dataactcore.interfaces.function_bag import (
     checkNumberOfErrorsByJobId, create_jobs, create_submission,
-    getErrorMetricsByJobId, getErrorType, get_submission_status,
-    mark_job_status, run_job_checks
+    derive_submission_status, dispatch_job, getErrorMetricsByJobId, getErrorType,
+    mark_job_status, reset_cross_file_jobs, run_job_checks
 )
-from dataactvalidator.filestreaming.csv_selection import write_csv
+from dataactvalidator.filestreaming.csv_selection import write_stream
 
 logger = logging.getLogger(__name__)
 
+# updated_at format used in list_submissions cursors
+SUBMISSION_CURSOR_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+# Seconds wait_for_status waits for a change by default
+STATUS_WAIT_TIMEOUT = 30
+
 
 class FileHandler:
     """ Responsible for all tasks relating to file upload
@@ -62,6 +71,8 @@ class FileHandler:
     VALIDATOR_RESPONSE_FILE = "validatorResponse"
     STATUS_MAP = {"waiting":"invalid", "ready":"invalid", "running":"waiting", "finished":"finished", "invalid":"failed", "failed":"failed"}
     VALIDATION_STATUS_MAP = {"waiting":"waiting", "ready":"waiting", "running":"waiting", "finished":"finished", "failed":"failed", "invalid":"failed"}
+    # Generated D files are copied to storage in pieces of this many bytes
+    DOWNLOAD_CHUNK_SIZE = 1024 ** 2
 
     UploadFile = namedtuple('UploadFile', ['file_type', 'upload_name', 'file_name', 'file_letter'])
 
@@ -545,10 +556,15 @@ class FileHandler:
             val_job.filename = upload_file_name
             val_job.original_filename = timestamped_name
             val_job.job_status_id = JOB_STATUS_DICT["waiting"]
+            # the new file's cross-file rules need checking again too
+            ready_job_ids = reset_cross_file_jobs(submission_id, [val_job.job_id])
             job.start_date = datetime.strptime(start_date,"%m/%d/%Y").date()
             job.end_date = datetime.strptime(end_date,"%m/%d/%Y").date()
             val_job.start_date = datetime.strptime(start_date,"%m/%d/%Y").date()
             val_job.end_date = datetime.strptime(end_date,"%m/%d/%Y").date()
+            sess.commit()
+            for job_id in ready_job_ids:
+                dispatch_job(job_id)
         except ValueError as e:
             # Date was not in expected format
             exc = ResponseException(str(e),StatusCode.CLIENT_ERROR,ValueError)
@@ -588,46 +604,31 @@ class FileHandler:
         else:
             self.complete_generation(task_key, file_type)
 
-    def download_file(self, local_file_path, file_url):
-        """ Download a file locally from the specified URL, returns True if successful """
+    def download_file(self, file_url, upload_name, timestamped_name):
+        """ Stream a file from the specified URL to S3, or locally, returns True if successful """
         if not self.isLocal:
-            with open(local_file_path, "w") as file:
-                # get request
-                response = requests.get(file_url)
+            with closing(requests.get(file_url, stream=True)) as response:
                 if response.status_code != 200:
                     # Could not download the file, return False
                     return False
-                # write to file
-                response.encoding = "utf-8"
-                file.write(response.text)
+                write_stream(timestamped_name, upload_name, False,
+                             response.iter_content(chunk_size=self.DOWNLOAD_CHUNK_SIZE))
                 return True
         elif not os.path.isfile(file_url):
             raise ResponseException('{} does not exist'.format(file_url),
                                     StatusCode.INTERNAL_ERROR)
-        elif not os.path.isdir(os.path.dirname(local_file_path)):
-            dirname = os.path.dirname(local_file_path)
-            raise ResponseException('{} folder does not exist'.format(dirname),
-                                    StatusCode.INTERNAL_ERROR)
         else:
-            copyfile(file_url, local_file_path)
+            with open(file_url, 'rb') as file:
+                write_stream(timestamped_name, upload_name, True,
+                             iter(partial(file.read, self.DOWNLOAD_CHUNK_SIZE), b''))
             return True
 
-    def get_lines_from_csv(self, file_path):
-        """ Retrieve all lines from specified CSV file """
-        lines = []
-        with open(file_path) as file:
-            for line in reader(file):
-                lines.append(line)
-        return lines
-
     def load_d_file(self, url, upload_name, timestamped_name, job_id, isLocal):
         """ Pull D file from specified URL and write to S3 """
         sess = GlobalDB.db().session
         try:
-            full_file_path = "".join([CONFIG_BROKER['d_file_storage_path'], timestamped_name])
-
             logger.debug('Downloading file...')
-            if not self.download_file(full_file_path, url):
+            if not self.download_file(url, upload_name, timestamped_name):
                 # Error occurred while downloading file, mark job as failed and record error message
                 mark_job_status(job_id, "failed")
                 job = sess.query(Job).filter_by(job_id = job_id).one()
@@ -641,9 +642,6 @@ class FileHandler:
                 job.error_message = "A problem occurred receiving data from {}".format(source)
 
                 raise ResponseException(job.error_message, StatusCode.CLIENT_ERROR)
-            lines = self.get_lines_from_csv(full_file_path)
-
-            write_csv(timestamped_name, upload_name, isLocal, lines[0], lines[1:])
 
             logger.debug('Marking job id of %s', job_id)
             mark_job_status(job_id, "finished")
@@ -1028,29 +1026,47 @@ def update_narratives(submission, narratives_json):
     return JsonResponse.create(StatusCode.OK, {})
 
 
-def get_status(submission):
-    """ Get description and status of all jobs in the submission specified in request object
+def get_status(submission, if_none_match=None):
+    """ Get description and status of all jobs in the submission specified in request object. The job details come from
+    the submission's status snapshot, which is only rebuilt after its jobs or files change.
+
+    Args:
+        submission: submission to get the status of
+        if_none_match: ETags from the request's If-None-Match header, if any
 
     Returns:
-        A flask response object to be sent back to client, holds a JSON where each job ID has a dictionary holding file_type, job_type, status, and filename
+        A flask response object to be sent back to client, holds a JSON where each job ID has a dictionary holding file_type, job_type, status, and filename.
+        If the status matches one of if_none_match, an empty 304 response instead. Either way, the status' ETag is set.
     """
     try:
         sess = GlobalDB.db().session
-
-        # Get jobs in this submission
-        jobs = sess.query(Job).filter_by(submission_id=submission.submission_id)
+        snapshot = get_status_snapshot(submission.submission_id)
+        # Submission level details are part of the response, so changes to them change the ETag too
+        etag = "{}-{}-{}".format(submission.submission_id, snapshot.version,
+                                 submission.updated_at.strftime("%Y%m%d%H%M%S%f"))
+        if if_none_match is not None and if_none_match.contains(etag):
+            response = Response(status=StatusCode.NOT_MODIFIED)
+            response.set_etag(etag)
+            return response
+
+        if snapshot.data is None:
+            status_data = build_status_snapshot(submission.submission_id)
+            # Only store it if nothing has changed since the snapshot was read
+            sess.query(SubmissionStatusSnapshot).\
+                filter_by(submission_id=submission.submission_id, version=snapshot.version).\
+                update({"data": json.dumps(status_data)}, synchronize_session=False)
+            sess.commit()
+        else:
+            status_data = json.loads(snapshot.data)
 
         # Build dictionary of submission info with info about each job
         submission_info = {}
-        submission_info["jobs"] = []
+        submission_info["jobs"] = status_data["jobs"]
         submission_info["cgac_code"] = submission.cgac_code
         submission_info["created_on"] = submission.datetime_utc.strftime('%m/%d/%Y')
         # Include number of errors in submission
         submission_info["number_of_errors"] = submission.number_of_errors
-        submission_info["number_of_rows"] = sess.query(
-            func.sum(Job.number_of_rows)).\
-            filter_by(submission_id=submission.submission_id).\
-            scalar() or 0
+        submission_info["number_of_rows"] = status_data["number_of_rows"]
         submission_info["last_updated"] = submission.updated_at.strftime("%Y-%m-%dT%H:%M:%S")
         # Format submission reporting date
         if submission.is_quarter_format:
@@ -1063,61 +1079,10 @@ def get_status(submission):
         # are always equal
         submission_info["reporting_period_start_date"] = submission_info["reporting_period_end_date"] = reporting_date
 
-        for job in jobs:
-            job_info = {}
-            job_type = job.job_type.name
-
-            if job_type != "csv_record_validation" and job_type != "validation":
-                continue
-
-            job_info["job_id"] = job.job_id
-            job_info["job_status"] = job.job_status.name
-            job_info["job_type"] = job_type
-            job_info["filename"] = job.original_filename
-            job_info["file_size"] = job.file_size
-            job_info["number_of_rows"] = job.number_of_rows
-            if job.file_type:
-                job_info["file_type"] = job.file_type.name
-            else:
-                job_info["file_type"] = ''
-
-            try:
-                file_results = sess.query(File).options(joinedload("file_status")).filter(File.job_id == job.job_id).one()
-                job_info["file_status"] = file_results.file_status.name
-            except NoResultFound:
-                # Job ID not in error database, probably did not make it to validation, or has not yet been validated
-                job_info["file_status"] = ""
-                job_info["missing_headers"] = []
-                job_info["duplicated_headers"] = []
-                job_info["error_type"] = ""
-                job_info["error_data"] = []
-                job_info["warning_data"] = []
-            else:
-                # If job ID was found in file, we should be able to get header error lists and file data
-                # Get string of missing headers and parse as a list
-                missing_header_string = file_results.headers_missing
-                if missing_header_string is not None:
-                    # Split header string into list, excluding empty strings
-                    job_info["missing_headers"] = [n.strip() for n in missing_header_string.split(",") if len(n) > 0]
-                else:
-                    job_info["missing_headers"] = []
-                # Get string of duplicated headers and parse as a list
-                duplicated_header_string = file_results.headers_duplicated
-                if duplicated_header_string is not None:
-                    # Split header string into list, excluding empty strings
-                    job_info["duplicated_headers"] = [n.strip() for n in duplicated_header_string.split(",") if len(n) > 0]
-                else:
-                    job_info["duplicated_headers"] = []
-                job_info["error_type"] = getErrorType(job.job_id)
-                job_info["error_data"] = getErrorMetricsByJobId(
-                    job.job_id, job_type=='validation', severity_id=RULE_SEVERITY_DICT['fatal'])
-                job_info["warning_data"] = getErrorMetricsByJobId(
-                    job.job_id, job_type=='validation', severity_id=RULE_SEVERITY_DICT['warning'])
-
-            submission_info["jobs"].append(job_info)
-
         # Build response object holding dictionary
-        return JsonResponse.create(StatusCode.OK,submission_info)
+        response = JsonResponse.create(StatusCode.OK, submission_info)
+        response.set_etag(etag)
+        return response
     except ResponseException as e:
         return JsonResponse.error(e,e.status)
     except Exception as e:
@@ -1125,6 +1090,125 @@ def get_status(submission):
         return JsonResponse.error(e,StatusCode.INTERNAL_ERROR)
 
 
+def wait_for_status(submission, if_none_match=None, timeout=None):
+    """ Long-polling version of get_status: if the submission's status still matches if_none_match, wait for one of
+    its jobs to change status, up to timeout seconds, before responding. No database connection is held while
+    waiting.
+
+    Args:
+        submission: submission to get the status of
+        if_none_match: ETags from the request's If-None-Match header, if any
+        timeout: longest to wait, in seconds. Defaults to the broker's status_wait_timeout setting
+
+    Returns:
+        The response from get_status, which is an empty 304 if nothing changed before timing out
+    """
+    if timeout is None:
+        timeout = CONFIG_BROKER.get('status_wait_timeout') or STATUS_WAIT_TIMEOUT
+    deadline = time.time() + timeout
+    submission_id = submission.submission_id
+    with job_status_listener.subscription(submission_id) as changed:
+        while True:
+            # Cleared before checking, so a change made after the check still wakes us
+            changed.clear()
+            response = get_status(submission, if_none_match)
+            remaining = deadline - time.time()
+            if response.status_code != StatusCode.NOT_MODIFIED or remaining <= 0:
+                return response
+            GlobalDB.close()
+            changed.wait(remaining)
+            submission = GlobalDB.db().session.query(Submission).filter_by(submission_id=submission_id).one()
+
+
+def get_status_snapshot(submission_id):
+    """ Get the submission's status snapshot, creating an empty one if it doesn't have one yet """
+    sess = GlobalDB.db().session
+    snapshot = sess.query(SubmissionStatusSnapshot).filter_by(submission_id=submission_id).one_or_none()
+    if snapshot is None:
+        sess.add(SubmissionStatusSnapshot(submission_id=submission_id, version=0))
+        try:
+            sess.commit()
+        except IntegrityError:
+            # Another request created it first
+            sess.rollback()
+        snapshot = sess.query(SubmissionStatusSnapshot).filter_by(submission_id=submission_id).one()
+    return snapshot
+
+
+def build_status_snapshot(submission_id):
+    """ Work out the job details reported by check_status for a submission
+
+    Returns:
+        dict holding the submission's total number_of_rows and details of each validation job
+    """
+    sess = GlobalDB.db().session
+
+    # Get jobs in this submission
+    jobs = sess.query(Job).filter_by(submission_id=submission_id)
+
+    status_data = {}
+    status_data["jobs"] = []
+    status_data["number_of_rows"] = sess.query(
+        func.sum(Job.number_of_rows)).\
+        filter_by(submission_id=submission_id).\
+        scalar() or 0
+
+    for job in jobs:
+        job_info = {}
+        job_type = job.job_type.name
+
+        if job_type != "csv_record_validation" and job_type != "validation":
+            continue
+
+        job_info["job_id"] = job.job_id
+        job_info["job_status"] = job.job_status.name
+        job_info["job_type"] = job_type
+        job_info["filename"] = job.original_filename
+        job_info["file_size"] = job.file_size
+        job_info["number_of_rows"] = job.number_of_rows
+        if job.file_type:
+            job_info["file_type"] = job.file_type.name
+        else:
+            job_info["file_type"] = ''
+
+        try:
+            file_results = sess.query(File).options(joinedload("file_status")).filter(File.job_id == job.job_id).one()
+            job_info["file_status"] = file_results.file_status.name
+        except NoResultFound:
+            # Job ID not in error database, probably did not make it to validation, or has not yet been validated
+            job_info["file_status"] = ""
+            job_info["missing_headers"] = []
+            job_info["duplicated_headers"] = []
+            job_info["error_type"] = ""
+            job_info["error_data"] = []
+            job_info["warning_data"] = []
+        else:
+            # If job ID was found in file, we should be able to get header error lists and file data
+            # Get string of missing headers and parse as a list
+            missing_header_string = file_results.headers_missing
+            if missing_header_string is not None:
+                # Split header string into list, excluding empty strings
+                job_info["missing_headers"] = [n.strip() for n in missing_header_string.split(",") if len(n) > 0]
+            else:
+                job_info["missing_headers"] = []
+            # Get string of duplicated headers and parse as a list
+            duplicated_header_string = file_results.headers_duplicated
+            if duplicated_header_string is not None:
+                # Split header string into list, excluding empty strings
+                job_info["duplicated_headers"] = [n.strip() for n in duplicated_header_string.split(",") if len(n) > 0]
+            else:
+                job_info["duplicated_headers"] = []
+            job_info["error_type"] = getErrorType(job.job_id)
+            job_info["error_data"] = getErrorMetricsByJobId(
+                job.job_id, job_type=='validation', severity_id=RULE_SEVERITY_DICT['fatal'])
+            job_info["warning_data"] = getErrorMetricsByJobId(
+                job.job_id, job_type=='validation', severity_id=RULE_SEVERITY_DICT['warning'])
+
+        status_data["jobs"].append(job_info)
+
+    return status_data
+
+
 def get_error_metrics(submission):
     """Returns an Http response object containing error information for every
     validation job in specified submission """
@@ -1147,9 +1231,14 @@ def get_error_metrics(submission):
         return JsonResponse.error(e,StatusCode.INTERNAL_ERROR)
 
 
-def list_submissions(page, limit, certified):
+def list_submissions(page, limit, certified, cursor=None):
     """ List submission based on current page and amount to display. If provided, filter based on
-    certification status """
+    certification status
+
+    Submissions are ordered newest first by (updated_at, submission_id). Rather than a page number, callers can pass
+    the next_cursor returned with the previous page, which seeks straight to the following page instead of skipping
+    over the earlier ones. The total is only counted when no cursor is given, as callers already have it by then.
+    """
     sess = GlobalDB.db().session
 
     offset = limit*(page-1)
@@ -1161,30 +1250,63 @@ def list_submissions(page, limit, certified):
                                     Submission.user_id == g.user.user_id))
     if certified != 'mixed':
         query = query.filter_by(publishable=certified)
-    submissions = query.order_by(Submission.updated_at.desc()).\
-            limit(limit).offset(offset)
 
-    return JsonResponse.create(StatusCode.OK, {
-        "submissions": [serialize_submission(s) for s in submissions],
-        "total": query.count()
-    })
+    page_query = query
+    if cursor is not None:
+        page_query = page_query.filter(
+            sa.tuple_(Submission.updated_at, Submission.submission_id) < decode_submission_cursor(cursor))
+    page_query = page_query.order_by(Submission.updated_at.desc(), Submission.submission_id.desc()).limit(limit)
+    if cursor is None:
+        page_query = page_query.offset(offset)
+
+    # Fetch the page along with each submission's user name, total file size and job status counts in one query
+    page_subquery = page_query.subquery()
+    page_submission = aliased(Submission, page_subquery)
+    counted_job = Job.job_type_id != JOB_TYPE_DICT['external_validation']
+    status_counts = [func.count(sa.case([(sa.and_(counted_job, Job.job_status_id == status_id), Job.job_id)]))
+                     for status_id in JOB_STATUS_DICT_ID]
+    rows = sess.query(page_submission, User.name, func.coalesce(func.sum(Job.file_size), 0), *status_counts).\
+        outerjoin(User, User.user_id == page_submission.user_id).\
+        outerjoin(Job, Job.submission_id == page_submission.submission_id).\
+        group_by(*(list(page_subquery.c) + [User.name])).\
+        order_by(page_submission.updated_at.desc(), page_submission.submission_id.desc()).all()
+
+    submissions = []
+    for submission, user_name, total_size, *counts in rows:
+        job_statuses = {JOB_STATUS_DICT_ID[status_id]: count for status_id, count in zip(JOB_STATUS_DICT_ID, counts)}
+        submissions.append(serialize_submission(submission, user_name, total_size,
+                                                derive_submission_status(submission, job_statuses)))
+
+    response = {
+        "submissions": submissions,
+        "next_cursor": encode_submission_cursor(rows[-1][0]) if len(rows) == limit else None
+    }
+    if cursor is None:
+        response["total"] = query.with_entities(func.count(Submission.submission_id)).scalar()
+    return JsonResponse.create(StatusCode.OK, response)
+
+
+def encode_submission_cursor(submission):
+    """Cursor pointing just after this submission in list_submissions' ordering"""
+    return "{}_{}".format(submission.updated_at.strftime(SUBMISSION_CURSOR_FORMAT), submission.submission_id)
 
 
-def serialize_submission(submission):
+def decode_submission_cursor(cursor):
+    """Convert a cursor from encode_submission_cursor back into an (updated_at, submission_id) tuple"""
+    try:
+        updated_at, submission_id = cursor.split("_")
+        return datetime.strptime(updated_at, SUBMISSION_CURSOR_FORMAT), int(submission_id)
+    except ValueError:
+        raise ResponseException("Invalid cursor", StatusCode.CLIENT_ERROR)
+
+
+def serialize_submission(submission, user_name, total_size, status):
     """Convert the provided submission into a dictionary in a schema the
     frontend expects"""
-    sess = GlobalDB.db().session
-    # @todo these should probably be part of the query rather than spawning n
-    # queries
-    total_size = sess.query(func.sum(Job.file_size)).\
-        filter_by(submission_id=submission.submission_id).\
-        scalar() or 0
-
-    status = get_submission_status(submission)
     if submission.user_id is None:
         submission_user_name = "No user"
     else:
-        submission_user_name = sess.query(User).filter_by(user_id=submission.user_id).one().name
+        submission_user_name = user_name
 
     return {
         "submission_id": submission.submission_id,
@@ -0,0 +1,97 @@
+import threading
+import time
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, joinedload
+
+from dataactcore.config import CONFIG_BROKER
+from dataactcore.interfaces.db import GlobalDB
+from dataactcore.models.userModel import User, UserAffiliation
+
+
+class UserCache:
+    """ Process-local cache of users, with their affiliations and agencies, so that authenticating a request doesn't
+    query them every time. Cached users aren't attached to any session; load() merges a copy into the current one.
+
+    Changes made through another process can take up to ttl seconds to be seen.
+    """
+    TTL = 30
+
+    def __init__(self, ttl=None):
+        """
+        Args:
+            ttl: seconds a user is served from the cache before being queried again
+        """
+        self.ttl = ttl if ttl is not None else self.TTL
+        # user_id -> (detached User or None, time cached)
+        self.users = {}
+        self.lock = threading.Lock()
+
+    def load(self, user_id):
+        """ Get a user, attached to the current session, without querying if they were loaded recently
+
+        Args:
+            user_id: ID of the user to load
+
+        Returns:
+            the User, with affiliations and their CGACs loaded, or None if there is no such user
+        """
+        now = time.time()
+        with self.lock:
+            cached = self.users.get(user_id)
+        if cached and now - cached[1] < self.ttl:
+            user = cached[0]
+        else:
+            user = query_user(user_id)
+            with self.lock:
+                self.users[user_id] = (user, now)
+        if user is None:
+            return None
+        # The cached instance is never modified, so copying it into the session doesn't need to check the database
+        return GlobalDB.db().session.merge(user, load=False)
+
+    def invalidate(self, user_id):
+        """ Drop a user whose details or permissions have changed, so they're queried again on the next load """
+        with self.lock:
+            self.users.pop(user_id, None)
+
+    def invalidate_on_commit(self, user):
+        """ Drop a user from the cache once the session they're being changed in commits. Invalidating any earlier
+        would let a concurrent request cache the old row again before the change is visible.
+
+        The permissions worked out for this user object are dropped straight away, so checks made later in the same
+        request see the change.
+
+        Args:
+            user: User whose details or permissions are being changed in the current session
+        """
+        vars(user).pop('_cgac_permissions', None)
+
+        def invalidate(session):
+            # the identity survives the commit expiring the user's attributes, and doesn't need a query
+            identity = inspect(user).identity
+            if identity is not None:
+                self.invalidate(identity[0])
+        event.listen(GlobalDB.db().session, 'after_commit', invalidate, once=True)
+
+
+def query_user(user_id):
+    """ Load a user, their affiliations and each affiliation's CGAC in one query. The result isn't attached to a
+    session, so it can be shared between requests.
+
+    Args:
+        user_id: ID of the user to load
+
+    Returns:
+        the detached User, or None if there is no such user
+    """
+    sess = Session(bind=GlobalDB.db().connection)
+    try:
+        return sess.query(User).\
+            options(joinedload(User.affiliations).joinedload(UserAffiliation.cgac)).\
+            filter_by(user_id=user_id).one_or_none()
+    finally:
+        sess.close()
+
+
+user_cache = UserCache(CONFIG_BROKER.get('user_cache_ttl'))
@@ -45,14 +45,21 @@ def current_user_can(permission, cgac_code):
     """Can the current user perform the act (described by the permission
     level) for the given cgac_code?"""
     admin = hasattr(g, 'user') and g.user.website_admin
-    has_affil = hasattr(g, 'user') and any(
-        aff.cgac.cgac_code == cgac_code
-        and aff.permission_type_id >= PERMISSION_TYPE_DICT[permission]
-        for aff in g.user.affiliations
-    )
+    has_affil = hasattr(g, 'user') and (
+        cgac_permissions(g.user).get(cgac_code, 0) >= PERMISSION_TYPE_DICT[permission])
     return admin or has_affil
 
 
+def cgac_permissions(user):
+    """The user's permission level for each cgac_code they're affiliated
+    with. Worked out once per user object, i.e. once per request, then reused
+    by every permission check"""
+    if '_cgac_permissions' not in vars(user):
+        user._cgac_permissions = {aff.cgac.cgac_code: aff.permission_type_id
+                                  for aff in user.affiliations}
+    return user._cgac_permissions
+
+
 def current_user_can_on_submission(perm, submission):
     """Submissions add another permission possibility: if a user created a
     submission, they can do anything to it, regardless of submission agency"""
@@ -1,3 +1,4 @@
+import hashlib
 import logging
 from datetime import datetime
 import boto
@@ -17,6 +18,7 @@ class s3UrlHandler:
     URL_LIFETIME = 2000
     STS_LIFETIME = 2000
     S3_ROLE = ""
+    HASH_CHUNK_SIZE = 1024 ** 2
 
     def __init__(self,name = None):
         """
@@ -109,6 +111,30 @@ class s3UrlHandler:
         else:
             return key.size
 
+    @staticmethod
+    def getFileHash(filename):
+        """ Returns the MD5 of specified file's contents, or None if file doesn't exist. For files uploaded in one part
+        this is the ETag S3 computed when it was uploaded, so the file isn't read again; a multipart upload's ETag
+        depends on its part size instead, so those files are read to hash them. """
+        try:
+            s3UrlHandler.REGION
+        except AttributeError as e:
+            s3UrlHandler.REGION = CONFIG_BROKER["aws_region"]
+        s3connection = boto.s3.connect_to_region(s3UrlHandler.REGION)
+        bucket = s3connection.get_bucket(CONFIG_BROKER['aws_bucket'])
+        key = bucket.get_key(filename)
+        if key is None:
+            logger.warning("File doesn't exist on AWS: %s", filename)
+            return None
+        etag = key.etag.strip('"')
+        if '-' not in etag:
+            return etag
+        file_hash = hashlib.md5()
+        for chunk in iter(lambda: key.read(s3UrlHandler.HASH_CHUNK_SIZE), b''):
+            file_hash.update(chunk)
+        key.close()
+        return file_hash.hexdigest()
+
     def getFileUrls(self, bucket_name, path):
         try:
             s3UrlHandler.REGION
@@ -1,5 +1,7 @@
 from collections import namedtuple
 import logging
+import os
+import threading
 import sqlalchemy
 import flask
 from sqlalchemy.orm import sessionmaker, scoped_session
@@ -8,29 +10,50 @@ from dataactcore.config import CONFIG_DB
 
 logger = logging.getLogger(__name__)
 
+# Pool settings used when the db config doesn't have an entry for this kind of process
+DEFAULT_POOL_SETTINGS = {'pool_size': 100, 'max_overflow': 50}
+# Keys in the db config's pool settings which are passed on to create_engine
+POOL_SETTING_KEYS = ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle')
+
 
 class _DB(namedtuple(
     '_DB', ['engine', 'connection', 'scoped_session_maker', 'session'])):
-    """Represents a database connection, from engine to session."""
+    """Represents a database connection, from engine to session. The engine
+    is shared by the whole process, so closing only returns the connection to
+    its pool."""
     def close(self):
         self.session.close()
         self.scoped_session_maker.remove()
         self.connection.close()
-        self.engine.dispose()
 
 
 class GlobalDB:
+    # Which pool settings from the db config to use, e.g. "broker"
+    process_type = None
+    # Per-thread holder for code running outside of a Flask app context
+    _local = threading.local()
+
+    @classmethod
+    def configure(cls, process_type):
+        """Choose the pool settings for engines created by this process.
+        Must be called before the first connection is made.
+
+        Args:
+            process_type: key in the db config's pool settings, e.g.
+                "broker", "validator" or "celery"
+        """
+        cls.process_type = process_type
+
     @classmethod
     def _holder(cls):
         """We generally want to work in the `g` context (i.e. per request),
-        but there are paths through the app which won't have access. In those
-        situations, fall back to the non-threadsafe static member approach"""
+        but there are paths through the app which won't have access (scripts,
+        celery tasks). In those situations, fall back to a per-thread
+        holder"""
         if flask.current_app:
             return flask.g
         else:
-            logger.warning("No current_app, falling back to non-threadsafe "
-                           "database connection")
-            return cls
+            return cls._local
 
     @classmethod
     def db(cls):
@@ -49,8 +72,43 @@ class GlobalDB:
             del holder._db
 
 
+class _EngineCache:
+    """One engine (and so one connection pool) per database URI, per
+    process. Engines aren't shared across a fork, so a forked child (e.g. a
+    celery worker) builds its own rather than reusing its parent's sockets."""
+    lock = threading.Lock()
+    engines = {}
+
+    @classmethod
+    def get(cls, uri):
+        key = (os.getpid(), uri)
+        with cls.lock:
+            if key not in cls.engines:
+                cls.engines[key] = sqlalchemy.create_engine(uri, **poolSettings())
+            return cls.engines[key]
+
+    @classmethod
+    def dispose(cls):
+        """Close all pooled connections for this process's engines"""
+        with cls.lock:
+            for (pid, uri) in list(cls.engines):
+                if pid == os.getpid():
+                    cls.engines.pop((pid, uri)).dispose()
+
+
+def poolSettings():
+    """Pool settings for this kind of process, from the db config's `pool`
+    section, falling back to DEFAULT_POOL_SETTINGS"""
+    settings = dict(DEFAULT_POOL_SETTINGS)
+    configured = (CONFIG_DB.get('pool') or {}).get(GlobalDB.process_type) or {}
+    settings.update({key: configured[key] for key in POOL_SETTING_KEYS
+                     if key in configured})
+    return settings
+
+
 def dbConnection():
-    """Use the config to set up a database engine and connection."""
+    """Use the config to set up a database connection and session, using the
+    process's engine for the configured database."""
     if not CONFIG_DB:
         raise ValueError("Database configuration is not defined")
 
@@ -59,13 +117,18 @@ def dbConnection():
         raise ValueError("Need dbName defined")
 
     # Create sqlalchemy connection and session
-    uri = dbURI(dbName)
-    engine = sqlalchemy.create_engine(uri, pool_size=100, max_overflow=50)
+    engine = _EngineCache.get(dbURI(dbName))
     connection = engine.connect()
     scoped_session_maker = scoped_session(sessionmaker(bind=engine))
     return _DB(engine, connection, scoped_session_maker, scoped_session_maker())
 
 
+def disposeEngines():
+    """Close all pooled connections held by this process, e.g. before
+    dropping a database"""
+    _EngineCache.dispose()
+
+
 def dbURI(dbName):
     uri = "postgresql://{username}:{password}@{host}:{port}/{}".format(
         dbName, **CONFIG_DB)
@@ -1,21 +1,29 @@
 from datetime import datetime
+import hashlib
+import json
 import logging
 from operator import attrgetter
+import os
 import time
 import uuid
 
-from sqlalchemy import func, or_
+from boto.exception import BotoClientError, BotoServerError
+from sqlalchemy import func, or_, select
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm.exc import NoResultFound
 
+from dataactcore.aws.s3UrlHandler import s3UrlHandler
+from dataactcore.config import CONFIG_BROKER, CONFIG_JOB_QUEUE
 from dataactcore.models.errorModels import ErrorMetadata, File
-from dataactcore.models.jobModels import Job, Submission, JobDependency
+from dataactcore.models.jobModels import (Job, Submission, JobDependency, SubmissionStatusSnapshot,
+                                          status_changed_statement)
 from dataactcore.models.stagingModels import AwardFinancial
 from dataactcore.models.userModel import User, UserStatus, EmailTemplateType, EmailTemplate
 from dataactcore.models.validationModels import RuleSeverity
-from dataactcore.models.lookups import (FILE_TYPE_DICT, FILE_STATUS_DICT, JOB_TYPE_DICT,
-                                        JOB_STATUS_DICT, FILE_TYPE_DICT_ID, PUBLISH_STATUS_DICT)
+from dataactcore.models.lookups import (FILE_TYPE, FILE_TYPE_DICT, FILE_STATUS_DICT, JOB_TYPE_DICT,
+                                        JOB_STATUS_DICT, JOB_STATUS_DICT_ID, FILE_TYPE_DICT_ID, PUBLISH_STATUS_DICT)
 from dataactcore.interfaces.db import GlobalDB
+from dataactcore.utils.report import get_cross_file_pairs
 from dataactvalidator.validation_handlers.validationError import ValidationError
 
 
@@ -32,6 +40,10 @@ logger = logging.getLogger(__name__)
 # todo: move these value to config if it is decided to keep local user login long term
 HASH_ROUNDS = 12
 
+# What's kept of a job's error metadata while its file is replaced, see stash_validation_results
+STASHED_ERROR_COLUMNS = ('filename', 'field_name', 'error_type_id', 'occurrences', 'first_row', 'rule_failed',
+                         'file_type_id', 'target_file_type_id', 'original_rule_label', 'severity_id')
+
 
 def createUserWithPassword(email, password, bcrypt, website_admin=False):
     """Convenience function to set up fully-baked user (used for setup/testing only)."""
@@ -59,28 +71,26 @@ def getPasswordHash(password, bcrypt):
 
 
 def populateSubmissionErrorInfo(submissionId):
-    """Set number of errors and warnings for submission."""
+    """Set number of errors and warnings for each of a submission's jobs, and for the submission as a whole, from a
+    single aggregate over error_metadata grouped by job and severity."""
     sess = GlobalDB.db().session
-    submission = sess.query(Submission).filter(Submission.submission_id == submissionId).one()
-    submission.number_of_errors = sumNumberOfErrorsForJobList(submissionId)
-    submission.number_of_warnings = sumNumberOfErrorsForJobList(submissionId, errorType='warning')
-    sess.commit()
-
+    totals = sess.query(ErrorMetadata.job_id, RuleSeverity.name, func.sum(ErrorMetadata.occurrences)).\
+        join(ErrorMetadata.severity).\
+        join(Job, Job.job_id == ErrorMetadata.job_id).\
+        filter(Job.submission_id == submissionId, RuleSeverity.name.in_(['fatal', 'warning'])).\
+        group_by(ErrorMetadata.job_id, RuleSeverity.name)
+    counts = {(job_id, severity): occurrences for job_id, severity, occurrences in totals}
 
-def sumNumberOfErrorsForJobList(submissionId, errorType='fatal'):
-    """Add number of errors for all jobs in list."""
-    sess = GlobalDB.db().session
-    errorSum = 0
-    jobs = sess.query(Job).filter(Job.submission_id == submissionId).all()
-    for job in jobs:
-        jobErrors = checkNumberOfErrorsByJobId(job.job_id, errorType)
-        if errorType == 'fatal':
-            job.number_of_errors = jobErrors
-        elif errorType == 'warning':
-            job.number_of_warnings = jobErrors
-        errorSum += jobErrors
+    submission = sess.query(Submission).filter(Submission.submission_id == submissionId).one()
+    submission.number_of_errors = 0
+    submission.number_of_warnings = 0
+    for job in sess.query(Job).filter(Job.submission_id == submissionId):
+        # jobs without errors or warnings of a severity won't have a row for it at all
+        job.number_of_errors = counts.get((job.job_id, 'fatal'), 0)
+        job.number_of_warnings = counts.get((job.job_id, 'warning'), 0)
+        submission.number_of_errors += job.number_of_errors
+        submission.number_of_warnings += job.number_of_warnings
     sess.commit()
-    return errorSum
 
 
 def checkNumberOfErrorsByJobId(jobId, errorType='fatal'):
@@ -177,6 +187,16 @@ def markFileComplete(job_id, filename=None):
     fileComplete.file_status_id = FILE_STATUS_DICT['complete']
     sess.commit()
 
+def markSubmissionStatusChanged(job_id):
+    """ Mark the status snapshot of the job's submission as out of date. Changes made through the ORM to jobs and
+    files do this automatically; this is for ones which aren't, e.g. bulk inserts of error metadata. Not committed.
+
+    Args:
+        job_id: ID of job in job tracker
+    """
+    sess = GlobalDB.db().session
+    sess.execute(status_changed_statement(select([Job.submission_id]).where(Job.job_id == job_id)))
+
 def getErrorMetricsByJobId(job_id, include_file_types=False, severity_id=None):
     """ Get error metrics for specified job, including number of errors for each field name and error type """
     sess = GlobalDB.db().session
@@ -312,7 +332,15 @@ def check_job_dependencies(job_id):
     dependencies = sess.query(JobDependency).filter_by(prerequisite_id = job_id).all()
     for dependency in dependencies:
         dep_job_id = dependency.job_id
-        if dependency.dependent_job.job_status_id != JOB_STATUS_DICT['waiting']:
+        dep_job = dependency.dependent_job
+        # job workers validate smaller files first. The size is looked up before the job is locked, as it may take a
+        # request to S3, and only for job workers, as the celery backend doesn't use it
+        record_size = CONFIG_JOB_QUEUE.get('backend', 'celery') == 'postgres' and \
+            dep_job.job_type_id == JOB_TYPE_DICT['csv_record_validation'] and dep_job.filename
+        file_size = get_file_size(dep_job.filename) if record_size else None
+        # lock the dependent job, so that if its last prerequisites finish at the same time, only one of them starts it
+        dep_job_status_id = sess.query(Job.job_status_id).filter_by(job_id=dep_job_id).with_for_update().scalar()
+        if dep_job_status_id != JOB_STATUS_DICT['waiting']:
             logger.error("%s (dependency of %s) is not in a 'waiting' state",
                 dep_job_id, job_id)
         else:
@@ -328,12 +356,87 @@ def check_job_dependencies(job_id):
                 # this job has no unfinished prerequisite jobs,
                 # so it is eligible to be set to a 'ready'
                 # status and added to the queue
+                if record_size:
+                    dep_job.file_size = file_size
                 mark_job_status(dep_job_id, 'ready')
-                # add to the job queue
-                logger.info('Sending job %s to job manager', dep_job_id)
-                # will move this later
-                from dataactcore.utils.jobQueue import enqueue
-                enqueue.delay(dep_job_id)
+                dispatch_job(dep_job_id)
+
+def dispatch_job(job_id):
+    """ Start a job which has been marked ready and committed: job workers poll the job table for ready jobs, so
+    this only needs to send it to the job manager on the celery backend
+
+    Args:
+        job_id: ID of the ready job
+    """
+    if CONFIG_JOB_QUEUE.get('backend', 'celery') == 'postgres':
+        logger.info('Job %s is ready for a job worker', job_id)
+        return
+    # add to the job queue
+    logger.info('Sending job %s to job manager', job_id)
+    # will move this later
+    from dataactcore.utils.jobQueue import enqueue
+    enqueue.delay(job_id)
+
+def get_file_size(filename):
+    """ Size of an uploaded file in bytes, or None if it can't be found
+
+    Args:
+        filename: the file's path, or its key in the broker's S3 bucket
+    """
+    try:
+        if CONFIG_BROKER['use_aws']:
+            return s3UrlHandler.getFileSize(filename) or None
+        return os.path.getsize(filename)
+    except (OSError, BotoClientError, BotoServerError):
+        logger.warning('Could not get the size of %s', filename, exc_info=True)
+        return None
+
+def get_file_hash(filename):
+    """ MD5 of an uploaded file's contents, or None if it can't be found. Files in S3 use the ETag S3 computed as
+    they were uploaded where that's their MD5, so aren't read again; other files are hashed as they're read.
+
+    Args:
+        filename: the file's path, or its key in the broker's S3 bucket
+    """
+    try:
+        if CONFIG_BROKER['use_aws']:
+            return s3UrlHandler.getFileHash(filename)
+        file_hash = hashlib.md5()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
+    except (OSError, BotoClientError, BotoServerError):
+        logger.warning('Could not get the hash of %s', filename, exc_info=True)
+        return None
+
+def stash_validation_results(job):
+    """ Set a validation job's row count and error metadata aside on the job, so they're no longer reported as the
+    file's, but can be restored if its replacement turns out to be the same file. Not committed.
+
+    Args:
+        job: the csv_record_validation job whose file is being replaced
+    """
+    sess = GlobalDB.db().session
+    errors = sess.query(ErrorMetadata).filter_by(job_id=job.job_id)
+    job.previous_results = json.dumps({
+        'number_of_rows': job.number_of_rows,
+        'errors': [{column: getattr(error, column) for column in STASHED_ERROR_COLUMNS} for error in errors]
+    })
+
+def restore_validation_results(job):
+    """ Restore the row count and error metadata stash_validation_results set aside, replacing any the job has.
+    Not committed.
+
+    Args:
+        job: the csv_record_validation job whose file was found to be unchanged
+    """
+    sess = GlobalDB.db().session
+    results = json.loads(job.previous_results)
+    job.number_of_rows = results['number_of_rows']
+    sess.query(ErrorMetadata).filter_by(job_id=job.job_id).delete(synchronize_session=False)
+    sess.add_all([ErrorMetadata(job_id=job.job_id, **error) for error in results['errors']])
+    job.previous_results = None
 
 def create_submission(user_id, submission_values, existing_submission):
     """ Create a new submission
@@ -375,6 +478,9 @@ def create_jobs(upload_files, submission, existing_submission=False):
     """
     sess = GlobalDB.db().session
     submission_id = submission.submission_id
+    if not existing_submission:
+        # check_status fills this in the first time it's called
+        sess.add(SubmissionStatusSnapshot(submission_id=submission_id))
 
     # create the file upload and single-file validation jobs and
     # set up the dependencies between them
@@ -382,6 +488,7 @@ def create_jobs(upload_files, submission, existing_submission=False):
     # to ensure that jobs dependent on the awards jobs being present
     # are processed last.
     jobs_required = []
+    validation_jobs = {}
     upload_dict= {}
     sorted_uploads = sorted(upload_files, key=attrgetter('file_letter'))
 
@@ -389,26 +496,15 @@ def create_jobs(upload_files, submission, existing_submission=False):
         validation_job_id, upload_job_id = add_jobs_for_uploaded_file(upload_file, submission_id, existing_submission)
         if validation_job_id:
             jobs_required.append(validation_job_id)
+            validation_jobs[FILE_TYPE_DICT[upload_file.file_type]] = validation_job_id
         upload_dict[upload_file.file_type] = upload_job_id
 
     # once single-file upload/validation jobs are created, create the cross-file
     # validation job and dependencies
     # todo: remove external validation jobs from the code-base--they aren't used
+    ready_job_ids = []
     if existing_submission:
-        # find cross-file and external validation jobs and mark them as waiting
-        # (note: job_type of 'validation' is a cross-file job)
-        val_job = sess.query(Job).\
-            filter_by(
-                submission_id = submission_id,
-                job_type_id = JOB_TYPE_DICT["validation"]).\
-            one()
-        val_job.job_status_id = JOB_STATUS_DICT["waiting"]
-        ext_job = sess.query(Job).\
-            filter_by(
-                submission_id = submission_id,
-                job_type_id = JOB_TYPE_DICT["external_validation"]).\
-            one()
-        ext_job.job_status_id = JOB_STATUS_DICT["waiting"]
+        ready_job_ids = reset_cross_file_jobs(submission_id, jobs_required)
         submission.updated_at = time.strftime("%c")
     else:
         # create cross-file validation job
@@ -430,11 +526,124 @@ def create_jobs(upload_files, submission, existing_submission=False):
             sess.add(val_dependency)
             ext_dependency = JobDependency(job_id=external_job.job_id, prerequisite_id=job_id)
             sess.add(ext_dependency)
+        create_cross_file_pair_jobs(submission_id, validation_jobs, validation_job.job_id)
 
     sess.commit()
+    for job_id in ready_job_ids:
+        dispatch_job(job_id)
     upload_dict["submission_id"] = submission_id
     return upload_dict
 
+def create_cross_file_pair_jobs(submission_id, validation_jobs, cross_file_job_id):
+    """ Create a job checking the cross-file rules between each pair of files, which starts as soon as both files
+    have been validated. The submission's cross-file job waits for all of them, then works out the submission's totals.
+    Not committed.
+
+    Args:
+        submission_id: submission to create the jobs in
+        validation_jobs: dict of file type ID to the ID of that file's csv_record_validation job
+        cross_file_job_id: ID of the submission's cross-file (validation) job
+    """
+    sess = GlobalDB.db().session
+    for first_file, second_file in get_cross_file_pairs():
+        if first_file.id not in validation_jobs or second_file.id not in validation_jobs:
+            continue
+        pair_job = Job(
+            job_status_id=JOB_STATUS_DICT['waiting'],
+            job_type_id=JOB_TYPE_DICT['cross_file_pair'],
+            file_type_id=first_file.id,
+            submission_id=submission_id)
+        sess.add(pair_job)
+        sess.flush()
+        sess.add_all([
+            JobDependency(job_id=pair_job.job_id, prerequisite_id=validation_jobs[first_file.id]),
+            JobDependency(job_id=pair_job.job_id, prerequisite_id=validation_jobs[second_file.id]),
+            JobDependency(job_id=cross_file_job_id, prerequisite_id=pair_job.job_id)
+        ])
+
+def reset_cross_file_jobs(submission_id, validation_job_ids):
+    """ Mark a submission's cross-file and external validation jobs as waiting when some of its files are replaced,
+    along with the cross-file pair jobs involving those files. Only the rules between changed files and the others are
+    checked again; errors and reports for pairs of unchanged files are kept. Not committed.
+
+    Args:
+        submission_id: submission the files are being replaced in
+        validation_job_ids: IDs of the csv_record_validation jobs for the replaced files
+
+    Returns:
+        IDs of jobs which are ready to run, to be passed to dispatch_job once committed
+    """
+    sess = GlobalDB.db().session
+    # (note: job_type of 'validation' is a cross-file job)
+    jobs = sess.query(Job).filter(Job.submission_id == submission_id,
+                                  Job.job_type_id.in_([JOB_TYPE_DICT['validation'],
+                                                       JOB_TYPE_DICT['external_validation']])).all()
+    ready_job_ids = []
+    for job in jobs:
+        checked = job.job_status_id == JOB_STATUS_DICT['finished']
+        job.job_status_id = JOB_STATUS_DICT['waiting']
+        if job.job_type_id == JOB_TYPE_DICT['validation']:
+            ready_job_ids.extend(reset_cross_file_pair_jobs(submission_id, validation_job_ids, job.job_id, checked))
+    return ready_job_ids
+
+def reset_cross_file_pair_jobs(submission_id, validation_job_ids, cross_file_job_id, checked=False):
+    """ Mark the cross-file pair jobs involving files which are being replaced as waiting, so they're checked again
+    once the new files are validated. Pairs between unchanged files are left as they are. Submissions created before
+    there were pair jobs get them: pairs of unchanged files which have been validated are finished if the submission's
+    cross-file job already checked them, and otherwise ready to run. Not committed.
+
+    Args:
+        submission_id: submission the files are being replaced in
+        validation_job_ids: IDs of the csv_record_validation jobs for the replaced files
+        cross_file_job_id: ID of the submission's cross-file (validation) job
+        checked: whether the submission's cross-file job had finished, checking every pair, before the files were
+            replaced
+
+    Returns:
+        IDs of the pair jobs which are ready to run
+    """
+    sess = GlobalDB.db().session
+    pair_jobs = sess.query(Job).filter_by(submission_id=submission_id, job_type_id=JOB_TYPE_DICT['cross_file_pair'])
+    if sess.query(pair_jobs.exists()).scalar():
+        changed_pairs = sess.query(JobDependency.job_id).filter(JobDependency.prerequisite_id.in_(validation_job_ids))
+        for pair_job in pair_jobs.filter(Job.job_id.in_(changed_pairs.subquery())):
+            pair_job.job_status_id = JOB_STATUS_DICT['waiting']
+        return []
+
+    validation_jobs = sess.query(Job.file_type_id, Job.job_id).\
+        filter_by(submission_id=submission_id, job_type_id=JOB_TYPE_DICT['csv_record_validation'])
+    create_cross_file_pair_jobs(submission_id, dict(validation_jobs), cross_file_job_id)
+    # nothing will finish to start a pair of unchanged files, so they have to be started here
+    ready_job_ids = []
+    for pair_job in pair_jobs:
+        prerequisites = sess.query(Job).join(JobDependency, JobDependency.prerequisite_id == Job.job_id).\
+            filter(JobDependency.job_id == pair_job.job_id)
+        if any(job.job_id in validation_job_ids or job.job_status_id != JOB_STATUS_DICT['finished']
+               for job in prerequisites):
+            continue
+        if checked:
+            pair_job.job_status_id = JOB_STATUS_DICT['finished']
+        else:
+            pair_job.job_status_id = JOB_STATUS_DICT['ready']
+            ready_job_ids.append(pair_job.job_id)
+    return ready_job_ids
+
+def get_cross_file_pair(job_id):
+    """ The two files a cross_file_pair job checks, in the order of get_cross_file_pairs
+
+    Args:
+        job_id: ID of the cross_file_pair job
+
+    Returns:
+        list of the two file types, as in lookups.FILE_TYPE
+    """
+    sess = GlobalDB.db().session
+    file_type_ids = {file_type_id for file_type_id, in sess.query(Job.file_type_id).
+                     join(JobDependency, JobDependency.prerequisite_id == Job.job_id).
+                     filter(JobDependency.job_id == job_id,
+                            Job.job_type_id == JOB_TYPE_DICT['csv_record_validation'])}
+    return sorted((file_type for file_type in FILE_TYPE if file_type.id in file_type_ids), key=attrgetter('order'))
+
 def add_jobs_for_uploaded_file(upload_file, submission_id, existing_submission):
     """ Add upload and validation jobs for a single filetype
 
@@ -500,6 +709,11 @@ def add_jobs_for_uploaded_file(upload_file, submission_id, existing_submission):
         val_job.job_status_id = JOB_STATUS_DICT['waiting']
         val_job.original_filename = upload_file.file_name
         val_job.filename = upload_file.upload_name
+        validation_job_id = val_job.job_id
+        if val_job.file_hash is not None and val_job.previous_results is None:
+            # keep the validated file's results aside in case the new file is identical to it (see
+            # ValidationManager.runValidation); if they're already set aside, it was never replaced by another
+            stash_validation_results(val_job)
         # reset file size and number of rows to be set during validation of new file
         val_job.file_size = None
         val_job.number_of_rows = None
@@ -509,6 +723,8 @@ def add_jobs_for_uploaded_file(upload_file, submission_id, existing_submission):
             delete(synchronize_session='fetch')
         # delete file error information that might exist from a previous run of this validation job
         sess.query(File).filter(File.job_id == val_job.job_id).delete(synchronize_session='fetch')
+        # bulk deletes don't trigger the mapper events that keep the status snapshot up to date
+        markSubmissionStatusChanged(val_job.job_id)
 
     else:
         # create a new record validation job and add dependencies if necessary
@@ -561,17 +777,23 @@ def get_submission_status(submission):
     """Return the status of a submission."""
     sess = GlobalDB.db().session
 
-    jobs = sess.query(Job).filter_by(submission_id=submission.submission_id)
-    status_names = JOB_STATUS_DICT.keys()
-    statuses = {name: 0 for name in status_names}
-    skip_count = 0
+    # external validation jobs don't count towards the submission's status
+    counts = sess.query(Job.job_status_id, func.count(Job.job_id)).\
+        filter(Job.submission_id == submission.submission_id,
+               Job.job_type_id != JOB_TYPE_DICT['external_validation']).\
+        group_by(Job.job_status_id)
+    return derive_submission_status(submission, {JOB_STATUS_DICT_ID[status_id]: count for status_id, count in counts})
 
-    for job in jobs:
-        if job.job_type.name not in ["external_validation", None]:
-            job_status = job.job_status.name
-            statuses[job_status] += 1
-        else:
-            skip_count += 1
+
+def derive_submission_status(submission, job_statuses):
+    """Return the status of a submission, given how many of its jobs (other than external validation jobs) are in
+    each job status.
+
+    Args:
+        submission: Submission to get the status of
+        job_statuses: dict mapping job status names to the number of the submission's jobs in that status
+    """
+    statuses = {name: job_statuses.get(name, 0) for name in JOB_STATUS_DICT}
 
     status = "unknown"
 
@@ -585,7 +807,7 @@ def get_submission_status(submission):
         status = "waiting"
     elif statuses["ready"] != 0:
         status = "ready"
-    elif statuses["finished"] == jobs.count() - skip_count:  # need to account for the jobs that were skipped above
+    elif statuses["finished"] == sum(statuses.values()):
         status = "validation_successful"
         if submission.number_of_warnings is not None and submission.number_of_warnings > 0:
             status = "validation_successful_warnings"
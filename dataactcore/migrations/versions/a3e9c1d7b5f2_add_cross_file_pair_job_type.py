@@ -0,0 +1,45 @@
+"""Add cross_file_pair job type
+
+Revision ID: a3e9c1d7b5f2
+Revises: 5f1470603fa0
+Create Date: 2017-01-12 10:41:37.208816
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a3e9c1d7b5f2'
+down_revision = '5f1470603fa0'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade(engine_name):
+    globals()["upgrade_%s" % engine_name]()
+
+
+def downgrade(engine_name):
+    globals()["downgrade_%s" % engine_name]()
+
+
+
+
+
+def upgrade_data_broker():
+    # setupJobTrackerDB inserts this too, but jobs can't be created with the type until it exists
+    op.execute("""
+        INSERT INTO job_type (job_type_id, name, description, created_at, updated_at)
+        SELECT 6, 'cross_file_pair', 'cross-file rules between two files must be checked', now(), now()
+        WHERE NOT EXISTS (SELECT 1 FROM job_type WHERE job_type_id = 6)
+    """)
+
+
+def downgrade_data_broker():
+    op.execute("""
+        DELETE FROM job_dependency WHERE job_id IN (SELECT job_id FROM job WHERE job_type_id = 6)
+            OR prerequisite_id IN (SELECT job_id FROM job WHERE job_type_id = 6)
+    """)
+    op.execute("DELETE FROM job WHERE job_type_id = 6")
+    op.execute("DELETE FROM job_type WHERE job_type_id = 6")
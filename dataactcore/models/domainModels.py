@@ -1,5 +1,5 @@
 from sqlalchemy import (
-    Column, Date, ForeignKey, Index, Integer, Numeric, Text, UniqueConstraint)
+    Boolean, Column, Date, DateTime, ForeignKey, Index, Integer, Numeric, Text, UniqueConstraint)
 from sqlalchemy.orm import relationship
 from dataactcore.models.baseModel import Base
 
@@ -121,3 +121,23 @@ Index("ix_pa_tas_pa",
       ProgramActivity.program_activity_code,
       ProgramActivity.program_activity_name,
       unique=True)
+
+class ExecutiveCompensation(Base):
+    """ An awardee's ultimate parent and top paid officers as looked up from SAM for file E, kept to save looking it up
+    again. Awardees SAM doesn't know are kept too, with in_sam false. """
+    __tablename__ = "executive_compensation"
+    duns = Column(Text, primary_key=True)
+    in_sam = Column(Boolean, nullable=False, default=True, server_default="True")
+    ultimate_parent_duns = Column(Text)
+    ultimate_parent_legal_name = Column(Text)
+    high_comp_officer1_full_name = Column(Text)
+    high_comp_officer1_amount = Column(Text)
+    high_comp_officer2_full_name = Column(Text)
+    high_comp_officer2_amount = Column(Text)
+    high_comp_officer3_full_name = Column(Text)
+    high_comp_officer3_amount = Column(Text)
+    high_comp_officer4_full_name = Column(Text)
+    high_comp_officer4_amount = Column(Text)
+    high_comp_officer5_full_name = Column(Text)
+    high_comp_officer5_amount = Column(Text)
+    fetched_at = Column(DateTime, nullable=False)
@@ -1,8 +1,9 @@
 """ These classes define the ORM models to be used by sqlalchemy for the error database """
 
-from sqlalchemy import Column, Integer, Text, ForeignKey
+from sqlalchemy import Column, Integer, Text, ForeignKey, event, select
 from sqlalchemy.orm import relationship
 from dataactcore.models.baseModel import Base
+from dataactcore.models.jobModels import Job, status_changed_statement
 
 
 class FileStatus(Base):
@@ -32,6 +33,15 @@ class File(Base):
     headers_missing = Column(Text, nullable=True)
     headers_duplicated = Column(Text, nullable=True)
 
+
+@event.listens_for(File, 'after_insert')
+@event.listens_for(File, 'after_update')
+@event.listens_for(File, 'after_delete')
+def file_changed(mapper, connection, target):
+    """ File status and header errors are part of the submission's status snapshot, so outdate it """
+    if target.job_id is not None:
+        connection.execute(status_changed_statement(select([Job.submission_id]).where(Job.job_id == target.job_id)))
+
 class ErrorMetadata(Base):
     __tablename__ = "error_metadata"
 
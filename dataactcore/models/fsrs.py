@@ -101,7 +101,8 @@ class FSRSProcurement(Base, _ContractAttributes, _PrimeAwardAttributes):
 class FSRSSubcontract(Base, _ContractAttributes):
     __tablename__ = "fsrs_subcontract"
     parent_id = Column(
-        Integer, ForeignKey('fsrs_procurement.id', ondelete='CASCADE'))
+        Integer, ForeignKey('fsrs_procurement.id', ondelete='CASCADE'),
+        index=True)
     parent = relationship(FSRSProcurement, back_populates='subawards')
     subcontract_amount = Column(String)
     subcontract_date = Column(Date)
@@ -123,7 +124,8 @@ class FSRSGrant(Base, _GrantAttributes, _PrimeAwardAttributes):
 class FSRSSubgrant(Base, _GrantAttributes):
     __tablename__ = "fsrs_subgrant"
     parent_id = Column(
-        Integer, ForeignKey('fsrs_grant.id', ondelete='CASCADE'))
+        Integer, ForeignKey('fsrs_grant.id', ondelete='CASCADE'),
+        index=True)
     parent = relationship(FSRSGrant, back_populates='subawards')
     subaward_amount = Column(String)
     subaward_date = Column(Date)
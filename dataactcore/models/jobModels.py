@@ -1,10 +1,12 @@
 """ These classes define the ORM models to be used by sqlalchemy for the job tracker database """
+import json
 
 from sqlalchemy import (
     Boolean, Column, Date, DateTime, ForeignKey, Integer, Text,
-    UniqueConstraint) 
+    UniqueConstraint, event, func, inspect, select)
 from sqlalchemy.orm import relationship
 from dataactcore.models.baseModel import Base
+from dataactcore.models.lookups import JOB_STATUS_DICT_ID
 
 
 def generateFiscalYear(context):
@@ -71,7 +73,7 @@ class Job(Base):
 
     job_id = Column(Integer, primary_key=True)
     filename = Column(Text, nullable=True)
-    job_status_id = Column(Integer, ForeignKey("job_status.job_status_id", name="fk_job_status_id"))
+    job_status_id = Column(Integer, ForeignKey("job_status.job_status_id", name="fk_job_status_id"), index=True)
     job_status = relationship("JobStatus", uselist=False, lazy='joined')
     job_type_id = Column(Integer, ForeignKey("job_type.job_type_id", name="fk_job_type_id"))
     job_type = relationship("JobType", uselist=False, lazy='joined')
@@ -89,6 +91,17 @@ class Job(Base):
     start_date = Column(Date)
     end_date = Column(Date)
     user_id = Column(Integer, ForeignKey("users.user_id", ondelete="SET NULL", name="fk_job_user"), nullable=True)
+    # Set while a job worker is running the job, see dataactvalidator.jobWorker
+    worker_id = Column(Text, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    worker_attempts = Column(Integer, nullable=False, default=0, server_default='0')
+    # Content hash of the file and version of the rules and domain data it last passed validation with, so an
+    # identical re-upload can keep its results, see ValidationManager.runValidation
+    file_hash = Column(Text, nullable=True)
+    validation_version = Column(Text, nullable=True)
+    # JSON of the row count and error metadata from that validation while the file is being replaced, see
+    # function_bag.stash_validation_results
+    previous_results = Column(Text, nullable=True)
 
 class JobDependency(Base):
     __tablename__ = "job_dependency"
@@ -139,3 +152,52 @@ class SubmissionNarrative(Base):
         UniqueConstraint('submission_id', 'file_type_id',
                          name='uniq_submission_file_type'),
     )
+
+
+# Postgres channel job status changes are announced on; see dataactcore.utils.jobNotifications
+JOB_STATUS_CHANNEL = 'job_status'
+
+
+class SubmissionStatusSnapshot(Base):
+    """ What check_status reports about a submission's jobs, kept so that polling doesn't rebuild it every time.
+    Any change to the submission's jobs or files increments version and clears data, so it's rebuilt on the next
+    read """
+    __tablename__ = "submission_status_snapshot"
+
+    submission_id = Column(Integer, ForeignKey("submission.submission_id", ondelete="CASCADE",
+                                               name="fk_status_snapshot_submission_id"), primary_key=True)
+    version = Column(Integer, nullable=False, default=0, server_default='0')
+    # JSON, None until built for the current version
+    data = Column(Text)
+
+
+def status_changed_statement(submission_ids):
+    """ UPDATE statement marking the status snapshots of the given submissions as out of date
+
+    Args:
+        submission_ids: list of submission IDs, or a select of them
+    """
+    table = SubmissionStatusSnapshot.__table__
+    return table.update().where(table.c.submission_id.in_(submission_ids)).\
+        values(version=table.c.version + 1, data=None)
+
+
+@event.listens_for(Job, 'after_insert')
+@event.listens_for(Job, 'after_update')
+@event.listens_for(Job, 'after_delete')
+def job_changed(mapper, connection, target):
+    """ Outdate the submission's status snapshot whenever one of its jobs is written """
+    if target.submission_id is not None:
+        connection.execute(status_changed_statement([target.submission_id]))
+
+
+@event.listens_for(Job, 'after_insert')
+@event.listens_for(Job, 'after_update')
+def job_status_changed(mapper, connection, target):
+    """ Let clients waiting on the submission know whenever a job's status is written, however it's changed """
+    attrs = inspect(target).attrs
+    if attrs.job_status_id.history.has_changes() or attrs.job_status.history.has_changes():
+        payload = json.dumps({'submission_id': target.submission_id, 'job_id': target.job_id,
+                              'status': JOB_STATUS_DICT_ID.get(target.job_status_id)})
+        # Postgres only delivers this once the transaction commits, so nothing is sent for a rolled back change
+        connection.execute(select([func.pg_notify(JOB_STATUS_CHANNEL, payload)]))
@@ -49,7 +49,8 @@ JOB_TYPE = [
     LookupType(2, 'csv_record_validation', 'do record level validation and add to staging table'),
     LookupType(3, 'db_transfer', 'information must be moved from production DB to staging table'),
     LookupType(4, 'validation', 'new information must be validated'),
-    LookupType(5, 'external_validation', 'new information must be validated against external sources')
+    LookupType(5, 'external_validation', 'new information must be validated against external sources'),
+    LookupType(6, 'cross_file_pair', 'cross-file rules between two files must be checked')
 ]
 JOB_TYPE_DICT = {item.name: item.id for item in JOB_TYPE}
 
@@ -1,14 +1,37 @@
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 import logging
 from operator import attrgetter
+import threading
 
+from sqlalchemy.exc import IntegrityError
 from suds.client import Client
 
 from dataactcore.config import CONFIG_BROKER
+from dataactcore.interfaces.db import GlobalDB
+from dataactcore.models.domainModels import ExecutiveCompensation
 
 
 logger = logging.getLogger(__name__)
 
+# DUNS numbers to look up per request to SAM
+CHUNK_SIZE = 100
+# Requests to SAM to have in flight at once, if not set in the config
+DEFAULT_WORKERS = 8
+# Seconds to use what SAM returned for a DUNS number before looking it up
+# again, if not set in the config
+DEFAULT_CACHE_TTL = 7 * 24 * 60 * 60
+# DUNS numbers to read or replace in the cache per query
+CACHE_QUERY_SIZE = 1000
+
+# Each thread's SAM SOAP clients, by WSDL URL
+_thread_clients = threading.local()
+# Threads looking up chunks of DUNS numbers, kept for the life of the process
+# so their clients are reused from one file to the next
+_executor = None
+_executor_lock = threading.Lock()
+
 
 def configValid():
     """Does the config have the necessary bits for talking to the SAM SOAP
@@ -20,6 +43,31 @@ def configValid():
     return hasWsdl and hasUser and hasPass
 
 
+def getClient():
+    """The SAM SOAP client for this thread, created the first time it's needed
+    so the WSDL is only fetched and parsed once per thread. Suds clients can't
+    be shared between threads"""
+    wsdl = CONFIG_BROKER['sam']['wsdl']
+    clients = getattr(_thread_clients, 'clients', None)
+    if clients is None:
+        clients = _thread_clients.clients = {}
+    if wsdl not in clients:
+        clients[wsdl] = Client(wsdl)
+    return clients[wsdl]
+
+
+def getExecutor():
+    """The pool of threads to send requests to SAM from, at most `workers`
+    (from the sam config) at once"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            sam = CONFIG_BROKER.get('sam') or {}
+            _executor = ThreadPoolExecutor(
+                max_workers=sam.get('workers') or DEFAULT_WORKERS)
+        return _executor
+
+
 def createAuth(client):
     auth = client.factory.create('userAuthenticationKeyType')
     auth.userID = CONFIG_BROKER['sam']['username']
@@ -69,6 +117,23 @@ Row = namedtuple('Row', (
     'HighCompOfficer5Amount'))
 
 
+# ExecutiveCompensation columns holding each of the Row fields, in order
+CACHE_COLUMNS = (
+    'duns',
+    'ultimate_parent_duns',
+    'ultimate_parent_legal_name',
+    'high_comp_officer1_full_name',
+    'high_comp_officer1_amount',
+    'high_comp_officer2_full_name',
+    'high_comp_officer2_amount',
+    'high_comp_officer3_full_name',
+    'high_comp_officer3_amount',
+    'high_comp_officer4_full_name',
+    'high_comp_officer4_amount',
+    'high_comp_officer5_full_name',
+    'high_comp_officer5_amount')
+
+
 def sudsToRow(sudsObj):
     """Convert a Suds result object into a Row tuple. This accounts for the
     presence/absence of top-paid officers"""
@@ -98,8 +163,86 @@ def retrieveRows(dunsList):
     """Soup-to-nuts creates a list of Row tuples from a set of DUNS
     numbers."""
     if configValid():
-        client = Client(CONFIG_BROKER['sam']['wsdl'])
-        return [sudsToRow(e) for e in getEntities(client, dunsList)]
+        return [sudsToRow(e) for e in getEntities(getClient(), dunsList)]
     else:
         logger.error("Invalid sam config")
         return []
+
+
+def retrieve_all_rows(duns_list):
+    """Create a list of Row tuples for any number of DUNS numbers, looking
+    them up CHUNK_SIZE at a time with several requests to SAM in flight at
+    once. Rows are in the same order as they'd be looking up each chunk in
+    turn."""
+    chunks = [duns_list[i:i + CHUNK_SIZE]
+              for i in range(0, len(duns_list), CHUNK_SIZE)]
+    if len(chunks) <= 1:
+        chunk_results = map(retrieveRows, chunks)
+    else:
+        chunk_results = getExecutor().map(retrieveRows, chunks)
+    rows = []
+    for chunk_rows in chunk_results:
+        rows.extend(chunk_rows)
+    return rows
+
+
+def retrieve_cached_rows(duns_list):
+    """Create a list of Row tuples for DUNS numbers, using what SAM returned
+    last time for any looked up within the cache's TTL, and looking up the rest.
+    What SAM returns for those, or that it doesn't know them, is cached."""
+    sess = GlobalDB.db().session
+    sam = CONFIG_BROKER.get('sam') or {}
+    fresh_since = datetime.utcnow() - timedelta(
+        seconds=sam.get('cache_ttl') or DEFAULT_CACHE_TTL)
+
+    cached = {}
+    for i in range(0, len(duns_list), CACHE_QUERY_SIZE):
+        query = sess.query(ExecutiveCompensation).\
+            filter(ExecutiveCompensation.duns.in_(
+                duns_list[i:i + CACHE_QUERY_SIZE])).\
+            filter(ExecutiveCompensation.fetched_at >= fresh_since)
+        cached.update((entry.duns, entry) for entry in query)
+    misses = [duns for duns in duns_list if duns not in cached]
+    logger.info('%s of %s DUNS numbers found in the executive compensation '
+                'cache', len(cached), len(duns_list))
+
+    rows = [Row(*(getattr(cached[duns], column) for column in CACHE_COLUMNS))
+            for duns in duns_list if duns in cached and cached[duns].in_sam]
+    if misses:
+        fetched = retrieve_all_rows(misses)
+        # without a SAM config nothing was actually looked up
+        if configValid():
+            cache_rows(misses, fetched)
+        rows.extend(fetched)
+    return rows
+
+
+def cache_rows(duns_list, rows):
+    """Replace the cache entries for DUNS numbers with the Rows SAM returned
+    for them. Those it didn't return are cached as not being in SAM."""
+    sess = GlobalDB.db().session
+    now = datetime.utcnow()
+    entries = {duns: {'duns': duns, 'in_sam': False}
+               for duns in duns_list if duns is not None}
+    for row in rows:
+        entries[row.AwardeeOrRecipientUniqueIdentifier] = dict(
+            zip(CACHE_COLUMNS, (None if value is None else str(value)
+                                for value in row)), in_sam=True)
+    values = [dict({column: None for column in CACHE_COLUMNS}, fetched_at=now,
+                   **entry) for entry in entries.values()]
+    keys = list(entries)
+    try:
+        for i in range(0, len(keys), CACHE_QUERY_SIZE):
+            sess.query(ExecutiveCompensation).\
+                filter(ExecutiveCompensation.duns.in_(
+                    keys[i:i + CACHE_QUERY_SIZE])).\
+                delete(synchronize_session=False)
+        if values:
+            sess.execute(ExecutiveCompensation.__table__.insert(), values)
+        sess.commit()
+    except IntegrityError:
+        # Another process is caching some of the same DUNS numbers; theirs
+        # will do
+        sess.rollback()
+        logger.warning('Executive compensation for %s DUNS numbers was cached '
+                       'by another process first', len(keys))
@@ -1,7 +1,8 @@
 from collections import namedtuple, OrderedDict
-import itertools
+from operator import attrgetter
 
 import iso3166
+from sqlalchemy import and_
 
 from dataactcore.interfaces.db import GlobalDB
 from dataactcore.models.fsrs import (
@@ -9,6 +10,9 @@ from dataactcore.models.fsrs import (
 from dataactcore.models.stagingModels import AwardFinancial, AwardProcurement
 
 
+# Number of rows to fetch from the database at a time while generating
+YIELD_PER = 1000
+
 def _country_name(code):
     """Convert a country code to the country name; return None if invalid"""
     country = iso3166.countries.get(code, None)
@@ -44,6 +48,18 @@ class CopyValues():
             if model and field_name:
                 return getattr(model, field_name)
 
+    def compile(self, model_types):
+        """Build a function doing the same for rows which always have the
+        given models, and no others, so which one to copy from is only worked
+        out once"""
+        for model_type in self.MODEL_TYPES:
+            field_name = getattr(self, model_type + '_field')
+            if model_type in model_types and field_name:
+                get_model = attrgetter(model_type)
+                get_field = attrgetter(field_name)
+                return lambda models: get_field(get_model(models))
+        return lambda models: None
+
 
 def copy_subaward_field(field_name):
     return CopyValues(field_name, field_name)
@@ -67,12 +83,24 @@ class SubawardLogic():
         elif models.subgrant:
             return self.subgrant_fn(models.subgrant)
 
+    def compile(self, model_types):
+        """Build a function doing the same for rows which always have the
+        given models, and no others"""
+        if 'subcontract' in model_types:
+            return lambda models: self.subcontract_fn(models.subcontract)
+        elif 'subgrant' in model_types:
+            return lambda models: self.subgrant_fn(models.subgrant)
+        return lambda models: None
+
 
 # Collect the models associated with a single F CSV row
 ModelRow = namedtuple(
     'ModelRow',
     ['award', 'procurement', 'subcontract', 'grant', 'subgrant', 'naics_desc'])
-ModelRow.__new__.__defaults__ = (None, None, None, None, None)
+ModelRow.__new__.__defaults__ = (None, None, None, None, None, None)
+# The models present in ModelRows from each kind of subaward
+PROCUREMENT_MODELS = ('procurement', 'subcontract')
+GRANT_MODELS = ('grant', 'subgrant')
 
 
 # A collection of mappers (callables which convert a ModelRow into a string to
@@ -162,44 +190,71 @@ mappings = OrderedDict([
 
 
 def submission_procurements(submission_id):
-    """Fetch procurements and subcontracts"""
+    """Fetch procurements and subcontracts for the submission's PIIDs"""
     sess = GlobalDB.db().session
 
-    naics_subquery = sess.query(AwardProcurement.naics_description).\
-        filter(AwardProcurement.submission_id == submission_id).\
-        filter(AwardProcurement.piid == AwardFinancial.piid).\
-        filter(AwardProcurement.naics == FSRSSubcontract.naics).\
-        order_by(AwardProcurement.award_procurement_id).limit(1).as_scalar()
-    results = sess.query(AwardFinancial, FSRSProcurement, FSRSSubcontract,
-                         naics_subquery).\
+    piids = sess.query(AwardFinancial.piid).\
         filter(AwardFinancial.submission_id == submission_id).\
-        filter(FSRSProcurement.contract_number == AwardFinancial.piid).\
-        filter(FSRSSubcontract.parent_id == FSRSProcurement.id)
-    for award, proc, sub, naics_desc in results:
-        yield ModelRow(award, proc, sub, naics_desc=naics_desc)
+        filter(AwardFinancial.piid.isnot(None)).\
+        distinct().subquery()
+    # The NAICS description of the first D1 row for each PIID and NAICS code
+    naics = sess.query(AwardProcurement.piid, AwardProcurement.naics,
+                       AwardProcurement.naics_description).\
+        filter(AwardProcurement.submission_id == submission_id).\
+        distinct(AwardProcurement.piid, AwardProcurement.naics).\
+        order_by(AwardProcurement.piid, AwardProcurement.naics,
+                 AwardProcurement.award_procurement_id).\
+        subquery()
+    results = sess.query(FSRSProcurement, FSRSSubcontract,
+                         naics.c.naics_description).\
+        join(piids, FSRSProcurement.contract_number == piids.c.piid).\
+        join(FSRSSubcontract,
+             FSRSSubcontract.parent_id == FSRSProcurement.id).\
+        outerjoin(naics, and_(
+            naics.c.piid == FSRSProcurement.contract_number,
+            naics.c.naics == FSRSSubcontract.naics)).\
+        yield_per(YIELD_PER)
+    for proc, sub, naics_desc in results:
+        yield ModelRow(procurement=proc, subcontract=sub,
+                       naics_desc=naics_desc)
 
 
 def submission_grants(submission_id):
-    """Fetch grants and subgrants"""
-    triplets = GlobalDB.db().session.\
-        query(AwardFinancial, FSRSGrant, FSRSSubgrant).\
+    """Fetch grants and subgrants for the submission's FAINs"""
+    sess = GlobalDB.db().session
+
+    fains = sess.query(AwardFinancial.fain).\
         filter(AwardFinancial.submission_id == submission_id).\
-        filter(FSRSGrant.fain == AwardFinancial.fain).\
-        filter(FSRSSubgrant.parent_id == FSRSGrant.id)
-    for award, grant, sub in triplets:
-        yield ModelRow(award, grant=grant, subgrant=sub)
+        filter(AwardFinancial.fain.isnot(None)).\
+        distinct().subquery()
+    pairs = sess.query(FSRSGrant, FSRSSubgrant).\
+        join(fains, FSRSGrant.fain == fains.c.fain).\
+        join(FSRSSubgrant, FSRSSubgrant.parent_id == FSRSGrant.id).\
+        yield_per(YIELD_PER)
+    for grant, sub in pairs:
+        yield ModelRow(grant=grant, subgrant=sub)
+
+
+def compile_row_builder(model_types):
+    """Build a function converting ModelRows with the given models into File F
+    rows: lists of strings, in the same order as `mappings`"""
+    cells = [mapper.compile(model_types) if hasattr(mapper, 'compile')
+             else mapper for mapper in mappings.values()]
+
+    def build_row(model_row):
+        return ['' if value is None else str(value)
+                for value in (cell(model_row) for cell in cells)]
+    return build_row
 
 
 def generate_f_rows(submission_id):
-    """Generated OrderedDicts representing File F rows. Subawards are filtered
-    to those relevant to a particular submissionId"""
-    for model_row in itertools.chain(submission_procurements(submission_id),
-                                     submission_grants(submission_id)):
-        result = OrderedDict()
-        for key, mapper in mappings.items():
-            value = mapper(model_row)
-            if value is None:
-                result[key] = ''
-            else:
-                result[key] = str(value)
-        yield result
+    """Generate lists of strings representing File F rows, with cells in the
+    same order as `mappings`. Subawards are filtered to those relevant to a
+    particular submissionId. Rows are fetched and converted as they're needed,
+    so a file can be written without holding all of it in memory"""
+    build_row = compile_row_builder(PROCUREMENT_MODELS)
+    for model_row in submission_procurements(submission_id):
+        yield build_row(model_row)
+    build_row = compile_row_builder(GRANT_MODELS)
+    for model_row in submission_grants(submission_id):
+        yield build_row(model_row)
@@ -0,0 +1,105 @@
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import logging
+import select
+import threading
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from dataactcore.config import CONFIG_DB
+from dataactcore.interfaces.db import dbURI
+from dataactcore.models.jobModels import JOB_STATUS_CHANNEL
+
+
+logger = logging.getLogger(__name__)
+
+
+class JobStatusListener:
+    """ LISTENs for job status notifications on a dedicated connection and wakes up threads waiting on the
+    submissions they're for. One per process; the listening thread starts with the first subscription.
+    """
+    RECONNECT_DELAY = 5
+
+    def __init__(self):
+        # submission_id -> Events of the threads waiting on it
+        self.waiters = defaultdict(set)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+
+    @contextmanager
+    def subscription(self, submission_id):
+        """ Subscribe to a submission's job status changes
+
+        Yields:
+            threading.Event which is set when one of the submission's jobs changes status
+        """
+        changed = threading.Event()
+        with self.lock:
+            self.start()
+            self.waiters[submission_id].add(changed)
+        try:
+            yield changed
+        finally:
+            with self.lock:
+                self.waiters[submission_id].discard(changed)
+                if not self.waiters[submission_id]:
+                    del self.waiters[submission_id]
+
+    def start(self):
+        """ Start the listening thread if it isn't running. Expects self.lock to be held """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.listen, name='job-status-listener', daemon=True)
+            self.thread.start()
+
+    def publish(self, payload):
+        """ Wake up the threads waiting on the submission a notification is for """
+        try:
+            submission_id = json.loads(payload)['submission_id']
+        except (ValueError, KeyError, TypeError):
+            logger.warning('Ignoring malformed job status notification: %s', payload)
+            return
+        with self.lock:
+            for changed in self.waiters.get(submission_id, ()):
+                changed.set()
+
+    def wake_all(self):
+        """ Wake every waiting thread, e.g. when notifications may have been missed while reconnecting """
+        with self.lock:
+            for waiters in self.waiters.values():
+                for changed in waiters:
+                    changed.set()
+
+    def stop(self):
+        """ Stop listening, within a second or so """
+        self.stopped.set()
+
+    def listen(self):
+        """ Receive notifications until stopped, reconnecting if the connection is lost """
+        while not self.stopped.is_set():
+            try:
+                connection = psycopg2.connect(dbURI(CONFIG_DB['db_name']))
+                try:
+                    connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                    connection.cursor().execute('LISTEN {}'.format(JOB_STATUS_CHANNEL))
+                    # Anything sent while we weren't listening is lost, so have waiters check for themselves
+                    self.wake_all()
+                    self.receive(connection)
+                finally:
+                    connection.close()
+            except Exception:
+                logger.exception('Lost job status notification connection')
+            self.stopped.wait(self.RECONNECT_DELAY)
+
+    def receive(self, connection):
+        """ Pass on notifications from a listening connection until it fails or we're stopped """
+        while not self.stopped.is_set():
+            select.select([connection], [], [], 1)
+            connection.poll()
+            while connection.notifies:
+                self.publish(connection.notifies.pop(0).payload)
+
+
+job_status_listener = JobStatusListener()
@@ -3,6 +3,7 @@ import logging
 
 from celery import Celery
 from celery.exceptions import MaxRetriesExceededError
+from celery.signals import worker_process_init
 from flask import Flask
 import requests
 
@@ -36,10 +37,19 @@ celery_app = Celery('tasks', backend=backendUrl,
 celery_app.config_from_object('celeryconfig')
 
 
+@worker_process_init.connect
+def configure_worker_db(**kwargs):
+    """Use the celery pool settings for each worker process's engine"""
+    GlobalDB.configure('celery')
+
+
 @celery_app.task(name='jobQueue.enqueue')
 def enqueue(jobID):
-    """POST a job to the validator"""
+    """Run a validation job, either in this worker or by POSTing it to the
+    validator, depending on the job queue's validate_in_worker setting"""
     logger.info('Adding job %s to the queue', jobID)
+    if CONFIG_JOB_QUEUE.get('validate_in_worker'):
+        return validate_in_worker(jobID)
     validatorUrl = '{validator_host}:{validator_port}'.format(
         **CONFIG_SERVICES)
     if 'http://' not in validatorUrl:
@@ -54,6 +64,15 @@ def enqueue(jobID):
     return response.json()
 
 
+def validate_in_worker(job_id):
+    """Run a validation job in this process rather than through the
+    validator's /validate/ route"""
+    # Only workers that validate need the validator's dependencies
+    from dataactvalidator.validation_handlers.validationManager import (
+        run_validation_job)
+    return run_validation_job(job_id)
+
+
 @contextmanager
 def job_context(task, job_id):
     """Common context for file E and F generation. Handles marking the job
@@ -83,16 +102,12 @@ def job_context(task, job_id):
 @celery_app.task(name='jobQueue.generate_f_file', max_retries=0, bind=True)
 def generate_f_file(task, submission_id, job_id, timestamped_name,
                     upload_file_name, is_local):
-    """Write rows from fileF.generate_f_rows to an appropriate CSV."""
+    """Write rows from fileF.generate_f_rows to an appropriate CSV, as they're
+    generated."""
     with job_context(task, job_id):
-        rows_of_dicts = fileF.generate_f_rows(submission_id)
-        header = [key for key in fileF.mappings]    # keep order
-        body = []
-        for row in rows_of_dicts:
-            body.append([row[key] for key in header])
-
+        header = list(fileF.mappings)    # keep order
         write_csv(timestamped_name, upload_file_name, is_local, header,
-                  body)
+                  fileF.generate_f_rows(submission_id))
 
 
 @celery_app.task(name='jobQueue.generate_e_file', max_retires=3, bind=True)
@@ -111,9 +126,7 @@ def generate_e_file(task, submission_id, job_id, timestamped_name,
         dunsSet = {r.awardee_or_recipient_uniqu for r in d1.union(d2)}
         dunsList = list(dunsSet)    # get an order
 
-        rows = []
-        for i in range(0, len(dunsList), 100):
-            rows.extend(fileE.retrieveRows(dunsList[i:i+100]))
+        rows = fileE.retrieve_cached_rows(dunsList)
         write_csv(timestamped_name, upload_file_name, is_local,
                   fileE.Row._fields, rows)
 
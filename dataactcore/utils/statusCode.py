@@ -3,6 +3,7 @@ class StatusCode() :
     Constants for the status code
     """
     OK = 200
+    NOT_MODIFIED = 304
     CLIENT_ERROR  = 400
     LOGIN_REQUIRED = 401
     PERMISSION_DENIED = 403
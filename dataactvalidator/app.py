@@ -1,17 +1,15 @@
 import logging
 
-import csv
 from flask import Flask, request, g
 
 from dataactcore.config import CONFIG_BROKER, CONFIG_SERVICES
 from dataactcore.interfaces.db import GlobalDB
-from dataactcore.interfaces.function_bag import writeFileError, mark_job_status
 from dataactcore.logging import configure_logging
 from dataactcore.models.jobModels import Job
 from dataactcore.utils.jsonResponse import JsonResponse
 from dataactcore.utils.responseException import ResponseException
-from dataactvalidator.validation_handlers.validationError import ValidationError
-from dataactvalidator.validation_handlers.validationManager import ValidationManager
+from dataactvalidator.validation_handlers.validationManager import (
+    ValidationManager, record_validation_failure, validation_failure_status)
 
 
 logger = logging.getLogger(__name__)
@@ -24,6 +22,7 @@ def createApp():
     local = CONFIG_BROKER['local']
     error_report_path = CONFIG_SERVICES['error_report_path']
     app.config.from_object(__name__)
+    GlobalDB.configure('validator')
 
     # Future: Override config w/ environment variable, if set
     app.config.from_envvar('VALIDATOR_SETTINGS', silent=True)
@@ -43,13 +42,9 @@ def createApp():
 
         job = get_current_job()
         if job:
-            if job.filename is not None:
-                # insert file-level error info to the database
-                writeFileError(job.job_id, job.filename, error.errorType, error.extraInfo)
-            if error.errorType != ValidationError.jobError:
-                # job pass prerequisites for validation, but an error
-                # happened somewhere. mark job as 'invalid'
-                mark_job_status(job.job_id, 'invalid')
+            # insert file-level error info to the database, and mark the
+            # job 'invalid' if it passed prerequisites for validation
+            record_validation_failure(job, error)
         return JsonResponse.error(error, error.status)
 
     @app.errorhandler(Exception)
@@ -57,16 +52,10 @@ def createApp():
         """Handle uncaught exceptions in validation process."""
         logger.error(str(error))
 
-        # csv-specific errors get a different job status and response code
-        if isinstance(error, ValueError) or isinstance(error, csv.Error):
-            job_status, response_code = 'invalid', 400
-        else:
-            job_status, response_code = 'failed', 500
         job = get_current_job()
         if job:
-            if job.filename is not None:
-                writeFileError(job.job_id, job.filename, ValidationError.unknownError)
-            mark_job_status(job.job_id, job_status)
+            record_validation_failure(job, error)
+        _, response_code = validation_failure_status(error)
         return JsonResponse.error(error, response_code)
 
     @app.route("/", methods=["GET"])
@@ -1,4 +1,5 @@
 import csv
+import io
 from dataactcore.config import CONFIG_BROKER
 from dataactcore.utils.statusCode import StatusCode
 from dataactcore.utils.responseException import ResponseException
@@ -14,6 +15,8 @@ class CsvAbstractReader(object):
     """
 
     BUFFER_SIZE = 8192
+    # what the decoder substitutes for bytes that aren't valid UTF-8
+    REPLACEMENT_CHARACTER = "\ufffd"
     header_report_headers = ["Error type", "Header name"]
 
     def open_file(self, region, bucket, filename, csv_schema, bucket_name, error_filename, long_to_short_dict):
@@ -29,19 +32,22 @@ class CsvAbstractReader(object):
         """
 
         self.filename = filename
-        self.unprocessed = ''
         self.extra_line = False
-        self.lines = []
         self.flex_dictionary = {}
         self.header_dictionary = {}
-        self.packet_counter = 0
         current = 0
         self.is_finished= False
         self.column_count = 0
-        line = self._get_line()
+        # decode the byte stream incrementally; newline='' leaves line endings
+        # inside quoted fields for the csv module to handle. Bytes that aren't
+        # valid UTF-8 are replaced so reading can carry on past them, and the
+        # rows containing them are reported as read errors by _read_row
+        self.text_stream = io.TextIOWrapper(self._get_stream(), encoding='utf-8', errors='replace', newline='')
+        line = self._get_header_line()
         # make sure we have not finished reading the file
 
-        if self.is_finished:
+        if line is None:
+            self.is_finished = True
             # Write header error for no header row
             with self.get_writer(bucket_name, error_filename, ["Error Type"], self.is_local) as writer:
                 writer.write(["No header row"])
@@ -109,6 +115,7 @@ class CsvAbstractReader(object):
                     current += 1
 
         self.column_count = current
+        self.csv_reader = csv.reader(self.text_stream, dialect='excel', delimiter=self.delimiter)
 
         #Check that all required fields exists
         missing_headers = []
@@ -138,6 +145,10 @@ class CsvAbstractReader(object):
                 writer.finishBatch()
             raise ResponseException("Errors in header row: " + str(error_string), StatusCode.CLIENT_ERROR, ValueError,ValidationError.headerError,**extra_info)
 
+        # always read one row ahead so is_finished is set when the last row is returned
+        self.next_row = self._read_row()
+        if self.next_row is None:
+            self.is_finished = True
         return long_headers
 
     @staticmethod
@@ -151,6 +162,28 @@ class CsvAbstractReader(object):
             region = CONFIG_BROKER["aws_region"]
         return CsvS3Writer(region, bucket_name, filename, header)
 
+    def get_next_row(self):
+        """
+        Read the next row as a list of cells, in file column order
+        Returns:
+            list of strings, one per column
+        """
+        row = self.next_row
+        if row is None:
+            raise ResponseException("No more records in this file", StatusCode.CLIENT_ERROR, ValueError, ValidationError.readError)
+        self.next_row = self._read_row()
+        if self.next_row is None:
+            self.is_finished = True
+            # a whitespace-only last line is left over from extra line breaks rather than being a real record
+            self.extra_line = isinstance(row, list) and not "".join(row).strip()
+        if not isinstance(row, list):
+            # this record could not be parsed or decoded
+            raise ResponseException(str(row), StatusCode.CLIENT_ERROR, ValueError, ValidationError.readError)
+
+        if len(row) != self.column_count:
+            raise ResponseException("Wrong number of fields in this row", StatusCode.CLIENT_ERROR, ValueError, ValidationError.readError)
+        return row
+
     def get_next_record(self):
         """
         Read the next record into a dict and return it
@@ -159,27 +192,20 @@ class CsvAbstractReader(object):
         """
         return_dict = {}
         flex_dict = {}
-        line = self._get_line()
-
-        for row in csv.reader([line], dialect='excel', delimiter=self.delimiter):
-            if len(row) != self.column_count:
-                raise ResponseException("Wrong number of fields in this row", StatusCode.CLIENT_ERROR, ValueError, ValidationError.readError)
-            for current, cell in enumerate(row):
-                if current >= self.column_count:
-                    raise ResponseException("Record contains too many fields",StatusCode.CLIENT_ERROR,ValueError,ValidationError.readError)
-                if cell == "":
-                    # Use None instead of empty strings for sqlalchemy
-                    cell = None
-                # self.header_dictionary uses the short, machine-readable column names
-                if self.header_dictionary[current] is None:
-                    if self.flex_dictionary[current] is not None:
-                        flex_dict["header"] = self.flex_dictionary[current]
-                        flex_dict["cell"] = cell
-                    else:
-                        # Skip this column as it is unknown or flex
-                        continue
+        for current, cell in enumerate(self.get_next_row()):
+            if cell == "":
+                # Use None instead of empty strings for sqlalchemy
+                cell = None
+            # self.header_dictionary uses the short, machine-readable column names
+            if self.header_dictionary[current] is None:
+                if self.flex_dictionary[current] is not None:
+                    flex_dict["header"] = self.flex_dictionary[current]
+                    flex_dict["cell"] = cell
                 else:
-                    return_dict[self.header_dictionary[current]] = cell
+                    # Skip this column as it is unknown or flex
+                    continue
+            else:
+                return_dict[self.header_dictionary[current]] = cell
         return return_dict, flex_dict
 
     def close(self):
@@ -188,85 +214,33 @@ class CsvAbstractReader(object):
         """
         raise NotImplementedError("Do not instantiate csvAbstractReader directly.")
 
-    def _get_file_size(self):
-        """
-        Gets the size of the file
-        """
-        raise NotImplementedError("Do not instantiate csvAbstractReader directly.")
-
-    def _get_next_packet(self):
+    def _get_stream(self):
         """
-        Gets the next packet from the file returns true if successful
+        Gets a buffered binary stream of the file's contents
         """
         raise NotImplementedError("Do not instantiate csvAbstractReader directly.")
 
-    def _get_line(self):
+    def _get_header_line(self):
         """
-        This method reads 8192 bytes from S3 Bucket at a time and stores
-        it in a line buffer. The line buffer is used until its empty then
-        another request is created to S3 for more data.
+        Returns the first non-blank line of the file without its line break, or None if there isn't one
         """
-        if len(self.lines) > 0:
-            #Get the next line
-            return self.lines.pop(0)
-        #packets are 8192 bytes in size
-        #for packet in self.s3File :
-        while self.packet_counter *  CsvAbstractReader.BUFFER_SIZE <=  self._get_file_size():
-
-            success,packet =  self._get_next_packet()
-            if not success:
-                break
-            self.packet_counter +=1
-
-            #Get the current lines
-            current_bytes = self.unprocessed + packet
-            self.lines = self._split_lines(current_bytes)
-
-            #edge case if the packet was filled with newlines only try again
-            if len(self.lines) ==0:
-                continue
+        for line in self.text_stream:
+            line = line.rstrip("\r\n")
+            if line:
+                return line
+        return None
 
-            #last line still needs processing save and reuse
-            self.unprocessed = self.lines.pop()
-            if len(self.lines) > 0:
-                #Get the next line
-                return  self.lines.pop(0)
-        self.is_finished = True
-
-        if len(self.unprocessed) < 5:
-            # Got an extra line from a line break on the last line
-            self.extra_line = True
-        return self.unprocessed
-
-
-    def _split_lines(self, packet) :
+    def _read_row(self):
         """
-        arguments :
-        packet unprocessed string of CSV data
-        returns a list of strings broken by newline
+        Returns the next non-blank row from the csv reader, None at the end of the file, or an error if the row
+        could not be parsed or decoded
         """
-        lines_to_return = []
-        escape_mode =  False
-        current = ""
-
-        for index,char in enumerate(packet):
-            if not escape_mode:
-                if char =='\r' or char =='\n' or char =='\r\n':
-                    if len(current) >0:
-                        lines_to_return.append(current)
-                        #check the last char if its a new line add extra line
-                        # as its at the end of the packet
-                    if index == len(packet)-1:
-                        lines_to_return.append("")
-                    current = ""
-                else:
-                  current = "".join([current,char])
-                  if char == '"':
-                        escape_mode = True
-            else :
-                if char == '"':
-                    escape_mode = False
-                current = "".join([current,char])
-        if len(current)>0:
-            lines_to_return.append(current)
-        return lines_to_return
+        try:
+            for row in self.csv_reader:
+                if row:
+                    if any(self.REPLACEMENT_CHARACTER in cell for cell in row):
+                        return UnicodeError("Record contains characters that are not valid UTF-8")
+                    return row
+        except csv.Error as e:
+            return e
+        return None
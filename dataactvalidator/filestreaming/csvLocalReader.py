@@ -1,4 +1,3 @@
-import os
 from dataactvalidator.filestreaming.csvAbstractReader import CsvAbstractReader
 
 
@@ -20,7 +19,7 @@ class CsvLocalReader(CsvAbstractReader):
         self.filename = filename
         self.is_local = True
         try:
-            self.file = open(filename,"r")
+            self.file = open(filename,"rb")
         except :
             raise ValueError("".join(["Filename provided not found : ", str(self.filename)]))
         super(CsvLocalReader,self).open_file(
@@ -34,18 +33,8 @@ class CsvLocalReader(CsvAbstractReader):
             # File does not exist, and so does not need to be closed
             pass
 
-    def _get_file_size(self):
+    def _get_stream(self):
         """
-        Gets the size of the file
+        Gets a buffered binary stream of the file's contents
         """
-        return os.path.getsize(self.filename)
-
-    def _get_next_packet(self):
-        """
-        Gets the next packet from the file returns true if successful
-        """
-        packet  = self.file.read(CsvAbstractReader.BUFFER_SIZE)
-        success = True
-        if packet == "":
-            success = False
-        return success, packet
+        return self.file
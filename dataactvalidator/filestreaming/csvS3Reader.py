@@ -1,7 +1,18 @@
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPException
+import io
+import logging
+import time
+
 import boto
+from boto.exception import BotoServerError
+from dataactcore.config import CONFIG_BROKER
 from dataactvalidator.filestreaming.csvAbstractReader import CsvAbstractReader
 
 
+logger = logging.getLogger(__name__)
+
+
 class CsvS3Reader(CsvAbstractReader):
     """
     Reads data from S3 CSV file
@@ -35,24 +46,103 @@ class CsvS3Reader(CsvAbstractReader):
             region, bucket, filename, csv_schema, bucket_name, error_filename, long_to_short_dict)
 
     def close(self):
-        """ Don't need to close file when streaming from S3 """
-        pass
+        """ Stops any read ahead of the S3 file """
+        try:
+            self.range_stream.close()
+        except AttributeError:
+            # Stream was never opened
+            pass
 
-    def _get_file_size(self):
+    def _get_stream(self):
         """
-        Gets the size of the file
+        Gets a buffered binary stream of the file's contents
         """
-        return self.s3_file.size
+        self.range_stream = S3RangeStream(self.s3_file, CONFIG_BROKER.get('s3_read_window_size'),
+                                          CONFIG_BROKER.get('s3_read_retries'))
+        return io.BufferedReader(self.range_stream, CsvAbstractReader.BUFFER_SIZE)
+
 
-    def _get_next_packet(self):
+class S3RangeStream(io.RawIOBase):
+    """
+    Raw binary stream over an S3 key. The key is fetched in large windows with ranged GETs, and a background thread
+    fetches the next window while the current one is being read. Failed ranges are retried.
+    """
+    WINDOW_SIZE = 16 * 1024 ** 2
+    RETRIES = 3
+    RETRY_DELAY = 1
+
+    def __init__(self, s3_file, window_size=None, retries=None):
         """
-        Gets the next packet from the file returns true if successful
+        Args:
+            s3_file: boto Key to read
+            window_size: number of bytes to fetch per request
+            retries: number of times to retry a failed request
         """
-        offset_check = self.packet_counter * CsvAbstractReader.BUFFER_SIZE
-        header = {'Range': 'bytes={}-{}'.format(
-            offset_check, offset_check + CsvAbstractReader.BUFFER_SIZE - 1)}
-        try:
-            packet = self.s3_file.get_contents_as_string(headers=header, encoding='utf-8')
-            return True, packet
-        except:
-            return False, ""
+        self.s3_file = s3_file
+        self.size = s3_file.size
+        self.window_size = window_size or self.WINDOW_SIZE
+        self.retries = self.RETRIES if retries is None else retries
+        self.window = memoryview(b'')
+        self.window_position = 0
+        self.next_start = 0
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = self._prefetch()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        """ Fill buffer with the next bytes of the file, returning the number of bytes read (0 at the end) """
+        if self.window_position >= len(self.window):
+            if self.pending is None:
+                return 0
+            self.window = memoryview(self.pending.result())
+            self.window_position = 0
+            self.pending = self._prefetch()
+        length = min(len(buffer), len(self.window) - self.window_position)
+        buffer[:length] = self.window[self.window_position:self.window_position + length]
+        self.window_position += length
+        return length
+
+    def close(self):
+        """ Stop reading ahead and release the current window """
+        if not self.closed:
+            self.executor.shutdown(wait=False)
+            self.pending = None
+            self.window = memoryview(b'')
+        super(S3RangeStream, self).close()
+
+    def _prefetch(self):
+        """ Start fetching the next window in the background, returns None if the whole file has been requested """
+        if self.next_start >= self.size:
+            return None
+        start = self.next_start
+        end = min(start + self.window_size, self.size) - 1
+        self.next_start = end + 1
+        return self.executor.submit(self._fetch, start, end)
+
+    def _fetch(self, start, end):
+        """ Get bytes start through end (inclusive) of the S3 file, retrying failures """
+        header = {'Range': 'bytes={}-{}'.format(start, end)}
+        attempt = 0
+        while True:
+            try:
+                packet = self.s3_file.get_contents_as_string(headers=header)
+                if len(packet) != end - start + 1:
+                    raise IOError("Expected {} bytes from S3, received {}".format(end - start + 1, len(packet)))
+                return packet
+            except (BotoServerError, HTTPException, OSError) as e:
+                if attempt >= self.retries or not is_transient(e):
+                    raise
+                attempt += 1
+                logger.warning('Failed to read bytes %s-%s of %s, retrying (attempt %s)',
+                               start, end, self.s3_file.name, attempt, exc_info=True)
+                time.sleep(self.RETRY_DELAY * attempt)
+
+
+def is_transient(error):
+    """ Whether a failed S3 request is worth retrying: connection problems, timeouts, short reads and S3's own
+    server errors (e.g. 503 Slow Down) are, while client errors such as a 403 aren't """
+    if isinstance(error, BotoServerError):
+        return error.status is None or error.status >= 500
+    return True
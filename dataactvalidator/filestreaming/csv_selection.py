@@ -1,6 +1,10 @@
 import logging
 
+import boto
+import smart_open
+
 from dataactcore.config import CONFIG_BROKER
+from dataactvalidator.filestreaming.csvAbstractWriter import CsvAbstractWriter
 from dataactvalidator.filestreaming.csvLocalWriter import CsvLocalWriter
 from dataactvalidator.filestreaming.csvS3Writer import CsvS3Writer
 
@@ -27,3 +31,24 @@ def write_csv(file_name, upload_name, is_local, header, body):
         for line in body:
             writer.write(line)
         writer.finishBatch()
+
+
+def write_stream(file_name, upload_name, is_local, chunks):
+    """Derive the relevant location, as write_csv does, and copy an already formatted file to it chunk by chunk,
+    so no more than one chunk is held in memory.
+    :param chunks: iterable of bytes making up the file"""
+    if is_local:
+        stream = open(CONFIG_BROKER['broker_files'] + file_name, 'wb')
+        message = 'Writing file locally...'
+    else:
+        key = boto.s3.connect_to_region(CONFIG_BROKER['aws_region']).get_bucket(
+            CONFIG_BROKER['aws_bucket']).new_key(upload_name)
+        stream = smart_open.smart_open(key, 'wb', min_part_size=CsvAbstractWriter.BUFFER_SIZE)
+        message = 'Writing file to S3...'
+
+    logger.debug(message)
+
+    with stream:
+        for chunk in chunks:
+            if chunk:
+                stream.write(chunk)
@@ -0,0 +1,326 @@
+""" Runs validation jobs claimed straight from the job table, as an alternative to dispatching them through celery.
+Start one or more of these, on any number of hosts, with the job queue's backend set to "postgres":
+
+    python dataactvalidator/jobWorker.py [--concurrency N] [--lane small|large]
+"""
+import argparse
+import logging
+import os
+import socket
+import threading
+
+from flask import Flask
+from sqlalchemy import func, text
+
+from dataactcore.config import CONFIG_JOB_QUEUE
+from dataactcore.interfaces.db import GlobalDB
+from dataactcore.logging import configure_logging
+from dataactcore.models.jobModels import Job
+from dataactcore.models.lookups import FILE_TYPE_DICT, JOB_STATUS_DICT, JOB_TYPE_DICT
+from dataactvalidator.validation_handlers.validationManager import run_validation_job
+
+
+logger = logging.getLogger(__name__)
+
+# Job types a worker will claim
+WORKER_JOB_TYPES = ('csv_record_validation', 'cross_file_pair', 'validation')
+
+# Estimated validation cost per byte, by file type. A, B and C rows are checked against SQL rules as well as their
+# field definitions, while D1 and D2 rows are wide but only have field checks. Other types cost 1 per byte
+FILE_TYPE_WEIGHTS = {'appropriations': 2, 'program_activity': 2, 'award_financial': 2}
+
+# A job's estimated cost: its file's size weighted by file type, or for cross-file validation the weighted sizes of
+# the files it checks: both of a cross_file_pair job's, or all of its submission's
+JOB_COST_SQL = """
+    COALESCE(job.file_size * {weight}, (
+        SELECT SUM(file_job.file_size * {file_weight}) FROM job AS file_job
+        WHERE file_job.job_type_id = :file_job_type AND CASE WHEN job.job_type_id = :pair_job_type
+            THEN file_job.job_id IN (SELECT prerequisite_id FROM job_dependency WHERE job_id = job.job_id)
+            ELSE file_job.submission_id = job.submission_id END
+    ), 0)"""
+
+# Cheapest job first, less a credit for each second it's been ready (updated_at is UTC) so large files aren't
+# starved. Locking with SKIP LOCKED lets each worker pass over rows another worker is in the middle of claiming
+READY_JOB_SQL = """
+    SELECT job.job_id FROM job
+    WHERE job.job_status_id = :ready AND job.job_type_id IN :job_types{lane_filter}
+    ORDER BY {cost} - :aging_rate * EXTRACT(EPOCH FROM (now() AT TIME ZONE 'UTC') - job.updated_at), job.job_id
+    LIMIT 1
+    FOR UPDATE OF job SKIP LOCKED"""
+
+# Which jobs each lane's workers claim, by estimated cost; workers without a lane claim any job
+LANE_FILTERS = {
+    'small': '{cost} < :large_job_cost',
+    'large': '{cost} >= :large_job_cost'
+}
+
+STALE_JOBS_SQL = text("""
+    SELECT job_id FROM job
+    WHERE job_status_id = :running AND worker_id IS NOT NULL
+        AND heartbeat_at < now() - :stale_after * interval '1 second'
+    FOR UPDATE SKIP LOCKED""")
+
+HEARTBEAT_SQL = text("""
+    UPDATE job SET heartbeat_at = now()
+    WHERE worker_id = :worker_id AND job_status_id = :running""")
+
+RELEASE_SQL = text("""
+    UPDATE job SET worker_id = NULL, heartbeat_at = NULL, worker_attempts = 0
+    WHERE job_id = :job_id AND worker_id = :worker_id""")
+
+
+def ready_job_sql(lane=None, weights=None):
+    """ Query for the next ready job a worker should claim
+
+    Args:
+        lane: "small" or "large" to only find jobs in that lane, None for any job
+        weights: estimated cost per byte by file type name, defaults to FILE_TYPE_WEIGHTS
+
+    Returns:
+        text() query taking the parameters built by claim_job
+    """
+    weights = FILE_TYPE_WEIGHTS if weights is None else weights
+
+    def weight(table):
+        if not weights:
+            return '1'
+        whens = ' '.join('WHEN {} THEN {}'.format(FILE_TYPE_DICT[name], float(weight))
+                         for name, weight in sorted(weights.items()))
+        return 'CASE {}.file_type_id {} ELSE 1 END'.format(table, whens)
+
+    cost = JOB_COST_SQL.format(weight=weight('job'), file_weight=weight('file_job'))
+    lane_filter = ' AND ' + LANE_FILTERS[lane].format(cost=cost) if lane else ''
+    return text(READY_JOB_SQL.format(cost=cost, lane_filter=lane_filter))
+
+
+def claim_job(sess, worker_id, query=None, aging_rate=None, large_job_cost=None):
+    """ Claim the ready validation job with the lowest estimated cost, allowing for how long it's waited, that no
+    other worker has, marking it running
+
+    Args:
+        sess: session to claim the job in; it's committed before returning
+        worker_id: identifies the claiming worker
+        query: from ready_job_sql, defaults to one for any lane
+        aging_rate: estimated cost credited to a job for each second it's been ready, defaults to JobWorker's
+        large_job_cost: estimated cost from which a job is in the large lane, defaults to JobWorker's
+
+    Returns:
+        ID of the claimed job, or None if there are no ready jobs
+    """
+    job_id = sess.execute(query if query is not None else ready_job_sql(), {
+        'ready': JOB_STATUS_DICT['ready'],
+        'job_types': tuple(JOB_TYPE_DICT[name] for name in WORKER_JOB_TYPES),
+        'file_job_type': JOB_TYPE_DICT['csv_record_validation'],
+        'pair_job_type': JOB_TYPE_DICT['cross_file_pair'],
+        'aging_rate': aging_rate if aging_rate is not None else JobWorker.AGING_RATE,
+        'large_job_cost': large_job_cost if large_job_cost is not None else JobWorker.LARGE_JOB_COST
+    }).scalar()
+    if job_id is not None:
+        job = sess.query(Job).filter_by(job_id=job_id).one()
+        job.job_status_id = JOB_STATUS_DICT['running']
+        job.worker_id = worker_id
+        job.heartbeat_at = func.now()
+        job.worker_attempts = Job.worker_attempts + 1
+    sess.commit()
+    return job_id
+
+
+def requeue_stale_jobs(sess, stale_after, max_attempts):
+    """ Put jobs back in the queue if the worker running them hasn't sent a heartbeat recently, i.e. has crashed.
+    Jobs which have already been abandoned max_attempts times are marked failed instead, so that a file which
+    crashes workers isn't retried forever.
+
+    Args:
+        sess: session to requeue the jobs in; it's committed before returning
+        stale_after: seconds without a heartbeat before a job is requeued
+        max_attempts: times a job can be claimed without being finished before it's failed
+
+    Returns:
+        IDs of the requeued or failed jobs
+    """
+    job_ids = [row.job_id for row in sess.execute(STALE_JOBS_SQL, {
+        'running': JOB_STATUS_DICT['running'],
+        'stale_after': stale_after
+    })]
+    if job_ids:
+        for job in sess.query(Job).filter(Job.job_id.in_(job_ids)):
+            if job.worker_attempts >= max_attempts:
+                logger.error('Failing job %s, abandoned by %s workers, the last %s', job.job_id,
+                             job.worker_attempts, job.worker_id)
+                status_name = 'failed'
+                job.error_message = 'Job was abandoned by {} job workers'.format(job.worker_attempts)
+                job.worker_attempts = 0
+            else:
+                logger.warning('Requeueing job %s, last claimed by worker %s', job.job_id, job.worker_id)
+                status_name = 'ready'
+            job.job_status_id = JOB_STATUS_DICT[status_name]
+            job.worker_id = None
+            job.heartbeat_at = None
+    sess.commit()
+    return job_ids
+
+
+def send_heartbeat(sess, worker_id):
+    """ Mark all the jobs a worker is running as still alive """
+    sess.execute(HEARTBEAT_SQL, {'worker_id': worker_id, 'running': JOB_STATUS_DICT['running']})
+    sess.commit()
+
+
+def release_job(sess, job_id, worker_id):
+    """ Forget which worker ran a job, and how many tried, once it's done with whatever its outcome """
+    sess.execute(RELEASE_SQL, {'job_id': job_id, 'worker_id': worker_id})
+    sess.commit()
+
+
+class JobWorker:
+    """ Runs up to `concurrency` validation jobs at once, each in its own thread, while another thread sends
+    heartbeats for them. Any worker requeues jobs whose worker has stopped sending heartbeats.
+
+    Small files are validated first. Giving workers a lane keeps some of them free for small files, so interactive
+    submissions stay quick while large ones are being validated; run workers for both lanes if any have one.
+    """
+    CONCURRENCY = 1
+    POLL_INTERVAL = 5
+    HEARTBEAT_INTERVAL = 30
+    STALE_AFTER = 120
+    MAX_ATTEMPTS = 3
+    # 1MB of estimated cost per second waited: a 2GB file is ahead of new small files after about half an hour
+    AGING_RATE = 1024 * 1024
+    LARGE_JOB_COST = 100 * 1024 * 1024
+    LANES = tuple(LANE_FILTERS)
+
+    def __init__(self, worker_id=None, concurrency=None, poll_interval=None, heartbeat_interval=None,
+                 stale_after=None, max_attempts=None, lane=None, aging_rate=None, large_job_cost=None,
+                 file_type_weights=None):
+        """
+        Args:
+            worker_id: identifies this worker in the job table, defaults to host:pid
+            concurrency: number of jobs run at once
+            poll_interval: seconds an idle thread waits before looking for jobs again
+            heartbeat_interval: seconds between heartbeats
+            stale_after: seconds without a heartbeat before a running job is requeued
+            max_attempts: times a job is claimed without being finished before it's marked failed
+            lane: "small" or "large" to only claim jobs in that lane, None to claim any job
+            aging_rate: estimated cost credited to a ready job for each second it waits
+            large_job_cost: estimated cost, i.e. weighted bytes, from which a job is in the large lane
+            file_type_weights: estimated cost per byte by file type name, defaults to FILE_TYPE_WEIGHTS
+        """
+        if lane is not None and lane not in self.LANES:
+            raise ValueError('Unknown job worker lane: {}'.format(lane))
+        self.worker_id = worker_id or '{}:{}'.format(socket.gethostname(), os.getpid())
+        self.concurrency = concurrency or self.CONCURRENCY
+        self.poll_interval = poll_interval or self.POLL_INTERVAL
+        self.heartbeat_interval = heartbeat_interval or self.HEARTBEAT_INTERVAL
+        self.stale_after = stale_after or self.STALE_AFTER
+        self.max_attempts = max_attempts or self.MAX_ATTEMPTS
+        self.aging_rate = aging_rate if aging_rate is not None else self.AGING_RATE
+        self.large_job_cost = large_job_cost or self.LARGE_JOB_COST
+        self.ready_job_query = ready_job_sql(lane, file_type_weights)
+        self.lane = lane
+        self.stopped = threading.Event()
+
+    @classmethod
+    def from_config(cls, concurrency=None, lane=None):
+        """ Build a worker from the job queue config, optionally overriding its concurrency and lane """
+        return cls(concurrency=concurrency or CONFIG_JOB_QUEUE.get('worker_concurrency'),
+                   poll_interval=CONFIG_JOB_QUEUE.get('worker_poll_interval'),
+                   heartbeat_interval=CONFIG_JOB_QUEUE.get('worker_heartbeat_interval'),
+                   stale_after=CONFIG_JOB_QUEUE.get('worker_stale_after'),
+                   max_attempts=CONFIG_JOB_QUEUE.get('worker_max_attempts'),
+                   lane=lane or CONFIG_JOB_QUEUE.get('worker_lane'),
+                   aging_rate=CONFIG_JOB_QUEUE.get('worker_aging_rate'),
+                   large_job_cost=CONFIG_JOB_QUEUE.get('worker_large_job_cost'),
+                   file_type_weights=CONFIG_JOB_QUEUE.get('worker_file_type_weights'))
+
+    def run(self):
+        """ Run jobs until stopped """
+        logger.info('Job worker %s starting %s threads in lane %s', self.worker_id, self.concurrency,
+                    self.lane or 'any')
+        threads = [threading.Thread(target=self.beat, name='job-worker-heartbeat', daemon=True)]
+        threads.extend(threading.Thread(target=self.work, name='job-worker-{}'.format(i))
+                       for i in range(self.concurrency))
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads[1:]:
+                # join with a timeout so KeyboardInterrupt gets through
+                while thread.is_alive():
+                    thread.join(1)
+        finally:
+            self.stop()
+
+    def stop(self):
+        """ Stop claiming jobs. Jobs already running are finished first """
+        self.stopped.set()
+
+    def work(self):
+        """ Claim and run jobs until stopped """
+        while not self.stopped.is_set():
+            if not self.run_next_job():
+                self.stopped.wait(self.poll_interval)
+
+    def run_next_job(self):
+        """ Requeue stale jobs, then claim and run one job
+
+        Returns:
+            True if a job was run, False if there were none ready (or the database couldn't be reached)
+        """
+        # Flask context ensures we have access to global.g
+        with Flask(__name__).app_context():
+            try:
+                sess = GlobalDB.db().session
+                requeue_stale_jobs(sess, self.stale_after, self.max_attempts)
+                job_id = claim_job(sess, self.worker_id, self.ready_job_query, self.aging_rate,
+                                   self.large_job_cost)
+            except Exception:
+                logger.exception('Job worker %s could not claim a job', self.worker_id)
+                return False
+            finally:
+                GlobalDB.close()
+        if job_id is None:
+            return False
+
+        logger.info('Job worker %s running job %s', self.worker_id, job_id)
+        try:
+            run_validation_job(job_id)
+        except Exception:
+            # failures are recorded on the job where possible; keep the thread alive either way
+            logger.exception('Job worker %s could not run job %s', self.worker_id, job_id)
+        finally:
+            with Flask(__name__).app_context():
+                try:
+                    release_job(GlobalDB.db().session, job_id, self.worker_id)
+                except Exception:
+                    # the job will be requeued once its heartbeat goes stale, if it's still running
+                    logger.exception('Job worker %s could not release job %s', self.worker_id, job_id)
+                finally:
+                    GlobalDB.close()
+        return True
+
+    def beat(self):
+        """ Send heartbeats until stopped """
+        while not self.stopped.wait(self.heartbeat_interval):
+            with Flask(__name__).app_context():
+                try:
+                    send_heartbeat(GlobalDB.db().session, self.worker_id)
+                except Exception:
+                    logger.exception('Job worker %s could not send a heartbeat', self.worker_id)
+                finally:
+                    GlobalDB.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run validation jobs from the job table')
+    parser.add_argument('-c', '--concurrency', type=int,
+                        help='number of jobs to run at once (default: the job queue\'s worker_concurrency)')
+    parser.add_argument('-l', '--lane', choices=JobWorker.LANES,
+                        help='only claim small or large jobs (default: the job queue\'s worker_lane, or any job)')
+    args = parser.parse_args()
+
+    GlobalDB.configure('validator')
+    JobWorker.from_config(args.concurrency, args.lane).run()
+
+
+if __name__ == '__main__':
+    configure_logging()
+    main()
@@ -1,5 +1,5 @@
 from collections import defaultdict
-from datetime import date
+from datetime import date, datetime
 import os
 import logging
 
@@ -63,7 +63,7 @@ def updateTASLookups(csvPath):
     sess.query(TASLookup).\
         filter(TASLookup.internal_end_date == None).\
         filter(~TASLookup.tas_id.in_(existing_ids)).\
-        update({'internal_end_date': date.today()}, synchronize_session=False)
+        update({'internal_end_date': date.today(), 'updated_at': datetime.utcnow()}, synchronize_session=False)
 
     new_data = data[data['existing_id'].isnull()]
     del new_data['existing_id']
@@ -0,0 +1,43 @@
+import logging
+
+from dataactcore.interfaces.db import GlobalDB
+from dataactcore.logging import configure_logging
+from dataactcore.models.stagingModels import AwardFinancialAssistance, AwardProcurement
+from dataactcore.utils import fileE
+from dataactvalidator.app import createApp
+
+
+logger = logging.getLogger(__name__)
+
+# DUNS numbers to look up and cache at a time
+BATCH_SIZE = 1000
+
+
+def load_executive_compensation():
+    """Fill the executive compensation cache used to generate file E for every awardee in D1 and D2 data"""
+    with createApp().app_context():
+        warm_executive_compensation()
+
+
+def warm_executive_compensation(batch_size=BATCH_SIZE):
+    """Look up every awardee in the D1 and D2 staging tables without a fresh executive compensation cache entry in
+    SAM, and cache the results"""
+    sess = GlobalDB.db().session
+    d1 = sess.query(AwardProcurement.awardee_or_recipient_uniqu).\
+        filter(AwardProcurement.awardee_or_recipient_uniqu.isnot(None))
+    d2 = sess.query(AwardFinancialAssistance.awardee_or_recipient_uniqu).\
+        filter(AwardFinancialAssistance.awardee_or_recipient_uniqu.isnot(None))
+    duns_list = sorted(duns for duns, in d1.union(d2))
+    logger.info('Caching executive compensation for %s awardees', len(duns_list))
+
+    for i in range(0, len(duns_list), batch_size):
+        fileE.retrieve_cached_rows(duns_list[i:i + batch_size])
+        # the rows aren't needed, so don't keep the cache entries read for them around
+        sess.expunge_all()
+        logger.info('Cached executive compensation for %s of %s awardees',
+                    min(i + batch_size, len(duns_list)), len(duns_list))
+
+
+if __name__ == '__main__':
+    configure_logging()
+    load_executive_compensation()
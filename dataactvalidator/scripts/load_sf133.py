@@ -1,5 +1,5 @@
 from collections import namedtuple
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 import glob
 import logging
 import os
@@ -131,7 +131,7 @@ def update_tas_id(fiscal_year, fiscal_period):
                 fiscal_period)
     sess.query(SF133).\
         filter_by(fiscal_year=fiscal_year, period=fiscal_period).\
-        update({SF133.tas_id: subquery}, synchronize_session=False)
+        update({SF133.tas_id: subquery, SF133.updated_at: datetime.utcnow()}, synchronize_session=False)
     sess.commit()
 
 
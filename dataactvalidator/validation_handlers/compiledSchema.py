@@ -0,0 +1,161 @@
+from decimal import Decimal
+
+from dataactcore.models.lookups import FIELD_TYPE_DICT_ID
+from dataactvalidator.filestreaming.fieldCleaner import FieldCleaner
+from dataactvalidator.validation_handlers.validationError import ValidationError
+from dataactvalidator.validation_handlers.validator import Validator
+
+
+def _is_int(value):
+    """ Same test as Validator.checkType for INT and LONG """
+    if value.isdecimal():
+        return True
+    try:
+        int(value)
+        return True
+    except ValueError:
+        return False
+
+
+def _is_decimal(value):
+    """ Same test as Validator.checkType for DECIMAL """
+    if value.isdecimal():
+        return True
+    try:
+        Decimal(value)
+        return True
+    except (ArithmeticError, ValueError):
+        return False
+
+
+_BOOLEAN_VALUES = frozenset(Validator.BOOLEAN_VALUES)
+
+
+def _is_boolean(value):
+    """ Same test as Validator.checkType for BOOLEAN """
+    return value.upper() in _BOOLEAN_VALUES
+
+
+# Strings always pass the type check once blanks are removed, so they don't need a checker
+TYPE_CHECKERS = {"INT": _is_int, "LONG": _is_int, "DECIMAL": _is_decimal, "BOOLEAN": _is_boolean}
+NUMERIC_TYPES = ("INT", "DECIMAL", "LONG")
+
+
+class CompiledSchema:
+    """ Cleaning and basic schema validation for one file, built once per job
+
+    Maps positions in the file's rows to precomputed cleaning and type checks for each FileColumn, so rows can be
+    processed as lists of values in file column order rather than dicts keyed by column name. Produces the same
+    results as FieldCleaner.cleanRow followed by Validator.validate.
+    """
+
+    def __init__(self, fields, header_dictionary, flex_dictionary):
+        """
+        Args:
+            fields: list of FileColumn objects for this file type
+            header_dictionary: maps positions in the file to short column names, None for unknown columns
+            flex_dictionary: maps positions in the file to flex column headers, None for other columns
+        """
+        fields_by_name = {FieldCleaner.cleanString(field.name_short): field for field in fields}
+        self.names = []
+        # (position, is numeric, length to pad to) for each column, in file order
+        self.clean_plan = []
+        # (short name, required, type checker, max length) for each column, in file order
+        self.validate_plan = []
+        for position, header in sorted(header_dictionary.items()):
+            if header is None:
+                continue
+            field = fields_by_name[header]
+            field_type = FIELD_TYPE_DICT_ID.get(field.field_types_id)
+            if field.field_types_id is not None and field_type not in TYPE_CHECKERS and field_type != "STRING":
+                # Validator.checkType raises for types it doesn't know, so fail the same way, before reading rows
+                raise ValueError("Data Type Error, Type: {}, Field: {}".format(
+                    field_type or field.field_types_id, field.name_short))
+            pad_length = field.length if field.padded_flag and field.length is not None else None
+            self.names.append(field.name_short)
+            self.clean_plan.append((position, field_type in NUMERIC_TYPES, pad_length))
+            self.validate_plan.append((field.name_short, field.required, TYPE_CHECKERS.get(field_type), field.length))
+        self.missing_required = [field.name_short for name, field in sorted(fields_by_name.items())
+                                 if field.required and field.name_short not in self.names]
+        self.flex_plan = [(position, header) for position, header in sorted(flex_dictionary.items())
+                          if header is not None]
+
+    def clean(self, row):
+        """ Strips whitespace, replaces empty strings with None, and pads fields that need it
+
+        Args:
+            row: list of cells as read from the file
+
+        Returns:
+            List of cleaned values, in the same order as self.names
+        """
+        values = []
+        for position, numeric, pad_length in self.clean_plan:
+            value = row[position].strip()
+            if numeric and "," in value:
+                temp_value = value.replace(",", "")
+                if FieldCleaner.isNumeric(temp_value):
+                    value = temp_value
+            if not value:
+                value = None
+            elif pad_length is not None:
+                value = value.zfill(pad_length)
+            values.append(value)
+        return values
+
+    def get_flex(self, row):
+        """ Gets the flex column from a row read from the file
+
+        Returns:
+            dict with the flex column's header and cell, or an empty dict if there is no flex column
+        """
+        flex_dict = {}
+        for position, header in self.flex_plan:
+            flex_dict["header"] = header
+            flex_dict["cell"] = row[position] or None
+        return flex_dict
+
+    def validate(self, values):
+        """ Check cleaned values for required fields, data types and field lengths
+
+        Args:
+            values: list of cleaned values returned by clean
+
+        Returns:
+            Tuple of three values:
+            True if validation passed, False if failed
+            List of failed rules, each with field, description of failure, value that failed, rule label, and severity
+            True if type check passed, False if type failed
+        """
+        if self.missing_required:
+            return False, [[self.missing_required[0], ValidationError.requiredError, "", "", "fatal"]], False
+
+        record_failed = False
+        record_type_failure = False
+        failed_rules = []
+        blank_fields = 0
+        for value, (name, required, checker, length) in zip(values, self.validate_plan):
+            if value is None:
+                blank_fields += 1
+                if required:
+                    record_failed = True
+                    failed_rules.append([name, ValidationError.requiredError, "", "", "fatal"])
+                continue
+            if checker is not None and not checker(value):
+                record_type_failure = True
+                record_failed = True
+                failed_rules.append([name, ValidationError.typeError, value, "", "fatal"])
+                # Don't check value rules if type failed
+                continue
+            if length is not None and len(value) > length:
+                record_failed = True
+                failed_rules.append([name, ValidationError.lengthError, value, "", "warning"])
+
+        # if all columns are blank (empty row), don't add to the error messages or write the line, just ignore it
+        if blank_fields == len(values):
+            return True, failed_rules, False
+        return (not record_failed), failed_rules, (not record_type_failure)
+
+    def to_record(self, values):
+        """ Convert cleaned values into a dict keyed by short column name """
+        return dict(zip(self.names, values))
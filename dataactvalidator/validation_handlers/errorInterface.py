@@ -1,3 +1,4 @@
+from dataactcore.interfaces.function_bag import markSubmissionStatusChanged
 from dataactcore.models.errorModels import ErrorMetadata
 from dataactvalidator.validation_handlers.validationError import ValidationError
 
@@ -27,7 +28,7 @@ class ErrorInterface:
             target_file_id: Id of target file type
             severity_id: Id of error severity
         """
-        key = "".join([str(job_id), field_name, str(error_type)])
+        key = (job_id, field_name, error_type)
         if key in self.rowErrors:
             self.rowErrors[key]["numErrors"] += 1
         else:
@@ -38,54 +39,49 @@ class ErrorInterface:
             self.rowErrors[key] = errorDict
 
     def writeAllRowErrors(self, job_id):
-        """ Writes all recorded errors to database
+        """ Writes all recorded errors for a job to database in a single insert, then clears all recorded errors
 
         Args:
             job_id: ID to write errors for
         """
         sess = GlobalDB.db().session
-        for key in self.rowErrors.keys():
-            errorDict = self.rowErrors[key]
-            # Set info for this error
-            thisJob = errorDict["jobId"]
+        rows = []
+        for (thisJob, field_name, error_type), errorDict in self.rowErrors.items():
             if int(job_id) != int(thisJob):
                 # This row is for a different job, skip it
                 continue
-            field_name = errorDict["fieldName"]
-            try:
-                # If last part of key is an int, it's one of our prestored messages
-                error_type = int(errorDict["errorType"])
-            except ValueError:
-                # For rule failures, it will hold the error message
-                errorMsg = errorDict["errorType"]
-                if "Field must be no longer than specified limit" in errorMsg:
-                    ruleFailedId = ERROR_TYPE_DICT['length_error']
-                else:
-                    ruleFailedId = ERROR_TYPE_DICT['rule_failed']
-                errorRow = ErrorMetadata(job_id=thisJob, filename=errorDict["filename"], field_name=field_name,
-                                         error_type_id=ruleFailedId, rule_failed=errorMsg,
-                                         occurrences=errorDict["numErrors"], first_row=errorDict["firstRow"],
-                                         original_rule_label=errorDict["originalRuleLabel"],
-                                         file_type_id=errorDict["fileTypeId"],
-                                         target_file_type_id=errorDict["targetFileId"],
-                                         severity_id=errorDict["severity"])
-            else:
-                # This happens if cast to int was successful
-                errorString = ValidationError.getErrorTypeString(error_type)
-                errorId = ERROR_TYPE_DICT[errorString]
-                # Create error metadata
-                errorRow = ErrorMetadata(job_id=thisJob, filename=errorDict["filename"], field_name=field_name,
-                                         error_type_id=errorId, occurrences=errorDict["numErrors"],
-                                         first_row=errorDict["firstRow"],
-                                         rule_failed=ValidationError.getErrorMessage(error_type),
-                                         original_rule_label=errorDict["originalRuleLabel"],
-                                         file_type_id=errorDict["fileTypeId"],
-                                         target_file_type_id=errorDict["targetFileId"],
-                                         severity_id=errorDict["severity"])
-
-            sess.add(errorRow)
+            errorId, errorMsg = getErrorTypeAndMessage(error_type)
+            rows.append({"job_id": thisJob, "filename": errorDict["filename"], "field_name": field_name,
+                         "error_type_id": errorId, "rule_failed": errorMsg, "occurrences": errorDict["numErrors"],
+                         "first_row": errorDict["firstRow"], "original_rule_label": errorDict["originalRuleLabel"],
+                         "file_type_id": errorDict["fileTypeId"], "target_file_type_id": errorDict["targetFileId"],
+                         "severity_id": errorDict["severity"]})
 
+        if rows:
+            sess.execute(ErrorMetadata.__table__.insert().values(rows))
+            markSubmissionStatusChanged(job_id)
         # Commit the session to write all rows
         sess.commit()
         # Clear the dictionary
-        self.rowErrors = {}
\ No newline at end of file
+        self.rowErrors = {}
+
+
+def getErrorTypeAndMessage(error_type):
+    """ Resolve a recorded error type to the error_type_id and message stored in error_metadata
+
+    Args:
+        error_type: one of the ValidationError types, or for rule failures the rule's error message
+
+    Returns:
+        Tuple of error type id and error message
+    """
+    try:
+        # If it's an int, it's one of our prestored messages
+        error_type = int(error_type)
+    except ValueError:
+        # For rule failures, it will hold the error message
+        if "Field must be no longer than specified limit" in error_type:
+            return ERROR_TYPE_DICT['length_error'], error_type
+        return ERROR_TYPE_DICT['rule_failed'], error_type
+    errorString = ValidationError.getErrorTypeString(error_type)
+    return ERROR_TYPE_DICT[errorString], ValidationError.getErrorMessage(error_type)
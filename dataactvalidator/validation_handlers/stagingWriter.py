@@ -0,0 +1,178 @@
+import io
+import logging
+
+import psycopg2
+from sqlalchemy.exc import SQLAlchemyError
+
+from dataactcore.config import CONFIG_SERVICES
+from dataactcore.interfaces.db import GlobalDB
+
+
+logger = logging.getLogger(__name__)
+
+# Errors caused by the data being written, which mean a row (or a batch containing it) couldn't be staged. COPY
+# goes through the raw psycopg2 cursor, so its errors aren't wrapped by SQLAlchemy.
+WRITE_ERRORS = (SQLAlchemyError, psycopg2.DataError, psycopg2.IntegrityError)
+
+
+class _DefaultContext:
+    """Minimal stand-in for the execution context SQLAlchemy passes to
+    column default functions such as concatTas"""
+    def __init__(self, current_parameters):
+        self.current_parameters = current_parameters
+
+
+class StagingWriter:
+    """ Buffers records bound for a staging table and writes them in batches
+
+    Records are flushed every batch_size rows, either through PostgreSQL's
+    COPY FROM STDIN, through a single multi-row INSERT, or one INSERT per row.
+    If a batch cannot be written, it is retried one row at a time so that
+    only the offending rows are reported as write errors.
+    """
+    COPY = "copy"
+    INSERT = "insert"
+    ROW = "row"
+    METHODS = (COPY, INSERT, ROW)
+    BATCH_SIZE = 10000
+
+    def __init__(self, model, method=COPY, batch_size=None):
+        """
+        Args:
+            model: orm model for the staging table being written
+            method: one of StagingWriter.METHODS
+            batch_size: number of records to buffer before writing them
+        """
+        if method not in self.METHODS:
+            raise ValueError("Unknown staging write method: {}".format(method))
+        self.table = model.__table__
+        self.method = method
+        self.batch_size = batch_size or self.BATCH_SIZE
+        # primary keys are generated by the database
+        self.columns = [column for column in self.table.columns if not column.primary_key]
+        self.column_names = [column.name for column in self.columns]
+        self.rows = []
+        self.rows_written = 0
+
+    @property
+    def is_full(self):
+        """ True once a batch's worth of records is waiting to be written """
+        return len(self.rows) >= self.batch_size
+
+    def add(self, record):
+        """ Add a record to the buffer without writing anything
+
+        Args:
+            record: dict of column values, must include row_number
+        """
+        self.rows.append(self._build_row(record))
+
+    def write(self, record):
+        """ Add a record to the buffer, writing the batch if it is full
+
+        Args:
+            record: dict of column values, must include row_number
+
+        Returns:
+            List of row numbers that could not be written
+        """
+        self.add(record)
+        if self.is_full:
+            return self.flush()
+        return []
+
+    def flush(self):
+        """ Write all buffered records
+
+        Returns:
+            List of row numbers that could not be written
+        """
+        if not self.rows:
+            return []
+        rows, self.rows = self.rows, []
+        sess = GlobalDB.db().session
+        if self.method == self.ROW:
+            return self._write_rows(sess, rows)
+        # Use a savepoint so a failed batch doesn't discard anything else pending on the session
+        savepoint = sess.begin_nested()
+        try:
+            if self.method == self.COPY:
+                self._copy(sess, rows)
+            else:
+                sess.execute(self.table.insert().values(rows))
+            savepoint.commit()
+            sess.commit()
+        except WRITE_ERRORS as e:
+            savepoint.rollback()
+            logger.warning('Batch write to %s failed, retrying row by row: %s', self.table.name, e)
+            return self._write_rows(sess, rows)
+        self.rows_written += len(rows)
+        return []
+
+    def _write_rows(self, sess, rows):
+        """ Write records one at a time, returning the row numbers of those that failed """
+        failed_rows = []
+        for row in rows:
+            savepoint = sess.begin_nested()
+            try:
+                sess.execute(self.table.insert(), row)
+                savepoint.commit()
+                self.rows_written += 1
+            except WRITE_ERRORS:
+                savepoint.rollback()
+                failed_rows.append(row["row_number"])
+        sess.commit()
+        return failed_rows
+
+    def _build_row(self, record):
+        """ Convert a record into a full row for this table, applying column defaults (e.g. concatTas) the same
+        way an ORM insert would """
+        row = {name: record.get(name) for name in self.column_names}
+        context = _DefaultContext(row)
+        for column in self.columns:
+            if row[column.name] is None and column.default is not None:
+                if column.default.is_callable:
+                    row[column.name] = column.default.arg(context)
+                elif column.default.is_scalar:
+                    row[column.name] = column.default.arg
+        return row
+
+    def _copy(self, sess, rows):
+        """ Stream rows to the database with COPY FROM STDIN """
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write("\t".join(self._copy_value(row[name]) for name in self.column_names))
+            buffer.write("\n")
+        buffer.seek(0)
+        cursor = sess.connection().connection.cursor()
+        try:
+            cursor.copy_expert("COPY {} ({}) FROM STDIN".format(self.table.name, ", ".join(self.column_names)),
+                               buffer)
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _copy_value(value):
+        """ Format a value for COPY's text format """
+        if value is None:
+            return "\\N"
+        if value is True:
+            return "t"
+        if value is False:
+            return "f"
+        return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def get_staging_writer(file_type, model):
+    """ Create a StagingWriter using the configured write method for this file type
+
+    Args:
+        file_type: name of the file type being loaded
+        model: orm model for the staging table
+
+    Returns:
+        StagingWriter
+    """
+    methods = CONFIG_SERVICES.get('staging_write_method') or {}
+    return StagingWriter(model, methods.get(file_type, StagingWriter.COPY),
+                         CONFIG_SERVICES.get('staging_batch_size'))
@@ -1,16 +1,23 @@
+import csv
+import hashlib
+import json
 import os
 import logging
+import time
 
-from sqlalchemy import and_, or_
+from flask import Flask
+from sqlalchemy import and_, func, or_
 
-from dataactcore.config import CONFIG_BROKER
+from dataactcore.config import CONFIG_BROKER, CONFIG_SERVICES
 from dataactcore.interfaces.db import GlobalDB
-from dataactcore.models.lookups import FILE_TYPE, FILE_TYPE_DICT, RULE_SEVERITY_DICT
+from dataactcore.models.lookups import FILE_TYPE, FILE_TYPE_DICT, JOB_TYPE_DICT, RULE_SEVERITY_DICT
+from dataactcore.models.domainModels import CGAC, ObjectClass, ProgramActivity, SF133, TASLookup
 from dataactcore.models.jobModels import Submission
 from dataactcore.models.validationModels import FileColumn
 from dataactcore.interfaces.function_bag import (
     createFileIfNeeded, writeFileError, markFileComplete, run_job_checks,
-    mark_job_status, sumNumberOfErrorsForJobList, populateSubmissionErrorInfo
+    mark_job_status, markSubmissionStatusChanged, populateSubmissionErrorInfo, get_cross_file_pair,
+    get_file_hash, get_file_size, restore_validation_results
 )
 from dataactcore.models.errorModels import ErrorMetadata
 from dataactcore.models.jobModels import Job
@@ -26,15 +33,20 @@ from dataactvalidator.filestreaming.csvS3Reader import CsvS3Reader
 from dataactvalidator.filestreaming.csvLocalReader import CsvLocalReader
 from dataactvalidator.filestreaming.csvLocalWriter import CsvLocalWriter
 from dataactvalidator.filestreaming.csvS3Writer import CsvS3Writer
+from dataactvalidator.validation_handlers.compiledSchema import CompiledSchema
 from dataactvalidator.validation_handlers.errorInterface import ErrorInterface
+from dataactvalidator.validation_handlers.stagingWriter import get_staging_writer
 from dataactvalidator.validation_handlers.validator import Validator
 from dataactvalidator.validation_handlers.validationError import ValidationError
-from dataactvalidator.filestreaming.fieldCleaner import FieldCleaner
 from dataactcore.models.validationModels import RuleSql
 
 
 logger = logging.getLogger(__name__)
 
+# Tables validating a file reads besides its own staging table: its schema, the rules, and the domain data the rules
+# and TAS matching check it against
+VALIDATION_DATA_MODELS = (FileColumn, RuleSql, TASLookup, SF133, CGAC, ObjectClass, ProgramActivity)
+
 
 class ValidationManager:
     """
@@ -82,21 +94,18 @@ class ValidationManager:
         # Forcing forward slash here instead of using os.path to write a valid path for S3
         return "".join(["errors/", path])
 
-    def readRecord(self,reader,writer,file_type,row_number,job,fields,error_list):
-        """ Read and process the next record
+    def readRecord(self,reader,row_number,schema):
+        """ Read and process the next record. A row which can't be read is reported through the fifth element of
+        the result rather than written here, so the caller can keep errors in row order (see writeReadError)
 
         Args:
             reader: CsvReader object
-            writer: CsvWriter object
-            file_type: Type of file for current job
             row_number: Next row number to be read
-            job_id: ID of current job
-            fields: List of FileColumn objects for this file type
-            error_list: instance of ErrorInterface to keep track of errors
+            schema: CompiledSchema for this file
 
         Returns:
             Tuple with six elements:
-            1. Dict of record after preprocessing
+            1. List of record values after preprocessing, ordered as schema.names
             2. Boolean indicating whether to reduce row count
             3. Boolean indicating whether to skip row
             4. Boolean indicating whether to stop reading
@@ -105,63 +114,85 @@ class ValidationManager:
         """
         reduce_row = False
         row_error_found = False
-        job_id = job.job_id
         try:
-            (next_record, flex_cols) = reader.get_next_record()
-            record = FieldCleaner.cleanRow(next_record, self.long_to_short_dict, fields)
-            record["row_number"] = row_number
+            next_row = reader.get_next_row()
+            record = schema.clean(next_row)
+            flex_cols = schema.get_flex(next_row)
             if flex_cols:
                 flex_cols["row_number"] = row_number
 
-            if reader.is_finished and len(record) < 2:
+            if reader.is_finished and len(record) < 1:
                 # This is the last line and is empty, don't record an error
-                return {}, True, True, True, False, {}  # Don't count this row
+                return [], True, True, True, False, {}  # Don't count this row
         except ResponseException:
             if reader.is_finished and reader.extra_line:
                 #Last line may be blank don't record an error, reader.extra_line indicates a case where the last valid line has extra line breaks
                 # Don't count last row if empty
                 reduce_row = True
             else:
-                writer.write(["Formatting Error", ValidationError.readErrorMsg, str(row_number), ""])
-                error_list.recordRowError(job_id, job.filename, "Formatting Error", ValidationError.readError,
-                                          row_number, severity_id=RULE_SEVERITY_DICT['fatal'])
                 row_error_found = True
 
-            return {}, reduce_row, True, False, row_error_found, {}
+            return [], reduce_row, True, False, row_error_found, {}
         return record, reduce_row, False, False, row_error_found, flex_cols
 
-    def writeToStaging(self, record, job, submission_id, passed_validations, writer, row_number, model, error_list):
-        """ Write this record to the staging tables
+    def writeToStaging(self, record, job, submission_id, passed_validations, staging_writer):
+        """ Buffer this record for the staging tables; it's written with the rest of its batch
 
         Args:
             record: Record to be written
             job: Current job
             submission_id: ID of current submission
             passed_validations: True if record has not failed first validations
+            staging_writer: StagingWriter for the current file's staging table
+        """
+        record["job_id"] = job.job_id
+        record["submission_id"] = submission_id
+        record["valid_record"] = passed_validations
+        staging_writer.add(record)
+
+    def writeReadError(self, job, writer, row_number, error_list):
+        """ Record an error for a row that could not be read """
+        writer.write(["Formatting Error", ValidationError.readErrorMsg, str(row_number), ""])
+        error_list.recordRowError(job.job_id, job.filename, "Formatting Error", ValidationError.readError,
+                                  row_number, severity_id=RULE_SEVERITY_DICT['fatal'])
+
+    def writeStagingError(self, job, writer, row_number, error_list):
+        """ Record an error for a row that could not be written to staging """
+        writer.write(["Formatting Error", ValidationError.writeErrorMsg, str(row_number), ""])
+        error_list.recordRowError(job.job_id, job.filename, "Formatting Error", ValidationError.writeError,
+                                  row_number, severity_id=RULE_SEVERITY_DICT['fatal'])
+
+    def writePendingErrors(self, pending_errors, failed_rows, job, writer, warning_writer, error_list):
+        """ Write the errors held back for rows in the batch just written to staging, in row order. A row that
+        couldn't be staged gets a single write error in place of its other errors, as when rows were written one
+        at a time.
+
+        Args:
+            pending_errors: List of (row number, failures) in row order, where failures is None for a row that
+                couldn't be read
+            failed_rows: Row numbers that could not be written to the staging or flex field tables
+            job: Current job
             writer: CsvWriter object
-            row_number: Current row number
-            model: orm model for the current file
+            warning_writer: CsvWriter object
             error_list: instance of ErrorInterface to keep track of errors
 
         Returns:
-            Boolean indicating whether to skip current row
+            List of row numbers with fatal errors
         """
-        sess = GlobalDB.db().session
-        job_id = job.job_id
-        try:
-            record["job_id"] = job_id
-            record["submission_id"] = submission_id
-            record["valid_record"] = passed_validations
-            sess.add(model(**record))
-            sess.commit()
-
-        except ResponseException:
-            # Write failed, move to next record
-            writer.write(["Formatting Error", ValidationError.writeErrorMsg, row_number,""])
-            error_list.recordRowError(job_id, job.filename,
-                "Formatting Error", ValidationError.writeError, row_number, severity_id=RULE_SEVERITY_DICT['fatal'])
-            return True
-        return False
+        failed_rows = set(failed_rows)
+        error_rows = []
+        pending_rows = dict(pending_errors)
+        for row_number in sorted(failed_rows.union(pending_rows)):
+            if row_number in failed_rows:
+                self.writeStagingError(job, writer, row_number, error_list)
+                error_rows.append(row_number)
+            elif pending_rows[row_number] is None:
+                self.writeReadError(job, writer, row_number, error_list)
+                error_rows.append(row_number)
+            elif self.writeErrors(pending_rows[row_number], job, self.short_to_long_dict, writer, warning_writer,
+                                  row_number, error_list):
+                error_rows.append(row_number)
+        return error_rows
 
     def writeErrors(self, failures, job, short_colnames, writer, warning_writer, row_number, error_list):
         """ Write errors to error database
@@ -207,25 +238,18 @@ class ValidationManager:
             error_list.recordRowError(job_id,job.filename,field_name,error,row_number,original_rule_label,severity_id=severityId)
         return fatal_error_found
 
-    def write_to_flex(self, flex_cols, job_id, submission_id, file_type):
-        """ Write this record to the staging tables
+    def write_to_flex(self, flex_cols, job_id, submission_id, flex_writer):
+        """ Buffer this record's flex columns for the flex_field table; they're written with the rest of the batch
 
         Args:
             flex_cols: Record to be written
             job_id: ID of current job
             submission_id: ID of current submission
-            file_type: Type of file for current job
-
-        Returns:
-            Boolean indicating whether to skip current row
+            flex_writer: StagingWriter for the flex_field table
         """
-        sess = GlobalDB.db().session
-
         flex_cols["job_id"] = job_id
         flex_cols["submission_id"] = submission_id
-
-        sess.add(FlexField(**flex_cols))
-        sess.commit()
+        flex_writer.add(flex_cols)
 
     def runValidation(self, job):
         """ Run validations for specified job
@@ -247,18 +271,41 @@ class ValidationManager:
 
         rowNumber = 1
         fileType = job.file_type.name
+        fileName = job.filename
         # Get orm model for this file
         model = [ft.model for ft in FILE_TYPE if ft.name == fileType][0]
 
-        # Clear existing records for this submission
+        # Validating the same file against the same rules and data as last time would give the same results, so keep
+        # the staged rows, errors and reports from then
+        fileHash = get_file_hash(fileName)
+        version = validation_version(job)
+        if fileHash is not None and (job.file_hash, job.validation_version) == (fileHash, version):
+            logger.info('VALIDATOR_INFO: File for job_id %s is unchanged since it was validated, keeping its results',
+                        job_id)
+            job.file_size = get_file_size(fileName)
+            if job.previous_results is not None:
+                restore_validation_results(job)
+            markSubmissionStatusChanged(job_id)
+            sess.commit()
+            populateSubmissionErrorInfo(submission_id)
+            mark_job_status(job_id, "finished")
+            markFileComplete(job_id, fileName)
+            return True
+
+        # Clear existing records and results for this submission
+        job.file_hash = None
+        job.validation_version = None
+        job.previous_results = None
+        job.number_of_rows = None
         sess.query(model).filter_by(submission_id=submission_id).delete()
+        sess.query(ErrorMetadata).filter_by(job_id=job_id).delete()
+        markSubmissionStatusChanged(job_id)
         sess.commit()
 
         # If local, make the error report directory
         if self.isLocal and not os.path.exists(self.directory):
             os.makedirs(self.directory)
         # Get bucket name and file name
-        fileName = job.filename
         bucketName = CONFIG_BROKER['aws_bucket']
         regionName = CONFIG_BROKER['aws_region']
 
@@ -286,21 +333,28 @@ class ValidationManager:
         for field in fields:
             sess.expunge(field)
 
-        csvSchema = {row.name_short: row for row in fields}
+        staging_writer = get_staging_writer(fileType, model)
+        flex_writer = get_staging_writer(fileType, FlexField)
 
         try:
             # Pull file and return info on whether it's using short or long col headers
             reader.open_file(regionName, bucketName, fileName, fields,
                              bucketName, errorFileName, self.long_to_short_dict)
+            # Build the cleaning and basic validation plan for this file's columns
+            schema = CompiledSchema(fields, reader.header_dictionary, reader.flex_dictionary)
 
             # list to keep track of rows that fail validations
             errorRows = []
+            # Errors for rows read since the last batch was written to staging, as (row number, failures). They're
+            # held back until the batch is written so rows that can't be staged get a write error instead.
+            pendingErrors = []
 
             # While not done, pull one row and put it into staging table if it passes
             # the Validator
 
             with self.getWriter(regionName, bucketName, errorFileName, self.reportHeaders) as writer, \
                  self.getWriter(regionName, bucketName, warningFileName, self.reportHeaders) as warningWriter:
+                load_start = time.time()
                 while not reader.is_finished:
                     rowNumber += 1
 
@@ -312,11 +366,11 @@ class ValidationManager:
                     # first phase of validations: read record and record a
                     # formatting error if there's a problem
                     #
-                    (record, reduceRow, skipRow, doneReading, rowErrorHere, flex_cols) = self.readRecord(reader, writer, fileType, rowNumber, job, fields, error_list)
+                    (record, reduceRow, skipRow, doneReading, rowErrorHere, flex_cols) = self.readRecord(reader, rowNumber, schema)
                     if reduceRow:
                         rowNumber -= 1
                     if rowErrorHere:
-                        errorRows.append(rowNumber)
+                        pendingErrors.append((rowNumber, None))
                     if doneReading:
                         # Stop reading from input file
                         break
@@ -335,25 +389,36 @@ class ValidationManager:
                         passedValidations = True
                         valid = True
                     else:
-                        passedValidations, failures, valid = Validator.validate(record, csvSchema)
+                        passedValidations, failures, valid = schema.validate(record)
                     if valid:
-                        skipRow = self.writeToStaging(
-                            record, job, submission_id, passedValidations,
-                            writer, rowNumber, model, error_list)
+                        stagingRecord = schema.to_record(record)
+                        stagingRecord["row_number"] = rowNumber
+                        self.writeToStaging(stagingRecord, job, submission_id, passedValidations, staging_writer)
                         if flex_cols:
-                            self.write_to_flex(flex_cols, job_id, submission_id, fileType)
-
-                        if skipRow:
-                            errorRows.append(rowNumber)
-                            continue
+                            self.write_to_flex(flex_cols, job_id, submission_id, flex_writer)
 
                     if not passedValidations:
-                        if self.writeErrors(failures, job, self.short_to_long_dict, writer, warningWriter, rowNumber, error_list):
-                            errorRows.append(rowNumber)
-
+                        pendingErrors.append((rowNumber, failures))
+
+                    # Write the batch once it's full, or once a batch's worth of errors is held back waiting for it
+                    if staging_writer.is_full or flex_writer.is_full or \
+                            len(pendingErrors) >= staging_writer.batch_size:
+                        failedRows = staging_writer.flush() + flex_writer.flush()
+                        errorRows.extend(self.writePendingErrors(
+                            pendingErrors, failedRows, job, writer, warningWriter, error_list))
+                        pendingErrors = []
+
+                # Write any rows still waiting in the staging buffers
+                failedRows = staging_writer.flush() + flex_writer.flush()
+                errorRows.extend(self.writePendingErrors(
+                    pendingErrors, failedRows, job, writer, warningWriter, error_list))
+
+                load_seconds = time.time() - load_start
                 logger.info(
                     'VALIDATOR_INFO: Loading complete on job_id: %s. '
-                    'Total rows added to staging: %s', job_id, rowNumber)
+                    'Total rows added to staging: %s (%s rows/sec using %s)', job_id,
+                    staging_writer.rows_written, int(staging_writer.rows_written / max(load_seconds, 0.001)),
+                    staging_writer.method)
 
                 if fileType in ('appropriations', 'program_activity',
                                 'award_financial'):
@@ -384,6 +449,9 @@ class ValidationManager:
             error_list.writeAllRowErrors(job_id)
             # Update error info for submission
             populateSubmissionErrorInfo(submission_id)
+            # Remember what was validated, so these results can be kept if the same file is uploaded again
+            job.file_hash = fileHash
+            job.validation_version = version
             # Mark validation as finished in job tracker
             mark_job_status(job_id, "finished")
             markFileComplete(job_id, fileName)
@@ -448,64 +516,33 @@ class ValidationManager:
         return error_rows
 
     def runCrossValidation(self, job):
-        """ Cross file validation job, test all rules with matching rule_timing """
+        """ Cross file validation job. The cross-file rules are checked by the submission's cross_file_pair jobs,
+        which record their errors against this job; once they're all done, this works out the submission's totals.
+        Submissions without pair jobs have every pair checked here instead.
+        """
         sess = GlobalDB.db().session
         job_id = job.job_id
         # Create File Status object
         createFileIfNeeded(job_id)
-        error_list = ErrorInterface()
-        
+
         submission_id = job.submission_id
-        bucketName = CONFIG_BROKER['aws_bucket']
-        regionName = CONFIG_BROKER['aws_region']
         logger.info(
             'VALIDATOR_INFO: Beginning runCrossValidation on submission_id: '
             '%s', submission_id)
 
-        # Delete existing cross file errors for this submission
-        sess.query(ErrorMetadata).filter(ErrorMetadata.job_id == job_id).delete()
-        sess.commit()
-
-        # get all cross file rules from db
-        crossFileRules = sess.query(RuleSql).filter(RuleSql.rule_cross_file_flag==True)
-
-        # for each cross-file combo, run associated rules and create error report
-        for c in get_cross_file_pairs():
-            first_file = c[0]
-            second_file = c[1]
-            comboRules = crossFileRules.filter(or_(and_(
-                RuleSql.file_id==first_file.id,
-                RuleSql.target_file_id==second_file.id), and_(
-                RuleSql.file_id==second_file.id,
-                RuleSql.target_file_id==first_file.id)))
-            # send comboRules to validator.crossValidate sql
-            failures = Validator.crossValidateSql(comboRules.all(), submission_id, self.short_to_long_dict)
-            # get error file name
-            reportFilename = self.getFileName(get_cross_report_name(submission_id, first_file.name, second_file.name))
-            warningReportFilename = self.getFileName(get_cross_warning_report_name(submission_id, first_file.name, second_file.name))
-
-            # loop through failures to create the error report
-            with self.getWriter(regionName, bucketName, reportFilename, self.crossFileReportHeaders) as writer, \
-                 self.getWriter(regionName, bucketName, warningReportFilename, self.crossFileReportHeaders) as warningWriter:
-                for failure in failures:
-                    if failure[9] == RULE_SEVERITY_DICT['fatal']:
-                        writer.write(failure[0:7])
-                    if failure[9] == RULE_SEVERITY_DICT['warning']:
-                        warningWriter.write(failure[0:7])
-                    error_list.recordRowError(job_id, "cross_file",
-                        failure[0], failure[3], failure[5], failure[6], failure[7], failure[8], severity_id=failure[9])
-                writer.finishBatch()
-                warningWriter.finishBatch()
+        pair_jobs = sess.query(Job).filter_by(submission_id=submission_id,
+                                              job_type_id=JOB_TYPE_DICT['cross_file_pair'])
+        if not sess.query(pair_jobs.exists()).scalar():
+            for first_file, second_file in get_cross_file_pairs():
+                self.validateCrossFilePair(job, first_file, second_file)
 
-        error_list.writeAllRowErrors(job_id)
         mark_job_status(job_id, "finished")
         logger.info(
             'VALIDATOR_INFO: Completed runCrossValidation on submission_id: '
             '%s', submission_id)
-        submission = sess.query(Submission).filter_by(submission_id = submission_id).one()
         # Update error info for submission
-        submission.number_of_errors = sumNumberOfErrorsForJobList(submission_id)
-        submission.number_of_warnings = sumNumberOfErrorsForJobList(submission_id, errorType="warning")
+        populateSubmissionErrorInfo(submission_id)
+        submission = sess.query(Submission).filter_by(submission_id = submission_id).one()
         # TODO: Remove temporary step below
         # Temporarily set publishable flag at end of cross file, remove this once users are able to mark their submissions
         # as publishable
@@ -517,6 +554,68 @@ class ValidationManager:
         # Mark validation complete
         markFileComplete(job_id)
 
+    def runCrossFilePairValidation(self, job):
+        """ Cross file pair job: check the cross-file rules between the two files it depends on, recording errors
+        against the submission's cross-file job """
+        sess = GlobalDB.db().session
+        first_file, second_file = get_cross_file_pair(job.job_id)
+        cross_file_job = sess.query(Job).filter_by(submission_id=job.submission_id,
+                                                   job_type_id=JOB_TYPE_DICT['validation']).one()
+        logger.info('VALIDATOR_INFO: Beginning cross-file validation of %s and %s on submission_id: %s',
+                    first_file.name, second_file.name, job.submission_id)
+        self.validateCrossFilePair(cross_file_job, first_file, second_file)
+        mark_job_status(job.job_id, "finished")
+
+    def validateCrossFilePair(self, cross_file_job, first_file, second_file):
+        """ Check the cross-file rules between two files, writing their error reports and replacing the pair's errors
+        recorded against the submission's cross-file job
+
+        Args:
+            cross_file_job: the submission's cross-file (validation) job
+            first_file: file type, as in lookups.FILE_TYPE, first in the pair
+            second_file: the pair's other file type
+        """
+        sess = GlobalDB.db().session
+        job_id = cross_file_job.job_id
+        submission_id = cross_file_job.submission_id
+        bucketName = CONFIG_BROKER['aws_bucket']
+        regionName = CONFIG_BROKER['aws_region']
+        error_list = ErrorInterface()
+        pair_ids = (first_file.id, second_file.id)
+
+        # Delete existing cross file errors for this pair
+        sess.query(ErrorMetadata).filter(ErrorMetadata.job_id == job_id, ErrorMetadata.file_type_id.in_(pair_ids),
+                                         ErrorMetadata.target_file_type_id.in_(pair_ids)).\
+            delete(synchronize_session=False)
+        markSubmissionStatusChanged(job_id)
+        sess.commit()
+
+        comboRules = sess.query(RuleSql).filter(RuleSql.rule_cross_file_flag==True, or_(and_(
+            RuleSql.file_id==first_file.id,
+            RuleSql.target_file_id==second_file.id), and_(
+            RuleSql.file_id==second_file.id,
+            RuleSql.target_file_id==first_file.id)))
+        # send comboRules to validator.crossValidate sql
+        failures = Validator.crossValidateSql(comboRules.all(), submission_id, self.short_to_long_dict)
+        # get error file name
+        reportFilename = self.getFileName(get_cross_report_name(submission_id, first_file.name, second_file.name))
+        warningReportFilename = self.getFileName(get_cross_warning_report_name(submission_id, first_file.name, second_file.name))
+
+        # loop through failures to create the error report
+        with self.getWriter(regionName, bucketName, reportFilename, self.crossFileReportHeaders) as writer, \
+             self.getWriter(regionName, bucketName, warningReportFilename, self.crossFileReportHeaders) as warningWriter:
+            for failure in failures:
+                if failure[9] == RULE_SEVERITY_DICT['fatal']:
+                    writer.write(failure[0:7])
+                if failure[9] == RULE_SEVERITY_DICT['warning']:
+                    warningWriter.write(failure[0:7])
+                error_list.recordRowError(job_id, "cross_file",
+                    failure[0], failure[3], failure[5], failure[6], failure[7], failure[8], severity_id=failure[9])
+            writer.finishBatch()
+            warningWriter.finishBatch()
+
+        error_list.writeAllRowErrors(job_id)
+
     def validate_job(self, request):
         """ Gets file for job, validates each row, and sends valid rows to a staging table
         Args:
@@ -524,9 +623,6 @@ class ValidationManager:
         Returns:
         Http response object
         """
-        # Create connection to job tracker database
-        sess = GlobalDB.db().session
-
         requestDict = RequestDictionary(request)
         if requestDict.exists('job_id'):
             job_id = requestDict.getValue('job_id')
@@ -537,6 +633,18 @@ class ValidationManager:
                                     StatusCode.CLIENT_ERROR, None,
                                     validation_error_type)
 
+        self.validate_job_id(job_id)
+        return JsonResponse.create(StatusCode.OK, {"message":"Validation complete"})
+
+    def validate_job_id(self, job_id):
+        """ Checks a job can be run, then runs it: validating each row of its file and sending valid rows to a
+        staging table, or running cross-file validations
+        Args:
+        job_id -- ID of the validation job to run
+        """
+        # Create connection to job tracker database
+        sess = GlobalDB.db().session
+
         # Get the job
         job = sess.query(Job).filter_by(job_id=job_id).one_or_none()
         if job is None:
@@ -555,7 +663,7 @@ class ValidationManager:
                                     validation_error_type)
 
         # Make sure this is a validation job
-        if job.job_type.name in ('csv_record_validation', 'validation'):
+        if job.job_type.name in ('csv_record_validation', 'validation', 'cross_file_pair'):
             job_type_name = job.job_type.name
         else:
             validation_error_type = ValidationError.jobError
@@ -571,11 +679,97 @@ class ValidationManager:
             self.runValidation(job)
         elif job_type_name == 'validation':
             self.runCrossValidation(job)
+        elif job_type_name == 'cross_file_pair':
+            self.runCrossFilePairValidation(job)
         else:
             raise ResponseException("Bad job type for validator",
                 StatusCode.INTERNAL_ERROR)
 
-        return JsonResponse.create(StatusCode.OK, {"message":"Validation complete"})
+
+def validation_failure_status(error):
+    """ Job status and HTTP status code for an error raised while running a validation job
+
+    Args:
+        error: the exception raised
+
+    Returns:
+        Tuple of the status to mark the job with (None to leave it alone) and the HTTP status code
+    """
+    if isinstance(error, ResponseException):
+        # Job errors mean the job wasn't in a state to be validated, so its status is left as is
+        job_status = None if error.errorType == ValidationError.jobError else 'invalid'
+        return job_status, error.status
+    # csv-specific errors get a different job status and response code
+    if isinstance(error, (ValueError, csv.Error)):
+        return 'invalid', StatusCode.CLIENT_ERROR
+    return 'failed', StatusCode.INTERNAL_ERROR
+
+
+def record_validation_failure(job, error):
+    """ Write the file-level error for a validation job which raised an error, and update the job's status
+
+    Args:
+        job: Job that was being validated
+        error: the exception raised
+    """
+    if job.filename is not None:
+        if isinstance(error, ResponseException):
+            writeFileError(job.job_id, job.filename, error.errorType, error.extraInfo)
+        else:
+            writeFileError(job.job_id, job.filename, ValidationError.unknownError)
+    job_status, _ = validation_failure_status(error)
+    if job_status:
+        mark_job_status(job.job_id, job_status)
+
+
+
+def run_validation_job(job_id):
+    """ Run a validation job in this process, recording any failure the same way the validator's error handlers do
+
+    Args:
+        job_id: ID of the validation job to run
+
+    Returns:
+        the message the validator's /validate/ route would respond with
+    """
+    with Flask(__name__).app_context():
+        try:
+            validation_manager = ValidationManager(CONFIG_BROKER['local'], CONFIG_SERVICES['error_report_path'])
+            validation_manager.validate_job_id(job_id)
+        except Exception as e:
+            logger.exception('Validation of job %s failed', job_id)
+            sess = GlobalDB.db().session
+            # Discard anything left half-written by the failed validation
+            sess.rollback()
+            job = sess.query(Job).filter_by(job_id=job_id).one_or_none()
+            if job:
+                record_validation_failure(job, e)
+            return {'message': str(e)}
+        finally:
+            GlobalDB.close()
+    logger.info('Job %s has completed validation', job_id)
+    return {'message': 'Validation complete'}
+
+def validation_version(job):
+    """ Identify the version of everything besides the file itself that validating a job's file depends on: the
+    submission's agency and reporting period, and the row count and latest update of each table in
+    VALIDATION_DATA_MODELS. Reloading one of those tables replaces or updates its rows, so changes one or the other.
+
+    Args:
+        job: the csv_record_validation job
+
+    Returns:
+        a hash of the version, to compare with the one stored on the job when its file was last validated
+    """
+    sess = GlobalDB.db().session
+    submission = job.submission
+    version = [job.file_type_id, submission.cgac_code, str(submission.reporting_start_date),
+               str(submission.reporting_end_date), submission.reporting_fiscal_year,
+               submission.reporting_fiscal_period, submission.is_quarter_format]
+    for model in VALIDATION_DATA_MODELS:
+        count, updated_at = sess.query(func.count(), func.max(model.updated_at)).one()
+        version.extend([model.__tablename__, count, str(updated_at)])
+    return hashlib.sha1(json.dumps(version).encode()).hexdigest()
 
 def update_tas_ids(model, submission_id):
     sess = GlobalDB.db().session
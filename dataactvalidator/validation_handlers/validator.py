@@ -1,6 +1,13 @@
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
 import logging
+import time
 
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from dataactcore.config import CONFIG_SERVICES
+from dataactcore.models.jobModels import Job
 from dataactcore.models.lookups import (FIELD_TYPE_DICT_ID, FILE_TYPE_DICT_ID, FILE_TYPE_DICT)
 from dataactcore.models.stagingModels import FlexField
 from dataactcore.models.validationModels import RuleSql
@@ -9,6 +16,9 @@ from dataactcore.interfaces.db import GlobalDB
 
 logger = logging.getLogger(__name__)
 
+# Most row numbers to look up in a single flex field query
+FLEX_QUERY_SIZE = 10000
+
 class Validator(object):
     """
     Checks individual records against specified validation tests
@@ -30,6 +40,8 @@ class Validator(object):
         # Put each rule through evaluate, appending all failures into list
         conn = GlobalDB.db().connection
 
+        rule_results = []
+        failed_rows = {}
         for rule in rules:
             failedRows = conn.execute(
                 rule.rule_sql.format(submissionId))
@@ -39,14 +51,21 @@ class Validator(object):
                 # validated, so exclude it
                 cols = failedRows.keys()
                 cols.remove('row_number')
-                columnString = ", ".join(short_to_long_dict[c] if c in short_to_long_dict else c for c in cols)
-                for row in failedRows:
-                    # get list of values for each column
-                    values = ["{}: {}".format(short_to_long_dict[c], str(row[c])) if c in short_to_long_dict else "{}: {}".format(c, str(row[c])) for c in cols]
-                    values = ", ".join(values)
-                    targetFileType = FILE_TYPE_DICT_ID[rule.target_file_id]
-                    failures.append([rule.file.name, targetFileType, columnString,
-                        str(rule.rule_error_message), values, row['row_number'],str(rule.rule_label),rule.file_id,rule.target_file_id,rule.rule_severity_id])
+                rows = failedRows.fetchall()
+                rule_results.append((rule, cols, rows))
+                failed_rows.setdefault(rule.file_id, set()).update(row['row_number'] for row in rows)
+
+        # Flex columns for the failing rows of each source file, loaded once for all rules
+        flex_fields = {file_id: getFlexFieldsByRow(submissionId, file_id, row_numbers)
+                       for file_id, row_numbers in failed_rows.items()}
+
+        for rule, cols, rows in rule_results:
+            targetFileType = FILE_TYPE_DICT_ID[rule.target_file_id]
+            for row in rows:
+                columnString, values = describeFailure(cols, row, short_to_long_dict,
+                                                       flex_fields[rule.file_id].get(row['row_number']))
+                failures.append([rule.file.name, targetFileType, columnString,
+                    str(rule.rule_error_message), values, row['row_number'],str(rule.rule_label),rule.file_id,rule.target_file_id,rule.rule_severity_id])
 
         # Return list of cross file validation failures
         return failures
@@ -195,45 +214,179 @@ class Validator(object):
         # Pull all SQL rules for this file type
         fileId = FILE_TYPE_DICT[fileType]
         rules = sess.query(RuleSql).filter(RuleSql.file_id == fileId).filter(
-            RuleSql.rule_cross_file_flag == False).all()
+            RuleSql.rule_cross_file_flag == False).order_by(RuleSql.rule_sql_id).all()
         errors = []
 
-        # For each rule, execute sql for rule
-        for rule in rules:
-            logger.info(
-                'VALIDATOR_INFO: Running query: %s on submissionId %s, '
-                'fileType: %s', rule.query_name, submission_id, fileType)
-            failures = sess.execute(rule.rule_sql.format(submission_id))
-            if failures.rowcount:
-                # Create column list (exclude row_number)
-                cols = failures.keys()
-                cols.remove("row_number")
-
-                # Create flex column list
-                flex_dict = {}
-                flex_results = sess.query(FlexField).filter_by(submission_id=submission_id)
+        # Results come back in rule order, however many rules ran at once
+        results = cls.runSqlRules(rules, submission_id, fileType)
 
-                for flex_row in flex_results:
-                    flex_dict[flex_row.row_number] = flex_row
+        # Flex columns are only needed for rows that failed, so load those once for all rules
+        failed_rows = {failure["row_number"] for _, _, failures in results for failure in failures}
+        flex_fields = getFlexFieldsByRow(submission_id, fileId, failed_rows)
 
+        for rule, cols, failures in results:
+            if failures:
+                # Create column list (exclude row_number)
+                cols.remove("row_number")
 
                 # Build error list
                 for failure in failures:
                     errorMsg = rule.rule_error_message
                     row = failure["row_number"]
-                    # Create strings for fields and values
-                    valueList = ["{}: {}".format(short_to_long_dict[field], str(failure[field])) if field in short_to_long_dict else "{}: {}".format(field, str(failure[field])) for field in cols]
-                    if flex_dict and flex_dict[row]:
-                        valueList.append("{}: {}".format(flex_dict[row].header, flex_dict[row].cell))
-                    valueString = ", ".join(valueList)
-                    fieldList = [short_to_long_dict[field] if field in short_to_long_dict else field for field in cols]
-                    if flex_dict and flex_dict[row]:
-                        fieldList.append(flex_dict[row].header)
-                    fieldString = ", ".join(fieldList)
+                    fieldString, valueString = describeFailure(cols, failure, short_to_long_dict, flex_fields.get(row))
                     errors.append([fieldString, errorMsg, valueString, row, rule.rule_label, fileId, rule.target_file_id, rule.rule_severity_id])
 
-            logger.info(
-                'VALIDATOR_INFO: Completed SQL validation rules on '
-                'submissionID: %s, fileType: %s', submission_id, fileType)
+        logger.info(
+            'VALIDATOR_INFO: Completed SQL validation rules on '
+            'submissionID: %s, fileType: %s', submission_id, fileType)
 
         return errors
+
+    @classmethod
+    def runSqlRules(cls, rules, submission_id, fileType):
+        """ Run each rule's query, several at a time if sql_rule_workers is configured
+
+        Rules are independent read-only queries, so they're spread across a pool of connections. When
+        sql_rule_snapshot is on (the default), every connection reads the same exported snapshot, so all rules see
+        the same staging data.
+
+        Args:
+            rules: list of RuleSql objects to run
+            submission_id: submission to be checked
+            fileType: file type being checked, for logging
+
+        Returns:
+            List of (rule, column names, failed rows) tuples, in the same order as rules
+        """
+        workers = min(CONFIG_SERVICES.get('sql_rule_workers') or 1, len(rules))
+        start = time.time()
+        if workers <= 1:
+            sess = GlobalDB.db().session
+            results = [_timedQuery(sess, rule, submission_id) for rule in rules]
+        else:
+            engine = GlobalDB.db().engine
+            snapshot = _SnapshotExporter(engine) if CONFIG_SERVICES.get('sql_rule_snapshot', True) else None
+            try:
+                snapshot_id = snapshot.export() if snapshot else None
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    futures = [executor.submit(_runOnSnapshot, engine, snapshot_id, rule, submission_id)
+                               for rule in rules]
+                    results = [future.result() for future in futures]
+            finally:
+                if snapshot:
+                    snapshot.close()
+
+        for rule, (cols, failures, duration) in zip(rules, results):
+            logger.info(
+                'VALIDATOR_INFO: Query %s on submissionID %s, fileType: %s took %.3f seconds, %s failures',
+                rule.query_name, submission_id, fileType, duration, len(failures))
+        if results:
+            slowest_rule, (_, _, slowest_duration) = max(zip(rules, results), key=lambda result: result[1][2])
+            logger.info(
+                'VALIDATOR_INFO: Ran %s SQL rules with %s workers on submissionID %s, fileType: %s in %.3f seconds, '
+                'slowest was %s at %.3f seconds', len(rules), workers, submission_id, fileType, time.time() - start,
+                slowest_rule.query_name, slowest_duration)
+        return [(rule, cols, failures) for rule, (cols, failures, _) in zip(rules, results)]
+
+
+def getFlexFieldsByRow(submission_id, file_type_id, row_numbers):
+    """ Get the flex column of each of the given rows of a submission's file
+
+    Only rows that failed a rule need their flex column, so just those are loaded, keeping memory proportional to the
+    number of failing rows rather than the size of the file.
+
+    Args:
+        submission_id: submission the file belongs to
+        file_type_id: type of the file the rows are from
+        row_numbers: iterable of row numbers to look up
+
+    Returns:
+        dict mapping row number to a (header, cell) tuple, for rows that have a flex column
+    """
+    sess = GlobalDB.db().session
+    row_numbers = sorted(row_numbers)
+    flex_fields = {}
+    for start in range(0, len(row_numbers), FLEX_QUERY_SIZE):
+        query = sess.query(FlexField.row_number, FlexField.header, FlexField.cell).\
+            join(Job, Job.job_id == FlexField.job_id).\
+            filter(FlexField.submission_id == submission_id, Job.file_type_id == file_type_id,
+                   FlexField.row_number.in_(row_numbers[start:start + FLEX_QUERY_SIZE]))
+        for row_number, header, cell in query:
+            flex_fields[row_number] = (header, cell)
+    return flex_fields
+
+
+def describeFailure(cols, failure, short_to_long_dict, flex_field=None):
+    """ Build the field and value strings reported for a row that failed a rule
+
+    Args:
+        cols: columns returned by the rule, excluding row_number
+        failure: the failing row
+        short_to_long_dict: mapping of short to long schema column names
+        flex_field: (header, cell) tuple for the row's flex column, if it has one
+
+    Returns:
+        Tuple of the comma-separated field names and the comma-separated "field: value" pairs
+    """
+    fieldList = [short_to_long_dict.get(field, field) for field in cols]
+    valueList = ["{}: {}".format(name, str(failure[field])) for name, field in zip(fieldList, cols)]
+    if flex_field:
+        fieldList.append(flex_field[0])
+        valueList.append("{}: {}".format(*flex_field))
+    return ", ".join(fieldList), ", ".join(valueList)
+
+
+def _timedQuery(conn, rule, submission_id):
+    """ Run one rule's query on a session or connection
+
+    Returns:
+        Tuple of column names, failed rows and seconds taken
+    """
+    start = time.time()
+    result = conn.execute(text(rule.rule_sql.format(submission_id)))
+    cols = list(result.keys())
+    failures = result.fetchall()
+    return cols, failures, time.time() - start
+
+
+def _runOnSnapshot(engine, snapshot_id, rule, submission_id):
+    """ Run one rule's query in its own read-only transaction, reading snapshot_id if given """
+    connection = engine.connect()
+    transaction = connection.begin()
+    try:
+        if snapshot_id:
+            connection.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            connection.execute("SET TRANSACTION SNAPSHOT '{}'".format(snapshot_id))
+        return _timedQuery(connection, rule, submission_id)
+    finally:
+        transaction.rollback()
+        connection.close()
+
+
+class _SnapshotExporter:
+    """ Holds open a transaction whose snapshot other connections can import with SET TRANSACTION SNAPSHOT """
+    def __init__(self, engine):
+        self.engine = engine
+        self.connection = None
+        self.transaction = None
+
+    def export(self):
+        """ Start the transaction and return its snapshot id, or None if the database can't export one """
+        try:
+            self.connection = self.engine.connect()
+            self.transaction = self.connection.begin()
+            self.connection.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            return self.connection.execute("SELECT pg_export_snapshot()").scalar()
+        except SQLAlchemyError as e:
+            logger.warning('Could not export a snapshot for SQL rules, running them without one: %s', e)
+            self.close()
+            return None
+
+    def close(self):
+        """ End the transaction; connections that imported the snapshot keep reading it """
+        if self.transaction is not None:
+            self.transaction.rollback()
+            self.transaction = None
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
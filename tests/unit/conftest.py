@@ -9,10 +9,10 @@ import dataactcore.config
 from dataactcore.models import (    # noqa
     baseModel, domainModels, fsrs, errorModels, jobModels, stagingModels,
     userModel, validationModels)
-from dataactcore.scripts import setupJobTrackerDB, setupUserDB
+from dataactcore.scripts import setupErrorDB, setupJobTrackerDB, setupUserDB, setupValidationDB
 from dataactcore.scripts.databaseSetup import (
     createDatabase, dropDatabase, runMigrations)
-from dataactcore.interfaces.db import GlobalDB
+from dataactcore.interfaces.db import GlobalDB, disposeEngines
 
 
 @pytest.fixture(scope='session')
@@ -34,6 +34,7 @@ def full_database_setup():
     yield (db, list(reversed(creation_order)))  # drop order
 
     GlobalDB.close()
+    disposeEngines()
     dropDatabase(config['db_name'])
 
 
@@ -48,6 +49,9 @@ def database(full_database_setup):
     db.scoped_session_maker.rollback()
     for table in tables_in_drop_order:
         db.session.query(table).delete(synchronize_session=False)
+    db.session.commit()
+    # Don't let the next test's merges find instances of the rows just deleted
+    db.session.expunge_all()
 
 
 @pytest.fixture()
@@ -59,6 +63,16 @@ def user_constants(database):
     setupUserDB.insertCodes(database.session)
     database.session.commit()
 
+@pytest.fixture()
+def validation_constants(database):
+    setupValidationDB.insertCodes(database.session)
+    database.session.commit()
+
+@pytest.fixture()
+def error_constants(database):
+    setupErrorDB.insertCodes(database.session)
+    database.session.commit()
+
 @pytest.fixture()
 def mock_broker_config_paths(tmpdir):
     """Replace configured paths with temp directories which will be cleaned up
@@ -1,11 +1,17 @@
 from datetime import date, datetime
 import json
+import threading
+import time
 from unittest.mock import Mock
 
 import pytest
+from werkzeug.datastructures import ETags
 
 from dataactbroker.handlers import fileHandler
-from dataactcore.models.jobModels import JobStatus, JobType, FileType
+from dataactcore.interfaces import function_bag
+from dataactcore.interfaces.db import GlobalDB
+from dataactcore.models.jobModels import JobStatus, JobType, FileType, Submission
+from dataactcore.utils.jobNotifications import JobStatusListener
 from dataactcore.utils.responseException import ResponseException
 from tests.unit.dataactbroker.utils import add_models, delete_models
 from tests.unit.dataactcore.factories.domain import CGACFactory
@@ -154,6 +160,50 @@ def test_list_submissions_permissions(database, monkeypatch):
     assert list_submissions_result()['total'] == 1
 
 
+def test_list_submissions_cursor(database, job_constants, monkeypatch):
+    """Paging with next_cursor should walk through submissions newest first, with sizes and users filled in"""
+    sess = database.session
+    user = UserFactory(user_id=1, name='Some User', website_admin=True)
+    add_models(database, [user])
+    updated_at = datetime(2016, 10, 1)
+    # Two submissions share an updated_at, so they're ordered by submission_id
+    subs = [SubmissionFactory(submission_id=i, user_id=1 if i % 2 else None, updated_at=updated_at.replace(day=day))
+            for i, day in ((1, 1), (2, 3), (3, 2), (4, 3), (5, 4))]
+    jobs = [JobFactory(submission_id=sub.submission_id, file_size=10 * sub.submission_id,
+                       job_status=sess.query(JobStatus).filter_by(name='finished').one(),
+                       job_type=sess.query(JobType).filter_by(name='csv_record_validation').one(),
+                       file_type=sess.query(FileType).filter_by(name='award').one())
+            for sub in subs for _ in range(2)]
+    add_models(database, subs)
+    sess.add_all(jobs)
+    sess.commit()
+    monkeypatch.setattr(fileHandler, 'g', Mock(user=user))
+
+    pages, cursor = [], None
+    while True:
+        json_response = fileHandler.list_submissions(1, 2, "mixed", cursor)
+        result = json.loads(json_response.get_data().decode('UTF-8'))
+        pages.append(result)
+        cursor = result['next_cursor']
+        if cursor is None:
+            break
+
+    assert [[sub['submission_id'] for sub in page['submissions']] for page in pages] == [[5, 4], [2, 3], [1]]
+    assert pages[0]['total'] == 5
+    assert 'total' not in pages[1]
+    first = pages[0]['submissions'][0]
+    assert (first['size'], first['status'], first['user']['name']) == (100, 'validation_successful', 'Some User')
+    assert pages[0]['submissions'][1]['user']['name'] == 'No user'
+
+    # Page numbers still work
+    json_response = fileHandler.list_submissions(2, 2, "mixed")
+    result = json.loads(json_response.get_data().decode('UTF-8'))
+    assert [sub['submission_id'] for sub in result['submissions']] == [2, 3]
+
+    with pytest.raises(ResponseException):
+        fileHandler.list_submissions(1, 2, "mixed", "not a cursor")
+
+
 def test_narratives(database, job_constants):
     """Verify that we can add, retrieve, and update submission narratives. Not
     quite a unit test as it covers a few functions in sequence"""
@@ -258,3 +308,164 @@ def test_submission_bad_dates(start_date, end_date, quarter_flag, submission):
     fh = fileHandler.FileHandler(Mock())
     with pytest.raises(ResponseException):
         fh.check_submission_dates(start_date, end_date, quarter_flag, submission)
+
+
+def test_get_status_snapshot(database, job_constants, error_constants):
+    """check_status should be served from the snapshot until the submission's jobs or files change, and return 304
+    for an unchanged ETag"""
+    sess = database.session
+    sub = SubmissionFactory(submission_id=1)
+    job = JobFactory(submission_id=1, number_of_rows=5, number_of_errors=3,
+                     job_status=sess.query(JobStatus).filter_by(name='running').one(),
+                     job_type=sess.query(JobType).filter_by(name='csv_record_validation').one(),
+                     file_type=sess.query(FileType).filter_by(name='appropriations').one())
+    add_models(database, [sub, job])
+
+    response = fileHandler.get_status(sub)
+    etag = response.get_etag()[0]
+    result = json.loads(response.get_data().decode('UTF-8'))
+    assert result['number_of_rows'] == 5
+    assert [(j['job_id'], j['job_status'], j['file_status']) for j in result['jobs']] == [
+        (job.job_id, 'running', '')]
+
+    not_modified = fileHandler.get_status(sub, ETags([etag]))
+    assert not_modified.status_code == 304
+    assert not_modified.get_data() == b''
+    assert fileHandler.get_status(sub).get_data() == response.get_data()
+
+    function_bag.markFileComplete(job.job_id, 'report.csv')
+    function_bag.mark_job_status(job.job_id, 'finished')
+    response = fileHandler.get_status(sub, ETags([etag]))
+    assert response.status_code == 200
+    assert response.get_etag()[0] != etag
+    result = json.loads(response.get_data().decode('UTF-8'))
+    assert [(j['job_status'], j['file_status'], j['error_type']) for j in result['jobs']] == [
+        ('finished', 'complete', 'row_errors')]
+
+    etag = response.get_etag()[0]
+    function_bag.markSubmissionStatusChanged(job.job_id)
+    sess.commit()
+    assert fileHandler.get_status(sub, ETags([etag])).status_code == 200
+
+
+def test_wait_for_status(database, job_constants, error_constants, monkeypatch):
+    """wait_for_status should return 304 if nothing changes before the timeout, and respond as soon as a job's status
+    changes otherwise"""
+    sess = database.session
+    sub = SubmissionFactory(submission_id=1)
+    job = JobFactory(submission_id=1, job_status=sess.query(JobStatus).filter_by(name='running').one(),
+                     job_type=sess.query(JobType).filter_by(name='csv_record_validation').one(),
+                     file_type=sess.query(FileType).filter_by(name='appropriations').one())
+    add_models(database, [sub, job])
+    listener = JobStatusListener()
+    monkeypatch.setattr(fileHandler, 'job_status_listener', listener)
+
+    etag = fileHandler.get_status(sub).get_etag()[0]
+    assert fileHandler.wait_for_status(sub, ETags([etag]), timeout=0).status_code == 304
+
+    results = []
+
+    def wait():
+        # Waiting releases the thread's database connection, so use a thread other than the test's
+        submission = GlobalDB.db().session.query(Submission).filter_by(submission_id=1).one()
+        results.append(fileHandler.wait_for_status(submission, ETags([etag]), timeout=20))
+        GlobalDB.close()
+
+    try:
+        started = time.time()
+        waiter = threading.Thread(target=wait)
+        waiter.start()
+        function_bag.mark_job_status(job.job_id, 'finished')
+        waiter.join()
+    finally:
+        listener.stop()
+        listener.thread.join()
+    assert time.time() - started < 10
+    assert results[0].status_code == 200
+    assert json.loads(results[0].get_data().decode('UTF-8'))['jobs'][0]['job_status'] == 'finished'
+
+
+def test_get_status_after_reupload(database, job_constants, error_constants):
+    """Replacing a file should outdate the snapshot, so the old file's status and errors aren't reported"""
+    sess = database.session
+    sub = SubmissionFactory(submission_id=1)
+    file_type = sess.query(FileType).filter_by(name='appropriations').one()
+    upload_job = JobFactory(submission_id=1, file_type=file_type, original_filename='a.csv', filename='1/a.csv',
+                            job_status=sess.query(JobStatus).filter_by(name='running').one(),
+                            job_type=sess.query(JobType).filter_by(name='file_upload').one())
+    val_job = JobFactory(submission_id=1, file_type=file_type, original_filename='a.csv', filename='1/a.csv',
+                         file_size=None, number_of_rows=None,
+                         job_status=sess.query(JobStatus).filter_by(name='waiting').one(),
+                         job_type=sess.query(JobType).filter_by(name='csv_record_validation').one())
+    add_models(database, [sub, upload_job, val_job])
+    function_bag.markFileComplete(val_job.job_id, 'report.csv')
+    etag = fileHandler.get_status(sub).get_etag()[0]
+
+    function_bag.add_jobs_for_uploaded_file(
+        fileHandler.FileHandler.UploadFile('appropriations', '1/a.csv', 'a.csv', 'A'), 1, True)
+    sess.commit()
+    response = fileHandler.get_status(sub, ETags([etag]))
+    assert response.status_code == 200
+    assert json.loads(response.get_data().decode('UTF-8'))['jobs'][0]['file_status'] == ''
+
+
+def add_d_file_job(database, status='running'):
+    sess = database.session
+    sub = SubmissionFactory()
+    job = JobFactory(submission=sub,
+                     file_type=sess.query(FileType).filter_by(name='award_procurement').one(),
+                     job_status=sess.query(JobStatus).filter_by(name=status).one(),
+                     job_type=sess.query(JobType).filter_by(name='file_upload').one())
+    add_models(database, [sub, job])
+    return job
+
+
+def test_load_d_file_local(database, job_constants, mock_broker_config_paths, tmpdir):
+    """Local D files should be copied to the broker files directory unchanged, a chunk at a time"""
+    job = add_d_file_job(database)
+    contents = b'PIID,"Awarding, Agency"\r\n1234,"ABC ""DEF"""\r\n' * 10
+    source = tmpdir.join('d1.csv')
+    source.write_binary(contents)
+    fh = fileHandler.FileHandler(Mock(), isLocal=True)
+    fh.DOWNLOAD_CHUNK_SIZE = 7
+
+    result = fh.load_d_file(str(source), '1/d1.csv', 'd1.csv', job.job_id, True)
+    assert result == {"message": "Success", "file_name": 'd1.csv'}
+    assert mock_broker_config_paths['broker_files'].join('d1.csv').read_binary() == contents
+    database.session.refresh(job)
+    assert job.job_status.name == 'finished'
+
+
+def test_load_d_file_streamed(database, job_constants, monkeypatch):
+    """D files should be streamed from the generation API into storage without reading the whole response"""
+    job = add_d_file_job(database)
+    chunks = [b'PIID,Agency\n', b'1234,', b'ABC\n']
+    response = Mock(status_code=200)
+    response.iter_content.return_value = iter(chunks)
+    monkeypatch.setattr(fileHandler.requests, 'get', Mock(return_value=response))
+    written = []
+    monkeypatch.setattr(fileHandler, 'write_stream',
+                        lambda file_name, upload_name, is_local, body: written.append(
+                            (file_name, upload_name, is_local, list(body))))
+
+    fh = fileHandler.FileHandler(Mock(), isLocal=False)
+    fh.load_d_file('http://example.com/d1.csv', '1/d1.csv', 'd1.csv', job.job_id, False)
+    fileHandler.requests.get.assert_called_once_with('http://example.com/d1.csv', stream=True)
+    response.iter_content.assert_called_once_with(chunk_size=fh.DOWNLOAD_CHUNK_SIZE)
+    assert written == [('d1.csv', '1/d1.csv', False, chunks)]
+    response.close.assert_called_once_with()
+    database.session.refresh(job)
+    assert job.job_status.name == 'finished'
+
+    # a failed request marks the job failed without writing anything
+    job = add_d_file_job(database)
+    response = Mock(status_code=500)
+    fileHandler.requests.get.return_value = response
+    written.clear()
+    with pytest.raises(ResponseException):
+        fh.load_d_file('http://example.com/d1.csv', '1/d1.csv', 'd1.csv', job.job_id, False)
+    assert written == []
+    response.iter_content.assert_not_called()
+    database.session.refresh(job)
+    assert job.job_status.name == 'failed'
+    assert job.error_message == 'A problem occurred receiving data from FPDS'
@@ -0,0 +1,65 @@
+from unittest.mock import Mock
+
+from dataactbroker.handlers.aws.sessionStore import (
+    DatabaseSessionBackend, MemorySessionBackend, SessionStore, StoredSession, unix_now)
+from dataactcore.models.userModel import SessionMap
+
+
+def memory_store():
+    backend = MemorySessionBackend()
+    return SessionStore(Mock(wraps=backend)), backend
+
+
+def test_cached_session_not_reread():
+    store, backend = memory_store()
+    backend.put('abc', '{}', unix_now() + 100)
+    assert store.load('abc') == backend.sessions['abc']
+    assert store.load('abc') == backend.sessions['abc']
+    assert store.backend.get.call_count == 1
+    assert store.load('missing') is None
+
+
+def test_unchanged_data_not_rewritten():
+    """Extending an unchanged session shouldn't write it until the next sweep"""
+    store, backend = memory_store()
+    expiration = unix_now() + 100
+    store.save('abc', '{"a": 1}', expiration)
+    store.save('abc', '{"a": 1}', expiration)
+    assert store.backend.put.call_count == 1
+
+    store.save('abc', '{"a": 1}', expiration + 50)
+    assert store.backend.put.call_count == 1
+    assert backend.sessions['abc'].expiration == expiration
+    assert store.load('abc').expiration == expiration + 50
+
+    store.sweep()
+    assert backend.sessions['abc'] == StoredSession('{"a": 1}', expiration + 50)
+
+    store.save('abc', '{"a": 2}', expiration + 50)
+    assert store.backend.put.call_count == 2
+    assert backend.sessions['abc'].data == '{"a": 2}'
+
+
+def test_sweep_removes_expired():
+    store, backend = memory_store()
+    backend.put('old', '{}', unix_now() - 1)
+    backend.put('new', '{}', unix_now() + 100)
+    store.sweep()
+    assert list(backend.sessions) == ['new']
+
+
+def test_database_backend(database):
+    backend = DatabaseSessionBackend()
+    # session_map stores whole seconds
+    now = int(unix_now())
+    backend.put('abc', '{}', now + 100)
+    backend.put('abc', '{"a": 1}', now + 100)
+    backend.put('old', '{}', now - 100)
+    assert backend.get('abc') == StoredSession('{"a": 1}', now + 100)
+
+    backend.extend({'abc': now + 200})
+    backend.delete_expired(now)
+    assert backend.get('abc').expiration == now + 200
+    assert backend.get('old') is None
+    database.session.query(SessionMap).delete()
+    database.session.commit()
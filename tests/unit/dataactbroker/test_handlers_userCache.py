@@ -0,0 +1,83 @@
+from unittest.mock import Mock
+
+from sqlalchemy import event
+
+from dataactbroker import permissions
+from dataactbroker.handlers import userCache
+from dataactbroker.handlers.userCache import UserCache
+from tests.unit.dataactcore.factories.domain import CGACFactory
+from tests.unit.dataactcore.factories.user import UserFactory
+
+
+def test_load_queries_once(database, user_constants, monkeypatch):
+    """Users should be loaded with their affiliations in one query, then served from the cache"""
+    cgacs = [CGACFactory(cgac_code='ABC'), CGACFactory(cgac_code='DEF')]
+    user = UserFactory.with_cgacs(*cgacs)
+    database.session.add_all(cgacs + [user])
+    database.session.commit()
+    user_id = user.user_id
+    database.session.expunge_all()
+
+    cache = UserCache()
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+    event.listen(database.engine, 'before_cursor_execute', record)
+    try:
+        loaded = cache.load(user_id)
+        assert {aff.cgac.cgac_code for aff in loaded.affiliations} == {'ABC', 'DEF'}
+        assert len(statements) == 1
+
+        database.session.expunge_all()
+        loaded = cache.load(user_id)
+        monkeypatch.setattr(permissions, 'g', Mock(user=loaded))
+        assert permissions.current_user_can('reader', 'DEF')
+        assert not permissions.current_user_can('writer', 'DEF')
+        assert len(statements) == 1
+        assert loaded in database.session
+    finally:
+        event.remove(database.engine, 'before_cursor_execute', record)
+
+
+def test_invalidate(monkeypatch):
+    query_user = Mock(return_value=None)
+    monkeypatch.setattr(userCache, 'query_user', query_user)
+    cache = UserCache()
+    assert cache.load(1) is None
+    assert cache.load(1) is None
+    assert query_user.call_count == 1
+
+    cache.invalidate(1)
+    cache.load(1)
+    assert query_user.call_count == 2
+
+    expired = UserCache(ttl=0)
+    expired.load(1)
+    expired.load(1)
+    assert query_user.call_count == 4
+
+
+def test_invalidate_on_commit(database, user_constants, monkeypatch):
+    """Users should only be dropped from the cache once their changes commit, while permissions already worked out
+    for the user object are dropped straight away"""
+    cgac = CGACFactory(cgac_code='ABC')
+    user = UserFactory.with_cgacs(cgac)
+    database.session.add_all([cgac, user])
+    database.session.commit()
+
+    cache = UserCache()
+    invalidate = Mock()
+    monkeypatch.setattr(cache, 'invalidate', invalidate)
+    assert permissions.cgac_permissions(user) == {'ABC': user.affiliations[0].permission_type_id}
+
+    user.affiliations = []
+    cache.invalidate_on_commit(user)
+    assert permissions.cgac_permissions(user) == {}
+    database.session.flush()
+    assert not invalidate.called
+
+    database.session.commit()
+    invalidate.assert_called_once_with(user.user_id)
+    database.session.commit()
+    assert invalidate.call_count == 1
@@ -0,0 +1,29 @@
+import hashlib
+import io
+from unittest.mock import Mock
+
+import pytest
+
+from dataactcore.aws import s3UrlHandler as s3_module
+from dataactcore.aws.s3UrlHandler import s3UrlHandler
+
+
+def mock_key(monkeypatch, contents, etag):
+    stream = io.BytesIO(contents)
+    key = Mock(etag='"{}"'.format(etag), read=Mock(side_effect=stream.read))
+    connection = Mock()
+    connection.get_bucket.return_value.get_key.return_value = key
+    monkeypatch.setattr(s3_module.boto.s3, 'connect_to_region', Mock(return_value=connection))
+    monkeypatch.setattr(s3UrlHandler, 'HASH_CHUNK_SIZE', 5)
+    return key
+
+
+@pytest.mark.parametrize('etag', ['{}', 'f3b6e1f0a9c2d4e8b7a6c5d4e3f2a1b0-3'])
+def test_get_file_hash(monkeypatch, etag):
+    """A file's hash should be its MD5 whether it was uploaded in one part, so its ETag is the MD5, or several"""
+    contents = b'allocationtransferagencyidentifier,agencyidentifier\n,097\n'
+    md5 = hashlib.md5(contents).hexdigest()
+    key = mock_key(monkeypatch, contents, etag.format(md5))
+
+    assert s3UrlHandler.getFileHash('1/a.csv') == md5
+    assert key.read.called == ('-' in etag)
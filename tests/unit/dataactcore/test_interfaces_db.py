@@ -0,0 +1,48 @@
+import threading
+
+from flask import Flask
+
+from dataactcore.interfaces import db as db_module
+from dataactcore.interfaces.db import GlobalDB
+
+
+def test_engine_reused_across_requests(database):
+    """Each app context gets its own session, but they all share one engine"""
+    app = Flask(__name__)
+    engines, sessions = [], []
+    for _ in range(2):
+        with app.app_context():
+            request_db = GlobalDB.db()
+            engines.append(request_db.engine)
+            sessions.append(request_db.session)
+            GlobalDB.close()
+    assert engines[0] is engines[1] is database.engine
+    assert sessions[0] is not sessions[1]
+
+
+def test_fallback_is_per_thread(database):
+    """Outside of an app context, each thread should get its own session"""
+    results = []
+
+    def use_db():
+        thread_db = GlobalDB.db()
+        results.append((thread_db.engine, thread_db.session))
+        GlobalDB.close()
+
+    thread = threading.Thread(target=use_db)
+    thread.start()
+    thread.join()
+    engine, session = results[0]
+    assert engine is database.engine
+    assert session is not database.session
+    assert GlobalDB.db() is database
+
+
+def test_pool_settings(monkeypatch):
+    monkeypatch.setitem(db_module.CONFIG_DB, 'pool', {
+        'validator': {'pool_size': 7, 'pool_recycle': 3600, 'echo': True}})
+    monkeypatch.setattr(GlobalDB, 'process_type', 'validator')
+    assert db_module.poolSettings() == {'pool_size': 7, 'max_overflow': 50, 'pool_recycle': 3600}
+
+    monkeypatch.setattr(GlobalDB, 'process_type', 'celery')
+    assert db_module.poolSettings() == db_module.DEFAULT_POOL_SETTINGS
@@ -0,0 +1,207 @@
+from unittest.mock import Mock
+
+import pytest
+from sqlalchemy import or_
+
+from dataactcore.interfaces import function_bag
+from dataactcore.interfaces.function_bag import (check_job_dependencies, create_jobs, get_cross_file_pair,
+                                                 populateSubmissionErrorInfo, reset_cross_file_jobs)
+from dataactcore.models.errorModels import ErrorMetadata
+from dataactcore.models.jobModels import FileType, Job, JobDependency, JobStatus, JobType
+from dataactcore.models.lookups import FILE_TYPE_DICT, JOB_STATUS_DICT, JOB_TYPE_DICT, RULE_SEVERITY_DICT
+from dataactbroker.handlers.fileHandler import FileHandler
+from tests.unit.dataactcore.factories.job import JobFactory, SubmissionFactory
+
+
+def test_populate_submission_error_info(database, validation_constants):
+    """Job and submission totals should be summed from error_metadata, per severity"""
+    sess = database.session
+    submission = SubmissionFactory(number_of_errors=99, number_of_warnings=99)
+    other_submission = SubmissionFactory()
+    jobs = [JobFactory(submission=submission) for _ in range(3)]
+    other_job = JobFactory(submission=other_submission)
+    sess.add_all([submission, other_submission] + jobs + [other_job])
+    sess.commit()
+
+    fatal, warning = RULE_SEVERITY_DICT['fatal'], RULE_SEVERITY_DICT['warning']
+    sess.add_all([
+        ErrorMetadata(job_id=jobs[0].job_id, occurrences=3, severity_id=fatal),
+        ErrorMetadata(job_id=jobs[0].job_id, occurrences=4, severity_id=fatal),
+        ErrorMetadata(job_id=jobs[0].job_id, occurrences=5, severity_id=warning),
+        ErrorMetadata(job_id=jobs[1].job_id, occurrences=6, severity_id=warning),
+        ErrorMetadata(job_id=other_job.job_id, occurrences=10, severity_id=fatal)
+    ])
+    sess.commit()
+
+    populateSubmissionErrorInfo(submission.submission_id)
+
+    job_totals = [(job.number_of_errors, job.number_of_warnings)
+                  for job in sess.query(Job).filter_by(submission_id=submission.submission_id).order_by(Job.job_id)]
+    assert job_totals == [(7, 5), (0, 6), (0, 0)]
+    assert (submission.number_of_errors, submission.number_of_warnings) == (7, 11)
+
+
+def test_check_job_dependencies_file_size(database, job_constants, monkeypatch, tmpdir):
+    """A validation job's file size should be recorded when it becomes ready, so job workers can schedule it"""
+    sess = database.session
+    monkeypatch.setitem(function_bag.CONFIG_BROKER, 'use_aws', False)
+    monkeypatch.setitem(function_bag.CONFIG_JOB_QUEUE, 'backend', 'postgres')
+    upload_file = tmpdir.join('appropriations.csv')
+    upload_file.write('a' * 1234)
+    file_type = sess.query(FileType).filter_by(name='appropriations').one()
+    upload_job = JobFactory(job_status=sess.query(JobStatus).filter_by(name='finished').one(),
+                            job_type=sess.query(JobType).filter_by(name='file_upload').one(), file_type=file_type)
+    val_job = JobFactory(job_status=sess.query(JobStatus).filter_by(name='waiting').one(),
+                         job_type=sess.query(JobType).filter_by(name='csv_record_validation').one(),
+                         file_type=file_type, submission=upload_job.submission, filename=str(upload_file),
+                         file_size=None)
+    sess.add_all([upload_job, val_job])
+    sess.commit()
+    sess.add(JobDependency(job_id=val_job.job_id, prerequisite_id=upload_job.job_id))
+    sess.commit()
+
+    check_job_dependencies(upload_job.job_id)
+    assert val_job.job_status.name == 'ready'
+    assert val_job.file_size == 1234
+
+    # the celery backend doesn't schedule by size, so shouldn't look it up
+    monkeypatch.setitem(function_bag.CONFIG_JOB_QUEUE, 'backend', 'celery')
+    monkeypatch.setattr(function_bag, 'get_file_size', Mock())
+    monkeypatch.setattr('dataactcore.utils.jobQueue.enqueue', Mock())
+    val_job.job_status_id = JOB_STATUS_DICT['waiting']
+    val_job.file_size = None
+    sess.commit()
+    check_job_dependencies(upload_job.job_id)
+    assert val_job.job_status.name == 'ready'
+    assert val_job.file_size is None
+    function_bag.get_file_size.assert_not_called()
+
+
+def test_create_jobs_cross_file_pairs(database, job_constants):
+    """Each pair of files should get a cross-file job depending on both files, which the submission's cross-file job
+    waits for. Replacing a file should only reset the pairs it's in"""
+    sess = database.session
+    submission = SubmissionFactory()
+    sess.add(submission)
+    sess.commit()
+    upload_files = [FileHandler.UploadFile('appropriations', 'a.csv', 'a.csv', 'A'),
+                    FileHandler.UploadFile('program_activity', 'b.csv', 'b.csv', 'B'),
+                    FileHandler.UploadFile('award_financial', 'c.csv', 'c.csv', 'C')]
+    create_jobs(upload_files, submission)
+    sess.commit()
+
+    jobs = sess.query(Job).filter_by(submission_id=submission.submission_id)
+    pair_jobs = jobs.filter_by(job_type_id=JOB_TYPE_DICT['cross_file_pair']).order_by(Job.job_id).all()
+    pairs = {tuple(file_type.name for file_type in get_cross_file_pair(job.job_id)): job for job in pair_jobs}
+    assert list(pairs) == [('appropriations', 'program_activity'), ('appropriations', 'award_financial'),
+                           ('program_activity', 'award_financial')]
+    cross_file_job = jobs.filter_by(job_type_id=JOB_TYPE_DICT['validation']).one()
+    prerequisites = {dep.prerequisite_id for dep in sess.query(JobDependency).filter_by(job_id=cross_file_job.job_id)}
+    assert {job.job_id for job in pair_jobs} <= prerequisites
+
+    for job in pair_jobs:
+        job.job_status_id = JOB_STATUS_DICT['finished']
+    sess.commit()
+    create_jobs(upload_files[1:2], submission, existing_submission=True)
+    sess.commit()
+    assert {names: job.job_status.name for names, job in pairs.items()} == {
+        ('appropriations', 'program_activity'): 'waiting',
+        ('appropriations', 'award_financial'): 'finished',
+        ('program_activity', 'award_financial'): 'waiting'
+    }
+
+
+def remove_pair_jobs(sess, submission):
+    """Make a submission look like one made before there were pair jobs"""
+    pair_jobs = sess.query(Job).filter_by(submission_id=submission.submission_id,
+                                          job_type_id=JOB_TYPE_DICT['cross_file_pair'])
+    pair_job_ids = [job.job_id for job in pair_jobs]
+    sess.query(JobDependency).filter(or_(JobDependency.job_id.in_(pair_job_ids),
+                                         JobDependency.prerequisite_id.in_(pair_job_ids))).\
+        delete(synchronize_session=False)
+    pair_jobs.delete(synchronize_session=False)
+    sess.commit()
+    return pair_jobs
+
+
+def test_create_jobs_adds_pairs_to_existing_submission(database, job_constants):
+    """Replacing a file in a submission made before there were pair jobs should create them"""
+    sess = database.session
+    submission = SubmissionFactory()
+    sess.add(submission)
+    sess.commit()
+    upload_files = [FileHandler.UploadFile('appropriations', 'a.csv', 'a.csv', 'A'),
+                    FileHandler.UploadFile('program_activity', 'b.csv', 'b.csv', 'B')]
+    create_jobs(upload_files, submission)
+    pair_jobs = remove_pair_jobs(sess, submission)
+
+    create_jobs(upload_files[:1], submission, existing_submission=True)
+    sess.commit()
+    assert [[file_type.name for file_type in get_cross_file_pair(job.job_id)] for job in pair_jobs] == [
+        ['appropriations', 'program_activity']]
+
+
+@pytest.mark.parametrize('cross_file_status, unchanged_status', [('finished', 'finished'), ('failed', 'ready')])
+def test_create_jobs_adds_unchanged_pairs_to_existing_submission(database, job_constants, monkeypatch,
+                                                                 cross_file_status, unchanged_status):
+    """Pairs of unchanged files added to a submission made before there were pair jobs have nothing to wait for, so
+    should be finished if the cross-file job already checked them, or started otherwise"""
+    sess = database.session
+    monkeypatch.setattr(function_bag, 'dispatch_job', Mock())
+    submission = SubmissionFactory()
+    sess.add(submission)
+    sess.commit()
+    upload_files = [FileHandler.UploadFile('appropriations', 'a.csv', 'a.csv', 'A'),
+                    FileHandler.UploadFile('program_activity', 'b.csv', 'b.csv', 'B'),
+                    FileHandler.UploadFile('award_financial', 'c.csv', 'c.csv', 'C')]
+    create_jobs(upload_files, submission)
+    pair_jobs = remove_pair_jobs(sess, submission)
+    jobs = sess.query(Job).filter_by(submission_id=submission.submission_id)
+    for job in jobs:
+        job.job_status_id = JOB_STATUS_DICT['finished']
+    jobs.filter_by(job_type_id=JOB_TYPE_DICT['validation']).one().job_status_id = JOB_STATUS_DICT[cross_file_status]
+    sess.commit()
+
+    create_jobs(upload_files[:1], submission, existing_submission=True)
+    sess.commit()
+    pairs = {tuple(file_type.name for file_type in get_cross_file_pair(job.job_id)): job for job in pair_jobs}
+    assert {names: job.job_status.name for names, job in pairs.items()} == {
+        ('appropriations', 'program_activity'): 'waiting',
+        ('appropriations', 'award_financial'): 'waiting',
+        ('program_activity', 'award_financial'): unchanged_status
+    }
+    dispatched = [call[0][0] for call in function_bag.dispatch_job.call_args_list]
+    assert dispatched == ([pairs[('program_activity', 'award_financial')].job_id] if unchanged_status == 'ready'
+                          else [])
+
+
+def test_reset_cross_file_jobs(database, job_constants):
+    """Regenerating a file should only put the cross-file jobs it affects back in the queue"""
+    sess = database.session
+    submission = SubmissionFactory()
+    sess.add(submission)
+    sess.commit()
+    create_jobs([FileHandler.UploadFile('appropriations', 'a.csv', 'a.csv', 'A'),
+                 FileHandler.UploadFile('program_activity', 'b.csv', 'b.csv', 'B'),
+                 FileHandler.UploadFile('award_procurement', 'd1.csv', 'd1.csv', 'D1')], submission)
+    jobs = sess.query(Job).filter_by(submission_id=submission.submission_id)
+    for job in jobs:
+        job.job_status_id = JOB_STATUS_DICT['finished']
+    sess.commit()
+    d1_job = jobs.filter_by(job_type_id=JOB_TYPE_DICT['csv_record_validation'],
+                            file_type_id=FILE_TYPE_DICT['award_procurement']).one()
+
+    reset_cross_file_jobs(submission.submission_id, [d1_job.job_id])
+    sess.commit()
+    statuses = {job.job_type.name: job.job_status.name for job in jobs.filter(Job.job_type_id.in_([
+        JOB_TYPE_DICT['csv_record_validation'], JOB_TYPE_DICT['validation'], JOB_TYPE_DICT['external_validation']]))}
+    statuses.update({tuple(file_type.letter for file_type in get_cross_file_pair(job.job_id)): job.job_status.name
+                     for job in jobs.filter_by(job_type_id=JOB_TYPE_DICT['cross_file_pair'])})
+    assert statuses == {
+        'csv_record_validation': 'finished',
+        ('A', 'B'): 'finished',
+        ('A', 'D1'): 'waiting',
+        ('B', 'D1'): 'waiting',
+        'validation': 'waiting',
+        'external_validation': 'waiting'
+    }
@@ -6,7 +6,7 @@ from unittest.mock import Mock
 from celery.exceptions import MaxRetriesExceededError, Retry
 import pytest
 
-from dataactcore.models.jobModels import FileType, JobStatus, JobType
+from dataactcore.models.jobModels import FileType, Job, JobStatus, JobType
 from dataactcore.utils import fileE, jobQueue
 from tests.unit.dataactcore.factories.staging import (
     AwardFinancialAssistanceFactory, AwardProcurementFactory)
@@ -25,9 +25,7 @@ def test_generate_f_file(monkeypatch, mock_broker_config_paths):
     system"""
     fileF_mock = Mock()
     monkeypatch.setattr(jobQueue, 'fileF', fileF_mock)
-    fileF_mock.generate_f_rows.return_value = [
-        dict(key4='a', key11='b'), dict(key4='c', key11='d')
-    ]
+    fileF_mock.generate_f_rows.return_value = iter([['a', 'b'], ['c', 'd']])
 
     fileF_mock.mappings = OrderedDict(
         [('key4', 'mapping4'), ('key11', 'mapping11')])
@@ -38,16 +36,6 @@ def test_generate_f_file(monkeypatch, mock_broker_config_paths):
     jobQueue.generate_f_file(1, 1, 'uniq1', 'uniq1', is_local=True)
     assert read_file_rows(file_path) == expected
 
-    # re-order
-    fileF_mock.mappings = OrderedDict(
-        [('key11', 'mapping11'), ('key4', 'mapping4')])
-    file_path = str(mock_broker_config_paths['broker_files'].join('uniq2'))
-    expected = [['key11', 'key4'], ['b', 'a'], ['d', 'c']]
-
-    monkeypatch.setattr(jobQueue, 'mark_job_status', Mock())
-    jobQueue.generate_f_file(1, 1, 'uniq2', 'uniq2', is_local=True)
-    assert read_file_rows(file_path) == expected
-
 
 def test_generate_e_file_query(monkeypatch, mock_broker_config_paths,
                                database):
@@ -182,3 +170,36 @@ def test_job_context_retry(database, job_constants):
 
     sess.refresh(job)
     assert job.job_status.name == 'running'     # still going
+
+
+def test_enqueue_validate_in_worker(database, job_constants, monkeypatch):
+    """With validate_in_worker set, jobs should be validated in the worker
+    rather than sent to the validator, and failures recorded on the job"""
+    from dataactvalidator.validation_handlers import validationManager
+
+    sess = database.session
+    job = JobFactory(
+        job_status=sess.query(JobStatus).filter_by(name='ready').one(),
+        job_type=sess.query(JobType).filter_by(name='csv_record_validation').one(),
+        file_type=sess.query(FileType).filter_by(name='appropriations').one(),
+        filename=None
+    )
+    sess.add(job)
+    sess.commit()
+    job_id = job.job_id
+
+    monkeypatch.setitem(jobQueue.CONFIG_JOB_QUEUE, 'validate_in_worker', True)
+    monkeypatch.setattr(jobQueue, 'requests', Mock())
+    validate_job_id = Mock()
+    monkeypatch.setattr(validationManager.ValidationManager,
+                        'validate_job_id', validate_job_id)
+
+    assert jobQueue.enqueue(job_id) == {'message': 'Validation complete'}
+    validate_job_id.assert_called_once_with(job_id)
+    assert not jobQueue.requests.post.called
+
+    validate_job_id.side_effect = Exception('This failed!')
+    assert jobQueue.enqueue(job_id) == {'message': 'This failed!'}
+    job = sess.query(Job).filter_by(job_id=job_id).one()
+    sess.refresh(job)
+    assert job.job_status.name == 'failed'
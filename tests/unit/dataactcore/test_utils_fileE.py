@@ -1,6 +1,15 @@
 from copy import deepcopy
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import re
+from socketserver import ThreadingMixIn
+import threading
+import time
 from unittest.mock import Mock
 
+import pytest
+
+from dataactcore.models.domainModels import ExecutiveCompensation
 from dataactcore.utils import fileE
 
 
@@ -98,6 +107,7 @@ def test_retrieveRows(monkeypatch):
     """Mock out a response from the SAM API and spot check several of the
     components that built it up"""
     monkeypatch.setattr(fileE, 'CONFIG_BROKER', _VALID_CONFIG)
+    monkeypatch.setattr(fileE, '_thread_clients', threading.local())
     mock_result = Mock(
         listOfEntities=Mock(
             entity=[
@@ -153,3 +163,323 @@ def test_retrieveRows(monkeypatch):
     assert auth.password == _VALID_CONFIG['sam']['password']
     assert search.DUNSList.DUNSNumber == ['duns1', 'duns2']
     assert params.coreData.value == 'Y'
+
+
+_SAM_NS = 'http://sam.example.com/entity'
+_SAM_WSDL = """<?xml version="1.0" encoding="UTF-8"?>
+<definitions xmlns="http://schemas.xmlsoap.org/wsdl/"
+    xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/"
+    xmlns:xsd="http://www.w3.org/2001/XMLSchema"
+    xmlns:tns="{ns}" targetNamespace="{ns}">
+  <types>
+    <xsd:schema targetNamespace="{ns}" elementFormDefault="qualified">
+      <xsd:complexType name="userAuthenticationKeyType">
+        <xsd:sequence>
+          <xsd:element name="userID" type="xsd:string"/>
+          <xsd:element name="password" type="xsd:string"/>
+        </xsd:sequence>
+      </xsd:complexType>
+      <xsd:complexType name="DUNSList">
+        <xsd:sequence>
+          <xsd:element name="DUNSNumber" type="xsd:string"
+                       maxOccurs="unbounded"/>
+        </xsd:sequence>
+      </xsd:complexType>
+      <xsd:complexType name="entitySearchCriteriaType">
+        <xsd:sequence>
+          <xsd:element name="DUNSList" type="tns:DUNSList"/>
+        </xsd:sequence>
+      </xsd:complexType>
+      <xsd:complexType name="dataFlagType">
+        <xsd:simpleContent>
+          <xsd:extension base="xsd:string">
+            <xsd:attribute name="version" type="xsd:string"/>
+          </xsd:extension>
+        </xsd:simpleContent>
+      </xsd:complexType>
+      <xsd:complexType name="requestedData">
+        <xsd:sequence>
+          <xsd:element name="coreData" type="tns:dataFlagType"/>
+        </xsd:sequence>
+      </xsd:complexType>
+      <xsd:complexType name="globalParentDUNSType">
+        <xsd:sequence>
+          <xsd:element name="DUNSNumber" type="xsd:string"/>
+          <xsd:element name="legalBusinessName" type="xsd:string"/>
+        </xsd:sequence>
+      </xsd:complexType>
+      <xsd:complexType name="DUNSInformationType">
+        <xsd:sequence>
+          <xsd:element name="globalParentDUNS"
+                       type="tns:globalParentDUNSType"/>
+        </xsd:sequence>
+      </xsd:complexType>
+      <xsd:complexType name="executiveCompensationDetailType">
+        <xsd:sequence>
+          <xsd:element name="name" type="xsd:string"/>
+          <xsd:element name="compensation" type="xsd:float"/>
+        </xsd:sequence>
+      </xsd:complexType>
+      <xsd:complexType name="executiveCompensationListType">
+        <xsd:sequence>
+          <xsd:element name="executiveCompensationDetail"
+                       type="tns:executiveCompensationDetailType"
+                       minOccurs="0" maxOccurs="unbounded"/>
+        </xsd:sequence>
+      </xsd:complexType>
+      <xsd:complexType name="coreDataType">
+        <xsd:sequence>
+          <xsd:element name="DUNSInformation" type="tns:DUNSInformationType"/>
+          <xsd:element name="listOfExecutiveCompensationInformation"
+                       type="tns:executiveCompensationListType"/>
+        </xsd:sequence>
+      </xsd:complexType>
+      <xsd:complexType name="entityIdentificationType">
+        <xsd:sequence>
+          <xsd:element name="DUNS" type="xsd:string"/>
+        </xsd:sequence>
+      </xsd:complexType>
+      <xsd:complexType name="entityType">
+        <xsd:sequence>
+          <xsd:element name="entityIdentification"
+                       type="tns:entityIdentificationType"/>
+          <xsd:element name="coreData" type="tns:coreDataType"/>
+        </xsd:sequence>
+      </xsd:complexType>
+      <xsd:complexType name="listOfEntitiesType">
+        <xsd:sequence>
+          <xsd:element name="entity" type="tns:entityType"
+                       minOccurs="0" maxOccurs="unbounded"/>
+        </xsd:sequence>
+      </xsd:complexType>
+      <xsd:complexType name="transactionInformationType">
+        <xsd:sequence>
+          <xsd:element name="transactionMessage" type="xsd:string"
+                       minOccurs="0"/>
+        </xsd:sequence>
+      </xsd:complexType>
+      <xsd:complexType name="entitiesResultType">
+        <xsd:sequence>
+          <xsd:element name="transactionInformation"
+                       type="tns:transactionInformationType"/>
+          <xsd:element name="listOfEntities" type="tns:listOfEntitiesType"
+                       minOccurs="0"/>
+        </xsd:sequence>
+      </xsd:complexType>
+      <xsd:element name="getEntities">
+        <xsd:complexType>
+          <xsd:sequence>
+            <xsd:element name="userAuthenticationKey"
+                         type="tns:userAuthenticationKeyType"/>
+            <xsd:element name="entitySearchCriteria"
+                         type="tns:entitySearchCriteriaType"/>
+            <xsd:element name="requestedData" type="tns:requestedData"/>
+          </xsd:sequence>
+        </xsd:complexType>
+      </xsd:element>
+      <xsd:element name="getEntitiesResponse">
+        <xsd:complexType>
+          <xsd:sequence>
+            <xsd:element name="getEntitiesResult"
+                         type="tns:entitiesResultType"/>
+          </xsd:sequence>
+        </xsd:complexType>
+      </xsd:element>
+    </xsd:schema>
+  </types>
+  <message name="getEntitiesRequest">
+    <part name="parameters" element="tns:getEntities"/>
+  </message>
+  <message name="getEntitiesResponse">
+    <part name="parameters" element="tns:getEntitiesResponse"/>
+  </message>
+  <portType name="EntityPortType">
+    <operation name="getEntities">
+      <input message="tns:getEntitiesRequest"/>
+      <output message="tns:getEntitiesResponse"/>
+    </operation>
+  </portType>
+  <binding name="EntityBinding" type="tns:EntityPortType">
+    <soap:binding style="document"
+                  transport="http://schemas.xmlsoap.org/soap/http"/>
+    <operation name="getEntities">
+      <soap:operation soapAction="getEntities"/>
+      <input><soap:body use="literal"/></input>
+      <output><soap:body use="literal"/></output>
+    </operation>
+  </binding>
+  <service name="EntityService">
+    <port name="EntityPort" binding="tns:EntityBinding">
+      <soap:address location="{url}"/>
+    </port>
+  </service>
+</definitions>
+"""
+_SAM_ENTITY = """
+<entity>
+  <entityIdentification><DUNS>{duns}</DUNS></entityIdentification>
+  <coreData>
+    <DUNSInformation><globalParentDUNS>
+      <DUNSNumber>P{duns}</DUNSNumber>
+      <legalBusinessName>Parent of {duns}</legalBusinessName>
+    </globalParentDUNS></DUNSInformation>
+    <listOfExecutiveCompensationInformation>
+      <executiveCompensationDetail>
+        <name>Officer of {duns}</name><compensation>1000.5</compensation>
+      </executiveCompensationDetail>
+    </listOfExecutiveCompensationInformation>
+  </coreData>
+</entity>"""
+_SAM_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">
+  <soap:Body>
+    <getEntitiesResponse xmlns="{ns}"><getEntitiesResult>
+      <transactionInformation><transactionMessage/></transactionInformation>
+      <listOfEntities>{entities}</listOfEntities>
+    </getEntitiesResult></getEntitiesResponse>
+  </soap:Body>
+</soap:Envelope>"""
+
+
+class SamStandIn(BaseHTTPRequestHandler):
+    """A local stand-in for the SAM SOAP API, serving its WSDL and answering
+    getEntities with an entity for each DUNS number requested. Keeps track of
+    how many times the WSDL's fetched, and how many requests are in flight"""
+    wsdl_fetches = 0
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        type(self).wsdl_fetches += 1
+        self.respond(_SAM_WSDL.format(ns=_SAM_NS, url=self.server.url))
+
+    def do_POST(self):
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+        dunsList = re.findall(r'<[^/>]*DUNSNumber>([^<]*)</', body)
+        # Answer later chunks first, to check results are put back in order
+        time.sleep(0.3 if dunsList[0] < '0100' else 0.1)
+        with cls.lock:
+            cls.in_flight -= 1
+        entities = ''.join(_SAM_ENTITY.format(duns=duns) for duns in dunsList)
+        self.respond(_SAM_RESPONSE.format(ns=_SAM_NS, entities=entities))
+
+    def respond(self, content):
+        content = content.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def sam_stand_in(monkeypatch):
+    """Point file E's SAM config at a local stand-in for the API"""
+    class Handler(SamStandIn):
+        wsdl_fetches = in_flight = max_in_flight = 0
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.url = 'http://127.0.0.1:{}/entity'.format(server.server_port)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    config = deepcopy(_VALID_CONFIG)
+    config['sam']['wsdl'] = server.url + '?wsdl'
+    config['sam']['workers'] = 4
+    monkeypatch.setattr(fileE, 'CONFIG_BROKER', config)
+    monkeypatch.setattr(fileE, '_thread_clients', threading.local())
+    monkeypatch.setattr(fileE, '_executor', None)
+    yield Handler
+    if fileE._executor:
+        fileE._executor.shutdown()
+    server.shutdown()
+    server.server_close()
+
+
+def test_retrieve_all_rows(sam_stand_in):
+    """DUNS numbers should be looked up in concurrent chunks, with each worker
+    thread reusing its client, and the rows returned in order"""
+    dunsList = ['{:04}'.format(i) for i in range(350)]
+
+    rows = fileE.retrieve_all_rows(dunsList)
+
+    assert [row.AwardeeOrRecipientUniqueIdentifier for row in rows] == dunsList
+    assert rows[0] == fileE.Row(
+        '0000', 'P0000', 'Parent of 0000', 'Officer of 0000', 1000.5,
+        '', '', '', '', '', '', '', '')
+    assert 1 < sam_stand_in.max_in_flight <= 4
+    assert sam_stand_in.wsdl_fetches <= 4
+
+    # later lookups reuse the workers' clients
+    wsdl_fetches = sam_stand_in.wsdl_fetches
+    assert len(fileE.retrieve_all_rows(dunsList)) == 350
+    assert sam_stand_in.wsdl_fetches == wsdl_fetches
+
+
+def sam_row(duns):
+    return fileE.Row(duns, 'P' + duns, 'Parent of ' + duns, 'Officer', 1000.5,
+                     '', '', '', '', '', '', '', '')
+
+
+def test_retrieve_cached_rows(database, monkeypatch):
+    """Only DUNS numbers without a fresh cache entry should be looked up in
+    SAM, and what it returns for them cached"""
+    sess = database.session
+    config = deepcopy(_VALID_CONFIG)
+    config['sam']['cache_ttl'] = 24 * 60 * 60
+    monkeypatch.setattr(fileE, 'CONFIG_BROKER', config)
+    retrieveRows = Mock(side_effect=lambda dunsList: [
+        sam_row(duns) for duns in dunsList if duns != 'unknown'])
+    monkeypatch.setattr(fileE, 'retrieveRows', retrieveRows)
+    now = datetime.utcnow()
+    sess.add_all([
+        ExecutiveCompensation(duns='hit', ultimate_parent_duns='Phit',
+                              high_comp_officer1_amount='5.5', fetched_at=now),
+        ExecutiveCompensation(duns='gone', in_sam=False, fetched_at=now),
+        ExecutiveCompensation(duns='stale', ultimate_parent_duns='old',
+                              fetched_at=now - timedelta(days=2))])
+    sess.commit()
+    dunsList = ['hit', 'stale', 'new', 'unknown', 'gone']
+
+    rows = fileE.retrieve_cached_rows(dunsList)
+    assert [row.AwardeeOrRecipientUniqueIdentifier for row in rows] == [
+        'hit', 'stale', 'new']
+    assert rows[0].UltimateParentUniqueIdentifier == 'Phit'
+    assert rows[0].HighCompOfficer1Amount == '5.5'
+    assert rows[1] == sam_row('stale')
+    retrieveRows.assert_called_once_with(['stale', 'new', 'unknown'])
+
+    sess.expire_all()
+    cached = {entry.duns: entry
+              for entry in sess.query(ExecutiveCompensation)}
+    assert cached['stale'].ultimate_parent_duns == 'Pstale'
+    assert cached['new'].high_comp_officer1_amount == '1000.5'
+    assert cached['new'].high_comp_officer2_full_name == ''
+    assert not cached['unknown'].in_sam
+
+    # everything's cached now
+    retrieveRows.reset_mock()
+    rows = fileE.retrieve_cached_rows(dunsList)
+    assert [row.AwardeeOrRecipientUniqueIdentifier for row in rows] == [
+        'hit', 'stale', 'new']
+    assert rows[2] == fileE.Row('new', 'Pnew', 'Parent of new', 'Officer',
+                                '1000.5', '', '', '', '', '', '', '', '')
+    assert not retrieveRows.called
+
+
+def test_retrieve_cached_rows_invalid_config(database, monkeypatch):
+    """Without a SAM config, nothing should be cached as missing from SAM"""
+    monkeypatch.setattr(fileE, 'CONFIG_BROKER', {})
+
+    assert fileE.retrieve_cached_rows(['duns1']) == []
+    assert database.session.query(ExecutiveCompensation).count() == 0
@@ -6,6 +6,11 @@ from tests.unit.dataactcore.factories.staging import (
     AwardFinancialFactory, AwardProcurementFactory)
 
 
+def column(name):
+    """Index of a File F column in generated rows"""
+    return list(fileF.mappings).index(name)
+
+
 def test_CopyValues_procurement():
     model_row = fileF.ModelRow(None,
                                FSRSProcurementFactory(duns='DUNS'),
@@ -63,6 +68,26 @@ def test_zipcode_guard():
     assert foreign_zip == '12345'
 
 
+def test_compile_row_builder():
+    """Compiled row builders should give the same cells as each mapper"""
+    procurement_row = fileF.ModelRow(
+        procurement=FSRSProcurementFactory(),
+        subcontract=FSRSSubcontractFactory(company_address_country='USA'),
+        naics_desc='NAICS DESC')
+    grant_row = fileF.ModelRow(
+        grant=FSRSGrantFactory(),
+        subgrant=FSRSSubgrantFactory(awardee_address_country='RU'))
+
+    for model_types, model_row in (
+            (fileF.PROCUREMENT_MODELS, procurement_row),
+            (fileF.GRANT_MODELS, grant_row)):
+        expected = []
+        for mapper in fileF.mappings.values():
+            value = mapper(model_row)
+            expected.append('' if value is None else str(value))
+        assert fileF.compile_row_builder(model_types)(model_row) == expected
+
+
 def test_generate_f_rows(database, monkeypatch):
     """generate_f_rows should find and convert subaward data relevant to a
     specific submission id. We'll compare the resulting DUNs values for
@@ -98,7 +123,7 @@ def test_generate_f_rows(database, monkeypatch):
         sess.add_all(grants[fain])
     sess.commit()
 
-    actual = {result['SubAwardeeOrRecipientUniqueIdentifier']
+    actual = {result[column('SubAwardeeOrRecipientUniqueIdentifier')]
               for result in fileF.generate_f_rows(123)}
     expected = set()
     expected.update(
@@ -125,7 +150,7 @@ def test_generate_f_rows_naics_desc(database, monkeypatch):
     database.session.add_all([award, ap, proc] + other_aps)
     database.session.commit()
 
-    actual = {result['NAICS_Description']
+    actual = {result[column('NAICS_Description')]
               for result in fileF.generate_f_rows(award.submission_id)}
     assert actual == {ap.naics_description}
 
@@ -143,5 +168,31 @@ def test_generate_f_rows_false(database, monkeypatch):
     database.session.commit()
 
     results = list(fileF.generate_f_rows(award.submission_id))
-    assert results[0]['RecModelQuestion1'] == 'False'
-    assert results[0]['RecModelQuestion2'] == ''
+    assert results[0][column('RecModelQuestion1')] == 'False'
+    assert results[0][column('RecModelQuestion2')] == ''
+
+
+def test_generate_f_rows_once_per_subaward(database, monkeypatch):
+    """Each subaward should get one row, however many File C rows share its
+    award's PIID, with the NAICS description of the first matching D1 row"""
+    sess = database.session
+    award = AwardFinancialFactory(piid='PIID1')
+    other_award = AwardFinancialFactory(
+        submission_id=award.submission_id, piid='PIID1')
+    sess.add_all([award, other_award])
+    sess.commit()
+    first_ap = AwardProcurementFactory(
+        submission_id=award.submission_id, piid='PIID1', naics='123')
+    sess.add(first_ap)
+    sess.commit()
+    later_ap = AwardProcurementFactory(
+        submission_id=award.submission_id, piid='PIID1', naics='123')
+    proc = FSRSProcurementFactory(contract_number='PIID1', subawards=[
+        FSRSSubcontractFactory(naics='123'),
+        FSRSSubcontractFactory(naics='456')])
+    sess.add_all([later_ap, proc])
+    sess.commit()
+
+    results = list(fileF.generate_f_rows(award.submission_id))
+    assert sorted(row[column('NAICS_Description')] for row in results) == [
+        '', first_ap.naics_description]
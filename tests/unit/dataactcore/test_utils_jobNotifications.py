@@ -0,0 +1,63 @@
+import threading
+
+from dataactcore.interfaces.function_bag import mark_job_status
+from dataactcore.models.jobModels import JobStatus, JobType, FileType
+from dataactcore.utils.jobNotifications import JobStatusListener
+from tests.unit.dataactcore.factories.job import JobFactory, SubmissionFactory
+
+
+def test_listener_wakes_subscribers(database, job_constants):
+    """A committed status change should wake the threads waiting on that submission, and only those"""
+    sess = database.session
+    subs = [SubmissionFactory(), SubmissionFactory()]
+    sess.add_all(subs)
+    sess.commit()
+    job = JobFactory(submission_id=subs[0].submission_id,
+                     job_status=sess.query(JobStatus).filter_by(name='running').one(),
+                     job_type=sess.query(JobType).filter_by(name='csv_record_validation').one(),
+                     file_type=sess.query(FileType).filter_by(name='appropriations').one())
+    sess.add(job)
+    sess.commit()
+
+    listener = JobStatusListener()
+    try:
+        with listener.subscription(subs[0].submission_id) as changed, \
+                listener.subscription(subs[1].submission_id) as other_changed:
+            # Everyone is woken once listening starts
+            assert changed.wait(10)
+            changed.clear()
+            other_changed.clear()
+
+            mark_job_status(job.job_id, 'finished')
+            assert changed.wait(10)
+            assert not other_changed.is_set()
+            changed.clear()
+
+            # Any status change is announced, not just those made through mark_job_status
+            job.job_status = sess.query(JobStatus).filter_by(name='failed').one()
+            sess.commit()
+            assert changed.wait(10)
+            changed.clear()
+
+            job.number_of_rows = 5
+            sess.commit()
+            assert not changed.wait(1)
+        assert not listener.waiters
+    finally:
+        listener.stop()
+        listener.thread.join()
+
+
+def test_publish_ignores_malformed():
+    """Malformed notifications shouldn't wake anyone, or stop later ones from being passed on"""
+    listener = JobStatusListener()
+    changed = threading.Event()
+    # registered directly, so the listening thread isn't started
+    listener.waiters[1].add(changed)
+    listener.publish('not json')
+    listener.publish('{"job_id": 1}')
+    listener.publish('[1]')
+    assert not changed.is_set()
+
+    listener.publish('{"submission_id": 1}')
+    assert changed.is_set()
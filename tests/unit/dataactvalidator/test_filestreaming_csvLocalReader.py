@@ -0,0 +1,64 @@
+from collections import namedtuple
+
+import pytest
+
+from dataactcore.utils.responseException import ResponseException
+from dataactvalidator.filestreaming.csvLocalReader import CsvLocalReader
+
+
+Column = namedtuple('Column', ['name', 'name_short'])
+SCHEMA = [Column('a', 'a'), Column('b', 'b')]
+
+
+def read_all(tmpdir, content):
+    """Write content to a file, then read every record from it. Read errors are returned in place of records as
+    (is_finished, extra_line) tuples"""
+    csv_file = tmpdir.join('file.csv')
+    csv_file.write_binary(content)
+    reader = CsvLocalReader()
+    reader.open_file(None, None, str(csv_file), SCHEMA, None, str(tmpdir.join('error.csv')), {})
+    records = []
+    while not reader.is_finished:
+        try:
+            records.append(reader.get_next_record())
+        except ResponseException:
+            records.append((reader.is_finished, reader.extra_line))
+    reader.close()
+    return records
+
+
+def test_reads_quoted_newlines(tmpdir):
+    records = read_all(tmpdir, b'a,b\r\n1,"multi\nline"\r\n3,4')
+    assert records == [({'a': '1', 'b': 'multi\nline'}, {}), ({'a': '3', 'b': '4'}, {})]
+
+
+def test_skips_blank_lines(tmpdir):
+    records = read_all(tmpdir, b'\na|b|flex_c\n1|2|x\n\n\n3||y\n\n')
+    assert records == [({'a': '1', 'b': '2'}, {'header': 'flex_c', 'cell': 'x'}),
+                       ({'a': '3', 'b': None}, {'header': 'flex_c', 'cell': 'y'})]
+
+
+def test_wrong_number_of_fields(tmpdir):
+    records = read_all(tmpdir, b'a,b\n1,2,3\n4,5\n6\n')
+    assert records == [(False, False), ({'a': '4', 'b': '5'}, {}), (True, False)]
+
+
+def test_trailing_whitespace_line(tmpdir):
+    """A whitespace-only last line is flagged as an extra line rather than a formatting error"""
+    records = read_all(tmpdir, b'a,b\n1,2\n  \n')
+    assert records == [({'a': '1', 'b': '2'}, {}), (True, True)]
+
+
+def test_header_only(tmpdir):
+    assert read_all(tmpdir, b'a,b\n') == []
+
+
+def test_no_header(tmpdir):
+    with pytest.raises(ResponseException):
+        read_all(tmpdir, b'\n\n')
+
+
+def test_invalid_utf8(tmpdir):
+    """A row with bytes that aren't valid UTF-8 is a read error, without affecting the rows around it"""
+    records = read_all(tmpdir, b'a,b\n1,2\n3,\xff4\n5,6\n')
+    assert records == [({'a': '1', 'b': '2'}, {}), (False, False), ({'a': '5', 'b': '6'}, {})]
@@ -0,0 +1,90 @@
+from collections import namedtuple
+import io
+import re
+
+from boto.exception import S3ResponseError
+import pytest
+
+from dataactvalidator.filestreaming import csvS3Reader
+
+
+class FakeS3Key:
+    """Local stand-in for a boto S3 Key which serves ranged GETs from memory. The first `failures` requests raise
+    `error`."""
+    def __init__(self, content, failures=0, error=None):
+        self.name = 'fake-key'
+        self.content = content
+        self.size = len(content)
+        self.failures = failures
+        self.error = error or IOError('Connection reset')
+        self.ranges = []
+
+    def get_contents_as_string(self, headers):
+        start, end = re.match(r'bytes=(\d+)-(\d+)', headers['Range']).groups()
+        self.ranges.append((int(start), int(end)))
+        if self.failures:
+            self.failures -= 1
+            raise self.error
+        return self.content[int(start):int(end) + 1]
+
+
+def test_range_stream_windows():
+    """The file should be fetched in window-sized ranges"""
+    content = bytes(range(256)) * 40
+    s3_file = FakeS3Key(content)
+    stream = csvS3Reader.S3RangeStream(s3_file, window_size=4096)
+    assert io.BufferedReader(stream, 100).read() == content
+    assert s3_file.ranges == [(0, 4095), (4096, 8191), (8192, 10239)]
+    stream.close()
+
+
+def test_range_stream_retries(monkeypatch):
+    monkeypatch.setattr(csvS3Reader.S3RangeStream, 'RETRY_DELAY', 0)
+    content = b'abcdefghij'
+    s3_file = FakeS3Key(content, failures=2)
+    stream = csvS3Reader.S3RangeStream(s3_file, window_size=4, retries=2)
+    assert io.BufferedReader(stream).read() == content
+    assert s3_file.ranges == [(0, 3), (0, 3), (0, 3), (4, 7), (8, 9)]
+
+    s3_file = FakeS3Key(content, failures=2)
+    stream = csvS3Reader.S3RangeStream(s3_file, window_size=4, retries=1)
+    with pytest.raises(IOError):
+        io.BufferedReader(stream).read()
+
+
+@pytest.mark.parametrize('error, retried', [
+    (S3ResponseError(503, 'Slow Down'), True),
+    (S3ResponseError(403, 'Forbidden'), False),
+    (TypeError('not a network problem'), False),
+])
+def test_range_stream_retries_transient_errors(monkeypatch, error, retried):
+    """Only failures that might succeed on another try should be retried"""
+    monkeypatch.setattr(csvS3Reader.S3RangeStream, 'RETRY_DELAY', 0)
+    s3_file = FakeS3Key(b'abcd', failures=1, error=error)
+    stream = csvS3Reader.S3RangeStream(s3_file, window_size=4, retries=2)
+    if retried:
+        assert io.BufferedReader(stream).read() == b'abcd'
+    else:
+        with pytest.raises(type(error)):
+            io.BufferedReader(stream).read()
+    assert len(s3_file.ranges) == (2 if retried else 1)
+
+
+def test_reader_request_count(monkeypatch):
+    """Reading a file through CsvS3Reader should make one request per window, not one per 8 KB packet"""
+    Column = namedtuple('Column', ['name', 'name_short'])
+    lines = [b'a,b'] + [str(i).encode() + b',"x\ny"' for i in range(50000)]
+    s3_file = FakeS3Key(b'\r\n'.join(lines))
+    monkeypatch.setattr(csvS3Reader.CsvS3Reader, 'initialize_file', lambda *args: s3_file)
+    monkeypatch.setitem(csvS3Reader.CONFIG_BROKER, 's3_read_window_size', 64 * 1024)
+
+    reader = csvS3Reader.CsvS3Reader()
+    reader.open_file(None, None, 'file.csv', [Column('a', 'a'), Column('b', 'b')], None, 'error.csv', {})
+    records = []
+    while not reader.is_finished:
+        records.append(reader.get_next_record()[0])
+    reader.close()
+
+    assert len(records) == 50000
+    assert records[-1] == {'a': '49999', 'b': 'x\ny'}
+    assert len(s3_file.ranges) == -(-s3_file.size // (64 * 1024))
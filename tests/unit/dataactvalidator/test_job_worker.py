@@ -0,0 +1,180 @@
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+
+import pytest
+from sqlalchemy.orm import Session
+
+from dataactcore.models.jobModels import FileType, Job, JobDependency, JobStatus, JobType
+from dataactvalidator import jobWorker
+from tests.unit.dataactcore.factories.job import JobFactory, SubmissionFactory
+
+
+def add_job(sess, status='ready', job_type='csv_record_validation', **kwargs):
+    kwargs.setdefault('file_type', sess.query(FileType).filter_by(name='appropriations').one())
+    job = JobFactory(
+        job_status=sess.query(JobStatus).filter_by(name=status).one(),
+        job_type=sess.query(JobType).filter_by(name=job_type).one(),
+        **kwargs
+    )
+    sess.add(job)
+    sess.commit()
+    return job.job_id
+
+
+def job_state(sess, job_id):
+    job = sess.query(Job).filter_by(job_id=job_id).one()
+    sess.refresh(job)
+    return job.job_status.name, job.worker_id
+
+
+def test_claim_job(database, job_constants):
+    """Workers should claim ready validation jobs, oldest first if they cost the same, and nothing else"""
+    sess = database.session
+    first = add_job(sess, file_size=100)
+    second = add_job(sess, job_type='validation', file_size=100)
+    add_job(sess, job_type='file_upload')
+    add_job(sess, status='waiting')
+
+    assert jobWorker.claim_job(sess, 'worker-a') == first
+    assert job_state(sess, first) == ('running', 'worker-a')
+    assert jobWorker.claim_job(sess, 'worker-b') == second
+    assert jobWorker.claim_job(sess, 'worker-a') is None
+
+
+def test_claim_job_skips_locked(database, job_constants):
+    """A job another worker is in the middle of claiming should be passed over rather than waited on"""
+    sess = database.session
+    first = add_job(sess)
+    second = add_job(sess)
+
+    other_sess = Session(bind=database.engine)
+    try:
+        other_sess.execute('SELECT job_id FROM job WHERE job_id = :job_id FOR UPDATE', {'job_id': first})
+        assert jobWorker.claim_job(sess, 'worker-a') == second
+    finally:
+        other_sess.rollback()
+        other_sess.close()
+    assert jobWorker.claim_job(sess, 'worker-a') == first
+
+
+def test_claim_job_smallest_first(database, job_constants):
+    """Jobs should be claimed in order of estimated cost, from file size and type, until they've waited long
+    enough"""
+    sess = database.session
+    large = add_job(sess, file_size=1024 ** 3)
+    small = add_job(sess, file_size=50 * 1024)
+    # D1 rows are cheaper to validate than A's, byte for byte, so the larger D1 file goes first
+    medium_d1 = add_job(sess, file_size=3 * 1024 ** 2,
+                        file_type=sess.query(FileType).filter_by(name='award_procurement').one())
+    medium = add_job(sess, file_size=2 * 1024 ** 2)
+
+    claimed = [jobWorker.claim_job(sess, 'worker-a') for _ in range(4)]
+    assert claimed == [small, medium_d1, medium, large]
+
+    # a job which has waited long enough goes ahead of smaller ones
+    large = add_job(sess, file_size=1024 ** 3)
+    sess.query(Job).filter_by(job_id=large).update({'updated_at': datetime.utcnow() - timedelta(hours=1)})
+    sess.commit()
+    small = add_job(sess, file_size=50 * 1024)
+    assert jobWorker.claim_job(sess, 'worker-a') == large
+    assert jobWorker.claim_job(sess, 'worker-a') == small
+
+
+def test_claim_job_lanes(database, job_constants):
+    """Workers in a lane should only claim jobs of that size, cross-file jobs costing their submission's files"""
+    sess = database.session
+    sub = SubmissionFactory()
+    sess.add(sub)
+    sess.commit()
+    large = add_job(sess, file_size=200 * 1024 ** 2)
+    add_job(sess, status='finished', file_size=20 * 1024 ** 2, submission=sub)
+    add_job(sess, status='finished', file_size=20 * 1024 ** 2, submission=sub)
+    cross_file = add_job(sess, job_type='validation', submission=sub, file_type=None, file_size=None)
+    small = add_job(sess, file_size=50 * 1024)
+
+    small_lane = jobWorker.ready_job_sql('small')
+    large_lane = jobWorker.ready_job_sql('large')
+    assert jobWorker.claim_job(sess, 'worker-a', large_lane, large_job_cost=100 * 1024 ** 2) == large
+    assert jobWorker.claim_job(sess, 'worker-a', large_lane, large_job_cost=100 * 1024 ** 2) is None
+    assert jobWorker.claim_job(sess, 'worker-a', small_lane, large_job_cost=100 * 1024 ** 2) == small
+    assert jobWorker.claim_job(sess, 'worker-a', large_lane, large_job_cost=30 * 1024 ** 2) == cross_file
+
+    with pytest.raises(ValueError):
+        jobWorker.JobWorker(lane='medium')
+
+
+def test_claim_job_pair_cost(database, job_constants):
+    """A cross-file pair job should cost the weighted sizes of its own two files, not the whole submission's"""
+    sess = database.session
+    sub = SubmissionFactory()
+    sess.add(sub)
+    sess.commit()
+    file_jobs = {name: add_job(sess, status='finished', file_size=size, submission=sub,
+                               file_type=sess.query(FileType).filter_by(name=name).one())
+                 for name, size in (('appropriations', 10 * 1024 ** 2), ('program_activity', 10 * 1024 ** 2),
+                                    ('award_procurement', 500 * 1024 ** 2))}
+    pair_job = add_job(sess, job_type='cross_file_pair', submission=sub, file_size=None,
+                       file_type=sess.query(FileType).filter_by(name='appropriations').one())
+    sess.add_all([JobDependency(job_id=pair_job, prerequisite_id=file_jobs['appropriations']),
+                  JobDependency(job_id=pair_job, prerequisite_id=file_jobs['program_activity'])])
+    sess.commit()
+
+    # 40MB of A and B rows, weighted
+    large_lane = jobWorker.ready_job_sql('large')
+    assert jobWorker.claim_job(sess, 'worker-a', large_lane, large_job_cost=41 * 1024 ** 2) is None
+    assert jobWorker.claim_job(sess, 'worker-a', large_lane, large_job_cost=40 * 1024 ** 2) == pair_job
+
+
+def test_requeue_stale_jobs(database, job_constants):
+    """Running jobs should be put back in the queue once their worker stops sending heartbeats"""
+    sess = database.session
+    stale = add_job(sess, status='running', worker_id='crashed',
+                    heartbeat_at=datetime.now() - timedelta(minutes=10))
+    alive = add_job(sess, status='running', worker_id='alive')
+    manual = add_job(sess, status='running')
+    jobWorker.send_heartbeat(sess, 'alive')
+
+    assert jobWorker.requeue_stale_jobs(sess, 120, 3) == [stale]
+    assert job_state(sess, stale) == ('ready', None)
+    assert job_state(sess, alive) == ('running', 'alive')
+    assert job_state(sess, manual) == ('running', None)
+
+
+def test_requeue_stale_jobs_max_attempts(database, job_constants):
+    """A job which keeps crashing its workers should be failed rather than requeued forever"""
+    sess = database.session
+    job_id = add_job(sess)
+    long_ago = datetime.now() - timedelta(minutes=10)
+
+    for attempt in range(3):
+        assert jobWorker.claim_job(sess, 'worker-{}'.format(attempt)) == job_id
+        sess.query(Job).filter_by(job_id=job_id).update({'heartbeat_at': long_ago})
+        sess.commit()
+        assert jobWorker.requeue_stale_jobs(sess, 120, 3) == [job_id]
+
+    assert job_state(sess, job_id) == ('failed', None)
+    job = sess.query(Job).filter_by(job_id=job_id).one()
+    assert job.error_message == 'Job was abandoned by 3 job workers'
+    assert jobWorker.claim_job(sess, 'worker-a') is None
+
+
+def test_run_next_job(database, job_constants, monkeypatch):
+    """Workers should run the job they claim, then release it"""
+    sess = database.session
+    job_id = add_job(sess)
+    run_validation_job = Mock()
+    monkeypatch.setattr(jobWorker, 'run_validation_job', run_validation_job)
+    worker = jobWorker.JobWorker(worker_id='worker-a')
+
+    assert worker.run_next_job()
+    run_validation_job.assert_called_once_with(job_id)
+    assert job_state(sess, job_id) == ('running', None)
+    # a job the worker got through isn't counted against it if it's requeued later
+    assert sess.query(Job).filter_by(job_id=job_id).one().worker_attempts == 0
+    assert not worker.run_next_job()
+
+    # failures are logged rather than stopping the worker
+    job_id = add_job(sess)
+    run_validation_job.side_effect = Exception('This failed!')
+    assert worker.run_next_job()
+    assert job_state(sess, job_id) == ('running', None)
@@ -0,0 +1,21 @@
+from unittest.mock import Mock
+
+from dataactvalidator.scripts import load_executive_compensation
+from tests.unit.dataactcore.factories.staging import AwardFinancialAssistanceFactory, AwardProcurementFactory
+
+
+def test_warm_executive_compensation(database, monkeypatch):
+    """Every awardee in D1 and D2 data should be looked up through the cache, once each, in batches"""
+    sess = database.session
+    sess.add_all([AwardProcurementFactory(awardee_or_recipient_uniqu='duns1'),
+                  AwardProcurementFactory(awardee_or_recipient_uniqu='duns3'),
+                  AwardProcurementFactory(awardee_or_recipient_uniqu=None),
+                  AwardFinancialAssistanceFactory(awardee_or_recipient_uniqu='duns2'),
+                  AwardFinancialAssistanceFactory(awardee_or_recipient_uniqu='duns1')])
+    sess.commit()
+    retrieve_cached_rows = Mock(return_value=[])
+    monkeypatch.setattr(load_executive_compensation.fileE, 'retrieve_cached_rows', retrieve_cached_rows)
+
+    load_executive_compensation.warm_executive_compensation(batch_size=2)
+
+    assert [call[0][0] for call in retrieve_cached_rows.call_args_list] == [['duns1', 'duns2'], ['duns3']]
@@ -0,0 +1,70 @@
+from collections import namedtuple
+
+import pytest
+
+from dataactcore.models.lookups import FIELD_TYPE_DICT
+from dataactvalidator.filestreaming.fieldCleaner import FieldCleaner
+from dataactvalidator.validation_handlers.compiledSchema import CompiledSchema
+from dataactvalidator.validation_handlers.validationError import ValidationError
+from dataactvalidator.validation_handlers.validator import Validator
+
+
+Field = namedtuple('Field', ['name', 'name_short', 'field_types_id', 'required', 'length', 'padded_flag'])
+FIELDS = [
+    Field('Amount', 'amount', FIELD_TYPE_DICT['DECIMAL'], True, None, False),
+    Field('Count', 'count', FIELD_TYPE_DICT['INT'], False, None, False),
+    Field('Code', 'code', FIELD_TYPE_DICT['STRING'], False, 4, True),
+    Field('Flag', 'flag', FIELD_TYPE_DICT['BOOLEAN'], False, None, False),
+    Field('Name', 'name', FIELD_TYPE_DICT['STRING'], False, 5, False),
+]
+# File columns are out of schema order, with an unknown column and a flex column
+HEADER_DICTIONARY = {0: 'name', 1: None, 2: 'amount', 3: 'count', 4: 'code', 5: None, 6: 'flag'}
+FLEX_DICTIONARY = {1: 'flex_note', 5: None}
+
+
+def legacy_results(row):
+    """Run a row through the reader's dict conversion, FieldCleaner.cleanRow and Validator.validate"""
+    record = {HEADER_DICTIONARY[position]: cell or None for position, cell in enumerate(row)
+              if HEADER_DICTIONARY[position] is not None}
+    record = FieldCleaner.cleanRow(record, {field.name: field.name_short for field in FIELDS}, FIELDS)
+    schema = {field.name_short: field for field in FIELDS}
+    return record, Validator.validate(record, schema)
+
+
+@pytest.mark.parametrize('row', [
+    ['bob', 'note', '1,234.50', '12', '7', '', 'yes'],
+    ['  bob  ', '', ' 12 ', '1,000', '12345', 'x', 'maybe'],
+    ['toolongname', 'n', '', 'abc', '', '', ''],
+    ['', '', '', '', '', '', ''],
+    ['a', '', '1,2,3', '1.5', ' ', '', 'TRUE'],
+    ['a', '', 'NaN', '-4', '0001', '', '0'],
+])
+def test_matches_legacy_validation(row):
+    """The compiled schema should clean and validate rows exactly like cleanRow + validate"""
+    compiled = CompiledSchema(FIELDS, HEADER_DICTIONARY, FLEX_DICTIONARY)
+    values = compiled.clean(row)
+    legacy_record, legacy_validation = legacy_results(row)
+
+    assert compiled.to_record(values) == legacy_record
+    assert compiled.names == list(legacy_record.keys())
+    assert compiled.validate(values) == legacy_validation
+
+
+def test_get_flex():
+    compiled = CompiledSchema(FIELDS, HEADER_DICTIONARY, FLEX_DICTIONARY)
+    assert compiled.get_flex(['a', 'note', '1', '', '', '', '']) == {'header': 'flex_note', 'cell': 'note'}
+    assert compiled.get_flex(['a', '', '1', '', '', '', '']) == {'header': 'flex_note', 'cell': None}
+    assert CompiledSchema(FIELDS, HEADER_DICTIONARY, {}).get_flex(['a']) == {}
+
+
+def test_missing_required_column():
+    compiled = CompiledSchema(FIELDS, {0: 'name'}, {})
+    assert compiled.validate(compiled.clean(['x'])) == (
+        False, [['amount', ValidationError.requiredError, '', '', 'fatal']], False)
+
+
+def test_unknown_field_type():
+    """A column with a type the validator can't check should fail when the schema is compiled"""
+    fields = FIELDS + [Field('Other', 'other', 99, False, None, False)]
+    with pytest.raises(ValueError):
+        CompiledSchema(fields, {0: 'amount', 1: 'other'}, {})
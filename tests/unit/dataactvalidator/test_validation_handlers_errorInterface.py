@@ -0,0 +1,38 @@
+from dataactcore.models.errorModels import ErrorMetadata
+from dataactcore.models.lookups import ERROR_TYPE_DICT, RULE_SEVERITY_DICT
+from dataactvalidator.validation_handlers.errorInterface import ErrorInterface
+from dataactvalidator.validation_handlers.validationError import ValidationError
+
+
+def test_write_all_row_errors(database, error_constants, validation_constants):
+    """Errors should be written once per job, field and error type, with occurrences counted from the first row"""
+    fatal = RULE_SEVERITY_DICT['fatal']
+    error_list = ErrorInterface()
+    error_list.recordRowError(1, 'a.csv', 'field_a', ValidationError.typeError, 2, severity_id=fatal)
+    error_list.recordRowError(1, 'a.csv', 'field_a', ValidationError.typeError, 5, severity_id=fatal)
+    error_list.recordRowError(1, 'a.csv', 'field_a', ValidationError.requiredError, 3, severity_id=fatal)
+    error_list.recordRowError(1, 'a.csv', 'field_b', 'Rule failed message', 4, 'A1', severity_id=fatal)
+    error_list.recordRowError(1, 'a.csv', 'field_b', 'Rule failed message', 7, 'A1', severity_id=fatal)
+    error_list.recordRowError(1, 'a.csv', 'field_c', 'Field must be no longer than specified limit (5)', 6,
+                              severity_id=RULE_SEVERITY_DICT['warning'])
+    # Keys that would have collided as concatenated strings
+    error_list.recordRowError(1, 'a.csv', 'field_1', '2 rows', 8, severity_id=fatal)
+    error_list.recordRowError(1, 'a.csv', 'field_', '12 rows', 9, severity_id=fatal)
+    error_list.recordRowError(2, 'b.csv', 'field_a', ValidationError.typeError, 2, severity_id=fatal)
+    error_list.writeAllRowErrors(1)
+
+    errors = database.session.query(ErrorMetadata).order_by(ErrorMetadata.first_row).all()
+    assert [(e.job_id, e.field_name, e.error_type_id, e.occurrences, e.first_row, e.original_rule_label)
+            for e in errors] == [
+        (1, 'field_a', ERROR_TYPE_DICT['type_error'], 2, 2, None),
+        (1, 'field_a', ERROR_TYPE_DICT['required_error'], 1, 3, None),
+        (1, 'field_b', ERROR_TYPE_DICT['rule_failed'], 2, 4, 'A1'),
+        (1, 'field_c', ERROR_TYPE_DICT['length_error'], 1, 6, None),
+        (1, 'field_1', ERROR_TYPE_DICT['rule_failed'], 1, 8, None),
+        (1, 'field_', ERROR_TYPE_DICT['rule_failed'], 1, 9, None)
+    ]
+    assert errors[0].rule_failed == ValidationError.getErrorMessage(ValidationError.typeError)
+    assert errors[2].rule_failed == 'Rule failed message'
+    assert errors[3].severity_id == RULE_SEVERITY_DICT['warning']
+    assert errors[0].created_at is not None
+    assert error_list.rowErrors == {}
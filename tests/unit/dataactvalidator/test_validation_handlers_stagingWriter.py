@@ -0,0 +1,107 @@
+import csv
+from decimal import Decimal, InvalidOperation
+import os
+from unittest.mock import Mock
+
+import pytest
+
+from dataactcore.models.stagingModels import Appropriation, AwardFinancialAssistance, FlexField
+from dataactvalidator.validation_handlers.stagingWriter import StagingWriter
+
+
+def appropriation_record(row_number, **kwargs):
+    record = {'row_number': row_number, 'submission_id': 1, 'job_id': 2, 'valid_record': True,
+              'allocation_transfer_agency': None, 'agency_identifier': '097', 'beginning_period_of_availa': None,
+              'ending_period_of_availabil': None, 'availability_type_code': 'X', 'main_account_code': '0100',
+              'sub_account_code': None, 'budget_authority_appropria_cpe': '12.50'}
+    record.update(kwargs)
+    return record
+
+
+@pytest.mark.parametrize('method', StagingWriter.METHODS)
+def test_write_computes_tas(database, method):
+    """Each write method should insert every row and fill in tas the same way concatTas does"""
+    staging_writer = StagingWriter(Appropriation, method, batch_size=2)
+    assert staging_writer.write(appropriation_record(2)) == []
+    assert staging_writer.write(appropriation_record(3, sub_account_code='001')) == []
+    assert staging_writer.write(appropriation_record(4, agency_identifier='tab\there')) == []
+    assert staging_writer.flush() == []
+
+    rows = database.session.query(Appropriation).order_by(Appropriation.row_number).all()
+    assert [row.row_number for row in rows] == [2, 3, 4]
+    assert rows[0].tas == '00009700000000X0100000'
+    assert rows[1].tas == '00009700000000X0100001'
+    assert rows[2].agency_identifier == 'tab\there'
+    assert str(rows[0].budget_authority_appropria_cpe) == '12.50'
+    assert rows[0].created_at is not None
+    assert staging_writer.rows_written == 3
+
+
+@pytest.mark.parametrize('method', StagingWriter.METHODS)
+def test_write_reports_failed_rows(database, method):
+    """A row that can't be written should be reported by row number without losing the rest of its batch"""
+    staging_writer = StagingWriter(Appropriation, method)
+    staging_writer.write(appropriation_record(2))
+    staging_writer.write(appropriation_record(3, budget_authority_appropria_cpe='not a number'))
+    staging_writer.write(appropriation_record(4))
+    assert staging_writer.flush() == [3]
+
+    rows = database.session.query(Appropriation.row_number).order_by(Appropriation.row_number).all()
+    assert [row.row_number for row in rows] == [2, 4]
+
+
+def test_write_ignores_extra_columns(database):
+    """Keys that aren't columns on the staging table (e.g. unknown headers) should be dropped"""
+    staging_writer = StagingWriter(AwardFinancialAssistance)
+    staging_writer.write({'row_number': 2, 'submission_id': 1, 'job_id': 2, 'fain': 'ABC', 'not_a_column': 'x'})
+    staging_writer.write({'row_number': 3, 'submission_id': 1, 'job_id': 2, 'fain': None})
+    flex_writer = StagingWriter(FlexField)
+    flex_writer.write({'row_number': 2, 'submission_id': 1, 'job_id': 2, 'header': 'flex_a', 'cell': 'b'})
+    assert staging_writer.flush() + flex_writer.flush() == []
+
+    assert database.session.query(AwardFinancialAssistance).count() == 2
+    flex = database.session.query(FlexField).one()
+    assert (flex.row_number, flex.header, flex.cell) == (2, 'flex_a', 'b')
+
+
+# Staging columns for the headers of the integration tests' large appropriations file (None for the one that
+# isn't a column)
+LARGE_FILE_COLUMNS = [
+    'allocation_transfer_agency', 'agency_identifier', 'beginning_period_of_availa', 'ending_period_of_availabil',
+    'availability_type_code', 'main_account_code', 'sub_account_code', 'budget_authority_unobligat_fyb',
+    'budget_authority_appropria_cpe', None, 'adjustments_to_unobligated_cpe',
+    'borrowing_authority_amount_cpe', 'contract_authority_amount_cpe', 'spending_authority_from_of_cpe',
+    'other_budgetary_resources_cpe', 'budget_authority_available_cpe', 'gross_outlay_amount_by_tas_cpe',
+    'obligations_incurred_total_cpe', 'deobligations_recoveries_r_cpe', 'unobligated_balance_cpe',
+    'status_of_budgetary_resour_cpe'
+]
+
+
+def is_numeric(value):
+    try:
+        Decimal(value)
+        return True
+    except InvalidOperation:
+        return False
+
+
+def test_copy_large_file(database):
+    """The rows of a large file that pass the validator's type checks should all be written by COPY, in batches"""
+    path = os.path.join(os.path.dirname(__file__), '..', '..', 'integration', 'data', 'appropMixedLarge.csv')
+    with open(path) as f:
+        rows = list(csv.reader(f))[1:]
+    staging_writer = StagingWriter(Appropriation, StagingWriter.COPY, batch_size=1000)
+    staging_writer._write_rows = Mock(side_effect=AssertionError('fell back to row by row writes'))
+    failed_rows, valid_rows = [], 0
+    for row_number, values in enumerate(rows, start=2):
+        record = {'row_number': row_number, 'submission_id': 1, 'job_id': 2, 'valid_record': True}
+        record.update((column, value or None) for column, value in zip(LARGE_FILE_COLUMNS, values) if column)
+        if all(is_numeric(value) for column, value in record.items() if column.endswith(('_cpe', '_fyb')) and value):
+            valid_rows += 1
+            failed_rows += staging_writer.write(record)
+    failed_rows += staging_writer.flush()
+
+    assert failed_rows == []
+    assert valid_rows > 5000
+    assert staging_writer.rows_written == valid_rows
+    assert database.session.query(Appropriation).count() == valid_rows
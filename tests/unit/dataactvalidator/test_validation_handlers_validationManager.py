@@ -1,10 +1,16 @@
 from datetime import date
+from unittest.mock import Mock
 
 import pytest
 
+from dataactbroker.handlers.fileHandler import FileHandler
+from dataactcore.interfaces import function_bag
+from dataactcore.models.errorModels import ErrorMetadata, File
+from dataactcore.models.jobModels import FileType, Job, JobStatus, JobType
+from dataactcore.models.lookups import FILE_TYPE_DICT, JOB_STATUS_DICT, JOB_TYPE_DICT, RULE_SEVERITY_DICT
 from dataactvalidator.validation_handlers import validationManager
-from tests.unit.dataactcore.factories.domain import TASFactory
-from tests.unit.dataactcore.factories.job import SubmissionFactory
+from tests.unit.dataactcore.factories.domain import CGACFactory, TASFactory
+from tests.unit.dataactcore.factories.job import JobFactory, SubmissionFactory
 from tests.unit.dataactcore.factories.staging import (
     AppropriationFactory, AwardFinancialFactory,
     ObjectClassProgramActivityFactory
@@ -120,3 +126,169 @@ def test_update_tas_ids_bad_dates(database, factory):
 
     model = sess.query(model.__class__).one()   # we'll only have one entry
     assert model.tas_id is None
+
+
+def test_write_pending_errors(database):
+    """Held back errors should be written in row order, with a single write error replacing the other errors of
+    each row that couldn't be staged"""
+    manager = validationManager.ValidationManager()
+    job = Mock(job_id=1, filename='file.csv')
+    writer, warning_writer, error_list = Mock(), Mock(), Mock()
+    fatal = ['field', 'message', 'value', 'A1', 'fatal']
+    warning = ['field', 'message', 'value', 'A2', 'warning']
+    pending_errors = [(2, None), (3, [fatal]), (5, [warning]), (6, [fatal])]
+
+    error_rows = manager.writePendingErrors(pending_errors, [4, 3, 4], job, writer, warning_writer, error_list)
+
+    assert error_rows == [2, 3, 4, 6]
+    assert [call[0][0][1:3] for call in writer.write.call_args_list] == [
+        [validationManager.ValidationError.readErrorMsg, '2'],
+        [validationManager.ValidationError.writeErrorMsg, '3'],
+        [validationManager.ValidationError.writeErrorMsg, '4'],
+        ['message', '6']
+    ]
+    assert [call[0][0][2] for call in warning_writer.write.call_args_list] == ['5']
+    assert [call[0][4] for call in error_list.recordRowError.call_args_list] == [2, 3, 4, 5, 6]
+
+
+def test_run_validation_job_setup_failure(database, job_constants, monkeypatch):
+    """A failure setting up the validation should be recorded on the job, and the connection still released"""
+    sess = database.session
+    job = JobFactory(job_status=sess.query(JobStatus).filter_by(name='ready').one(),
+                     job_type=sess.query(JobType).filter_by(name='csv_record_validation').one(),
+                     file_type=sess.query(FileType).filter_by(name='appropriations').one(), filename=None)
+    sess.add(job)
+    sess.commit()
+    monkeypatch.setattr(validationManager, 'ValidationManager', Mock(side_effect=Exception('No config')))
+    close = Mock(wraps=validationManager.GlobalDB.close)
+    monkeypatch.setattr(validationManager.GlobalDB, 'close', close)
+
+    assert validationManager.run_validation_job(job.job_id) == {'message': 'No config'}
+    assert close.called
+    sess.refresh(job)
+    assert job.job_status.name == 'failed'
+
+
+def test_run_cross_file_pair_validation(database, job_constants, error_constants, validation_constants, monkeypatch,
+                                        tmpdir):
+    """A pair job should replace its pair's errors on the submission's cross-file job, leaving other pairs' alone,
+    and start the cross-file job once it's the last to finish"""
+    sess = database.session
+    monkeypatch.setitem(function_bag.CONFIG_JOB_QUEUE, 'backend', 'postgres')
+    submission = SubmissionFactory()
+    sess.add(submission)
+    sess.commit()
+    function_bag.create_jobs([FileHandler.UploadFile('appropriations', 'a.csv', 'a.csv', 'A'),
+                              FileHandler.UploadFile('program_activity', 'b.csv', 'b.csv', 'B')], submission)
+    jobs = sess.query(Job).filter_by(submission_id=submission.submission_id)
+    for job in jobs.filter(Job.job_type_id.in_([JOB_TYPE_DICT['file_upload'],
+                                                JOB_TYPE_DICT['csv_record_validation']])):
+        job.job_status_id = JOB_STATUS_DICT['finished']
+    pair_job = jobs.filter_by(job_type_id=JOB_TYPE_DICT['cross_file_pair']).one()
+    cross_file_job = jobs.filter_by(job_type_id=JOB_TYPE_DICT['validation']).one()
+    a, b, c = (FILE_TYPE_DICT[name] for name in ('appropriations', 'program_activity', 'award_financial'))
+    fatal = RULE_SEVERITY_DICT['fatal']
+    sess.add_all([ErrorMetadata(job_id=cross_file_job.job_id, file_type_id=b, target_file_type_id=a,
+                                original_rule_label='A18', severity_id=fatal, occurrences=1),
+                  ErrorMetadata(job_id=cross_file_job.job_id, file_type_id=a, target_file_type_id=c,
+                                original_rule_label='A30', severity_id=fatal, occurrences=1)])
+    sess.commit()
+    failure = ['field', 'appropriations', 'program_activity', 'message', 'values', 3, 'A19', a, b, fatal]
+    monkeypatch.setattr(validationManager.Validator, 'crossValidateSql', Mock(return_value=[failure]))
+
+    validationManager.ValidationManager(directory=str(tmpdir)).runCrossFilePairValidation(pair_job)
+
+    errors = sess.query(ErrorMetadata.original_rule_label).filter_by(job_id=cross_file_job.job_id)
+    assert sorted(label for label, in errors) == ['A19', 'A30']
+    assert tmpdir.join('submission_{}_cross_appropriations_program_activity.csv'.format(
+        submission.submission_id)).check()
+    sess.refresh(pair_job)
+    sess.refresh(cross_file_job)
+    assert pair_job.job_status.name == 'finished'
+    assert cross_file_job.job_status.name == 'ready'
+
+
+def test_run_validation_unchanged_file(database, job_constants, error_constants, validation_constants, monkeypatch,
+                                       tmpdir):
+    """A file identical to the one last validated, against the same rules and data, should keep its results rather
+    than being read again"""
+    sess = database.session
+    monkeypatch.setitem(validationManager.CONFIG_BROKER, 'use_aws', False)
+    monkeypatch.setitem(function_bag.CONFIG_BROKER, 'use_aws', False)
+    upload = tmpdir.join('appropriations.csv')
+    upload.write('allocationtransferagencyidentifier,agencyidentifier\n,097\n')
+    submission = SubmissionFactory()
+    sess.add(submission)
+    job = JobFactory(submission=submission, job_status=sess.query(JobStatus).filter_by(name='running').one(),
+                     job_type=sess.query(JobType).filter_by(name='csv_record_validation').one(),
+                     file_type=sess.query(FileType).filter_by(name='appropriations').one(),
+                     filename=str(upload), number_of_rows=2)
+    sess.add(job)
+    sess.commit()
+    job.file_hash = function_bag.get_file_hash(str(upload))
+    job.validation_version = validationManager.validation_version(job)
+    sess.add(ErrorMetadata(job_id=job.job_id, original_rule_label='A1',
+                           severity_id=RULE_SEVERITY_DICT['fatal'], occurrences=1))
+    sess.commit()
+    manager = validationManager.ValidationManager(directory=str(tmpdir))
+    monkeypatch.setattr(manager, 'getReader', Mock(side_effect=AssertionError('File was read')))
+
+    assert manager.runValidation(job)
+    sess.refresh(job)
+    assert job.job_status.name == 'finished'
+    assert job.number_of_rows == 2
+    assert job.number_of_errors == 1
+    assert sess.query(ErrorMetadata).filter_by(job_id=job.job_id).count() == 1
+    assert sess.query(File).filter_by(job_id=job.job_id).one().file_status.name == 'complete'
+
+    # a change to the domain data means the file has to be validated again
+    version = job.validation_version
+    sess.add(CGACFactory())
+    sess.commit()
+    assert validationManager.validation_version(job) != version
+
+
+def test_run_validation_reuploaded_file(database, job_constants, error_constants, validation_constants, monkeypatch,
+                                        tmpdir):
+    """Replacing a file should stop its results being reported, restoring them only once the new file is found to
+    be the same one"""
+    sess = database.session
+    monkeypatch.setitem(validationManager.CONFIG_BROKER, 'use_aws', False)
+    monkeypatch.setitem(function_bag.CONFIG_BROKER, 'use_aws', False)
+    upload = tmpdir.join('appropriations.csv')
+    upload.write('allocationtransferagencyidentifier,agencyidentifier\n,097\n')
+    submission = SubmissionFactory()
+    sess.add(submission)
+    file_type = sess.query(FileType).filter_by(name='appropriations').one()
+    upload_job = JobFactory(submission=submission, job_status=sess.query(JobStatus).filter_by(name='finished').one(),
+                            job_type=sess.query(JobType).filter_by(name='file_upload').one(), file_type=file_type)
+    job = JobFactory(submission=submission, job_status=sess.query(JobStatus).filter_by(name='finished').one(),
+                     job_type=sess.query(JobType).filter_by(name='csv_record_validation').one(),
+                     file_type=file_type, filename=str(upload), number_of_rows=2)
+    sess.add_all([upload_job, job])
+    sess.commit()
+    job.file_hash = function_bag.get_file_hash(str(upload))
+    job.validation_version = validationManager.validation_version(job)
+    sess.add(ErrorMetadata(job_id=job.job_id, original_rule_label='A1', field_name='agencyidentifier',
+                           severity_id=RULE_SEVERITY_DICT['fatal'], occurrences=1, first_row=2))
+    sess.commit()
+
+    function_bag.add_jobs_for_uploaded_file(
+        FileHandler.UploadFile('appropriations', str(upload), 'appropriations.csv', 'A'),
+        submission.submission_id, True)
+    sess.commit()
+    sess.refresh(job)
+    assert job.number_of_rows is None
+    assert sess.query(ErrorMetadata).filter_by(job_id=job.job_id).count() == 0
+
+    job.job_status_id = JOB_STATUS_DICT['running']
+    sess.commit()
+    manager = validationManager.ValidationManager(directory=str(tmpdir))
+    monkeypatch.setattr(manager, 'getReader', Mock(side_effect=AssertionError('File was read')))
+    assert manager.runValidation(job)
+    sess.refresh(job)
+    assert job.number_of_rows == 2
+    assert job.number_of_errors == 1
+    assert job.previous_results is None
+    error = sess.query(ErrorMetadata).filter_by(job_id=job.job_id).one()
+    assert (error.original_rule_label, error.field_name, error.first_row) == ('A1', 'agencyidentifier', 2)
@@ -0,0 +1,88 @@
+import pytest
+
+from dataactcore.models.jobModels import Job
+from dataactcore.models.lookups import FILE_TYPE_DICT, JOB_TYPE_DICT, RULE_SEVERITY_DICT
+from dataactcore.models.stagingModels import FlexField
+from dataactcore.models.validationModels import RuleSql
+from dataactvalidator.validation_handlers import validator
+from dataactvalidator.validation_handlers.validator import Validator
+from tests.unit.dataactcore.factories.staging import AppropriationFactory
+
+
+def add_rules(sess, count):
+    """Add count appropriations rules; rule i fails rows whose row_number is a multiple of i + 1"""
+    rules = []
+    for i in range(count):
+        rules.append(RuleSql(
+            rule_sql='SELECT row_number, agency_identifier FROM appropriation '
+                     'WHERE submission_id = {{}} AND row_number % {} = 0'.format(i + 1),
+            rule_label='A{}'.format(i), rule_description='rule', rule_error_message='error {}'.format(i),
+            rule_cross_file_flag=False, file_id=FILE_TYPE_DICT['appropriations'],
+            rule_severity_id=RULE_SEVERITY_DICT['fatal'], query_name='a{}'.format(i)))
+    sess.add_all(rules)
+    sess.commit()
+
+
+@pytest.mark.parametrize('snapshot', (True, False))
+def test_parallel_rules_match_sequential(database, job_constants, validation_constants, monkeypatch, snapshot):
+    """Running SQL rules on several connections should give the same errors, in the same order, as running
+    them one at a time"""
+    sess = database.session
+    add_rules(sess, 6)
+    sess.add_all([AppropriationFactory(submission_id=1, row_number=row, agency_identifier='{:03}'.format(row))
+                  for row in range(2, 14)])
+    sess.commit()
+
+    monkeypatch.setitem(validator.CONFIG_SERVICES, 'sql_rule_workers', 1)
+    sequential = Validator.validateFileBySql(1, 'appropriations', {'agency_identifier': 'AgencyIdentifier'})
+    monkeypatch.setitem(validator.CONFIG_SERVICES, 'sql_rule_workers', 4)
+    monkeypatch.setitem(validator.CONFIG_SERVICES, 'sql_rule_snapshot', snapshot)
+    parallel = Validator.validateFileBySql(1, 'appropriations', {'agency_identifier': 'AgencyIdentifier'})
+
+    assert parallel == sequential
+    assert [error[4] for error in parallel] == ['A0'] * 12 + ['A1'] * 6 + ['A2'] * 4 + ['A3'] * 3 + ['A4'] * 2 + \
+        ['A5'] * 2
+    assert parallel[0][:4] == ['AgencyIdentifier', 'error 0', 'AgencyIdentifier: 002', 2]
+
+
+def test_snapshot_shared_by_workers(database):
+    """Every worker should read the exported snapshot, not data committed after it"""
+    sess = database.session
+    exporter = validator._SnapshotExporter(database.engine)
+    snapshot_id = exporter.export()
+    sess.add(AppropriationFactory(submission_id=1, row_number=2))
+    sess.commit()
+    rule = RuleSql(rule_sql='SELECT row_number FROM appropriation WHERE submission_id = {}')
+
+    _, snapshot_rows, _ = validator._runOnSnapshot(database.engine, snapshot_id, rule, 1)
+    _, current_rows, _ = validator._runOnSnapshot(database.engine, None, rule, 1)
+    exporter.close()
+    assert len(snapshot_rows) == 0
+    assert len(current_rows) == 1
+
+
+def test_flex_fields_for_failed_rows(database, job_constants, validation_constants):
+    """Failures should include the flex column from the file being validated, looked up only for failing rows"""
+    sess = database.session
+    add_rules(sess, 2)
+    jobs = {file_type: Job(submission_id=None, file_type_id=FILE_TYPE_DICT[file_type],
+                           job_type_id=JOB_TYPE_DICT['csv_record_validation'])
+            for file_type in ('appropriations', 'award_financial')}
+    sess.add_all(jobs.values())
+    sess.flush()
+    sess.add_all([AppropriationFactory(submission_id=1, row_number=row, agency_identifier='097') for row in (2, 3)])
+    sess.add_all([
+        FlexField(submission_id=1, job_id=jobs['appropriations'].job_id, row_number=2, header='flex_a', cell='x'),
+        FlexField(submission_id=1, job_id=jobs['award_financial'].job_id, row_number=3, header='flex_b', cell='y')
+    ])
+    sess.commit()
+
+    assert validator.getFlexFieldsByRow(1, FILE_TYPE_DICT['appropriations'], [2, 3]) == {2: ('flex_a', 'x')}
+    assert validator.getFlexFieldsByRow(1, FILE_TYPE_DICT['appropriations'], [3]) == {}
+
+    errors = Validator.validateFileBySql(1, 'appropriations', {})
+    assert [(error[0], error[2], error[3]) for error in errors] == [
+        ('agency_identifier, flex_a', 'agency_identifier: 097, flex_a: x', 2),
+        ('agency_identifier', 'agency_identifier: 097', 3),
+        ('agency_identifier, flex_a', 'agency_identifier: 097, flex_a: x', 2)
+    ]